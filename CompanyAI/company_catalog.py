@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Columnar in-memory copy of all_companies for the read endpoints in app.py.
+
+Catalog keeps one numpy array per numeric column and one UTF-8 blob plus
+offsets per text column, so a ServingCache snapshot can map it back without
+parsing (see serving_cache.py). Rows are stored in the order of the search
+endpoint (monthly_visits DESC, NULLs first). The other orders are index
+arrays computed once per load.
+
+Each query method gives the same rows as the SQL it replaces, as tuples in
+the order of its `fields`, or returns None when it cannot be answered here
+and the caller should run the SQL:
+
+* search(): LOWER(col) LIKE '%query%' over name, website, description,
+  vertical and subvertical, plus the min_visits, vertical and location
+  filters. The lower-cased text is computed by Postgres at load time. A
+  search is one bytes.find() pass over that blob, stopping at `limit` hits.
+  Because rows are ordered by visits, it usually stops early. Queries with
+  LIKE wildcards or non-ASCII text go to SQL.
+* reached_out(): reached_out rows by reached_out_date DESC (the
+  reached-out list).
+* page(): the /companies order (monthly_visits DESC NULLS LAST, name ASC),
+  ranked by Postgres so collation ties match.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from projection import REACHED_OUT_FIELDS, SEARCH_FIELDS
+from serving_cache import Blob, Section
+
+TEXT_COLUMNS = ("name", "website", "vertical", "subvertical", "description", "location", "response_status")
+
+CATALOG_SQL = """
+SELECT id, name, website, vertical, subvertical, description, location, response_status,
+       monthly_visits, unique_visitors, pages_per_visit::float8, adsense_enabled,
+       reached_out, reached_out_date,
+       lower(concat_ws(chr(1), name, website, description, vertical, subvertical)) || chr(1),
+       lower(vertical), lower(location),
+       row_number() OVER (ORDER BY monthly_visits DESC NULLS LAST, name ASC)
+FROM all_companies
+ORDER BY monthly_visits DESC NULLS FIRST, id
+"""
+
+EPOCH = datetime(1970, 1, 1)
+_LIKE_SPECIAL = ("%", "_", "\\", "\x01")
+
+
+class _TextColumn:
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = [0]
+        self.nulls = []
+
+    def append(self, value: Optional[str]) -> None:
+        if value is not None:
+            self.data += value.encode()
+        self.offsets.append(len(self.data))
+        self.nulls.append(value is None)
+
+
+def _micros(value: datetime) -> int:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def _servable(*texts: Optional[str]) -> bool:
+    """True if Python's lower() and substring search match Postgres LOWER/LIKE for these inputs."""
+    return all(not t or (t.isascii() and not any(c in t for c in _LIKE_SPECIAL)) for t in texts)
+
+
+class Catalog:
+    def __init__(self, arrays: Dict[str, Any], verticals: List[str]):
+        self.arrays = arrays
+        self.size = len(arrays["id"])
+        self.verticals = verticals
+        self._vertical_codes = {v: i for i, v in enumerate(verticals)}
+        self._null_visits = int(np.count_nonzero(arrays["monthly_visits_null"]))
+
+    # ---- Building and (de)serializing ----
+
+    @classmethod
+    def from_rows(cls, rows) -> "Catalog":
+        text = {name: _TextColumn() for name in TEXT_COLUMNS + ("search", "location_key")}
+        ids, visits, uniques, ppv, adsense, reached, reached_date, ranks, codes = ([] for _ in range(9))
+        vertical_codes: Dict[str, int] = {}
+        for row in rows:
+            for name, value in zip(TEXT_COLUMNS, row[1:8]):
+                text[name].append(value)
+            ids.append(row[0])
+            visits.append(row[8])
+            uniques.append(row[9])
+            ppv.append(row[10])
+            adsense.append(row[11])
+            reached.append(row[12])
+            reached_date.append(row[13])
+            text["search"].append(row[14])
+            codes.append(-1 if row[15] is None else vertical_codes.setdefault(row[15], len(vertical_codes)))
+            text["location_key"].append(row[16])
+            ranks.append(row[17])
+
+        arrays: Dict[str, Any] = {"id": np.array(ids, dtype=np.int64)}
+        for name, column in text.items():
+            arrays[name] = Blob(bytes(column.data))
+            arrays[f"{name}_offsets"] = np.array(column.offsets, dtype=np.int64)
+            if name in TEXT_COLUMNS:
+                arrays[f"{name}_null"] = np.array(column.nulls, dtype=bool)
+        for name, values in (("monthly_visits", visits), ("unique_visitors", uniques)):
+            arrays[f"{name}_null"] = np.array([v is None for v in values], dtype=bool)
+            arrays[name] = np.array([v or 0 for v in values], dtype=np.int64)
+        arrays["pages_per_visit"] = np.array([np.nan if v is None else v for v in ppv], dtype=np.float64)
+        for name, values in (("adsense_enabled", adsense), ("reached_out", reached)):
+            arrays[name] = np.array([-1 if v is None else int(v) for v in values], dtype=np.int8)
+        arrays["reached_out_date_null"] = np.array([v is None for v in reached_date], dtype=bool)
+        arrays["reached_out_date"] = np.array([0 if v is None else _micros(v) for v in reached_date], dtype=np.int64)
+        arrays["vertical_code"] = np.array(codes, dtype=np.int32)
+        arrays["page_order"] = np.argsort(np.array(ranks, dtype=np.int64), kind="stable").astype(np.int32)
+
+        # reached_out = true by reached_out_date DESC; Postgres puts NULLs first
+        members = np.flatnonzero(arrays["reached_out"] == 1)
+        dated = ~arrays["reached_out_date_null"][members]
+        arrays["reached_out_order"] = members[
+            np.lexsort((-arrays["reached_out_date"][members], dated))
+        ].astype(np.int32)
+        return cls(arrays, sorted(vertical_codes, key=vertical_codes.get))
+
+    def dump(self) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        return {"verticals": self.verticals}, self.arrays
+
+    @classmethod
+    def restore(cls, meta: Dict[str, Any], arrays: Dict[str, Any]) -> "Catalog":
+        return cls(arrays, meta["verticals"])
+
+    # ---- Row access ----
+
+    def text(self, name: str, i: int) -> Optional[str]:
+        null = self.arrays.get(f"{name}_null")
+        if null is not None and null[i]:
+            return None
+        offsets = self.arrays[f"{name}_offsets"]
+        return self.arrays[name].slice(int(offsets[i]), int(offsets[i + 1])).decode()
+
+    def value(self, name: str, i: int) -> Any:
+        if name in TEXT_COLUMNS:
+            return self.text(name, i)
+        arrays = self.arrays
+        if name in ("monthly_visits", "unique_visitors"):
+            return None if arrays[f"{name}_null"][i] else int(arrays[name][i])
+        if name == "pages_per_visit":
+            v = float(arrays[name][i])
+            return None if v != v else v
+        if name in ("adsense_enabled", "reached_out"):
+            v = int(arrays[name][i])
+            return None if v < 0 else bool(v)
+        if name == "reached_out_date":
+            if arrays["reached_out_date_null"][i]:
+                return None
+            return EPOCH + timedelta(microseconds=int(arrays[name][i]))
+        return int(arrays[name][i])
+
+    def rows(self, indexes: Sequence[int], fields: Sequence[str]) -> List[Tuple[Any, ...]]:
+        return [tuple(self.value(name, i) for name in fields) for i in indexes]
+
+    # ---- Queries ----
+
+    def _candidates(self, query: str, start: int, end: int, code: Optional[int]) -> Iterator[int]:
+        codes = self.arrays["vertical_code"]
+        if not query:
+            if code is None:
+                yield from range(start, end)
+            else:
+                yield from (start + np.flatnonzero(codes[start:end] == code)).tolist()
+            return
+        needle = query.lower().encode()
+        blob, offsets = self.arrays["search"], self.arrays["search_offsets"]
+        pos, stop = int(offsets[start]), int(offsets[end])
+        while True:
+            hit = blob.find(needle, pos, stop)
+            if hit < 0:
+                return
+            i = int(np.searchsorted(offsets, hit, side="right")) - 1
+            if code is None or codes[i] == code:
+                yield i
+            pos = int(offsets[i + 1])
+
+    def search(self, query: str, limit: int, min_visits: Optional[int] = None,
+               vertical: Optional[str] = None, location: Optional[str] = None,
+               fields: Sequence[str] = SEARCH_FIELDS) -> Optional[List[Tuple[Any, ...]]]:
+        if limit < 0 or not _servable(query, vertical, location):
+            return None
+        start, end = 0, self.size
+        if min_visits:
+            start = self._null_visits
+            end = start + int(np.count_nonzero(self.arrays["monthly_visits"][start:] >= min_visits))
+        code = None
+        if vertical:
+            code = self._vertical_codes.get(vertical.lower())
+            if code is None:
+                return []
+        needle = location.lower().encode() if location else None
+        loc_blob, loc_offsets = self.arrays["location_key"], self.arrays["location_key_offsets"]
+
+        found: List[int] = []
+        if limit:
+            for i in self._candidates(query, start, end, code):
+                if needle is not None and loc_blob.find(needle, int(loc_offsets[i]), int(loc_offsets[i + 1])) < 0:
+                    continue
+                found.append(i)
+                if len(found) >= limit:
+                    break
+        return self.rows(found, fields)
+
+    def reached_out(self, limit: int, vertical: Optional[str] = None,
+                    fields: Sequence[str] = REACHED_OUT_FIELDS) -> Optional[List[Tuple[Any, ...]]]:
+        if limit < 0 or not _servable(vertical):
+            return None
+        order = self.arrays["reached_out_order"]
+        if vertical:
+            order = order[self.arrays["vertical_code"][order] == self._vertical_codes.get(vertical.lower(), -2)]
+        return self.rows(order[:limit].tolist(), fields)
+
+    def page(self, limit: int, offset: int,
+             fields: Sequence[str] = SEARCH_FIELDS) -> Optional[Tuple[int, List[Tuple[Any, ...]]]]:
+        if limit < 0 or offset < 0:
+            return None
+        return self.size, self.rows(self.arrays["page_order"][offset:offset + limit].tolist(), fields)
+
+
+def load_catalog(conn) -> Catalog:
+    """Read all_companies through a server-side cursor (streamed, not buffered whole)."""
+    cur = conn.cursor(name="serving_cache_catalog")
+    try:
+        cur.itersize = 5000
+        cur.execute(CATALOG_SQL)
+        return Catalog.from_rows(cur)
+    finally:
+        cur.close()
+
+
+CATALOG_SECTION = Section(
+    name="catalog",
+    tables=("all_companies",),
+    load=load_catalog,
+    dump=Catalog.dump,
+    restore=Catalog.restore,
+    version=2,
+)
@@ -8,19 +8,36 @@ Supports moving companies between 'interested' and 'reached_out' lists.
 
 import os
 import json
-from typing import List, Optional, Dict, Any
+import threading
+from typing import TYPE_CHECKING, List, Optional, Dict, Any
 from datetime import datetime, date
 from dataclasses import dataclass
 
 import psycopg2
-from psycopg2.extras import RealDictCursor, execute_values
-from fastapi import FastAPI, HTTPException, Depends
+from psycopg2.extras import execute_values
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-import openai
 from dotenv import load_dotenv
 
+from data_versions import ensure_data_versions
+from db_pool import ConnectionPool
+from domain_keys import canonical_domain, ensure_domain_key
+from fast_json import FastJSONResponse, records
+from growth_signals import SIGNAL_COLUMNS, SIGNAL_ORDER, ensure_growth_table
+from http_cache import CompressionMiddleware, db_validators, not_modified
+from list_events import ListEventHub, notify
+import metrics
+from serving_cache import Section, ServingCache
+from stats_snapshot import refresh_stats_snapshot_safely
+import warmup
+
+if TYPE_CHECKING:
+    import openai  # imported on first use: it is most of this module's import time
+
 load_dotenv()
+warmup.mark("imports")
 
 app = FastAPI(title="Company Management API", version="1.0.0")
 
@@ -32,6 +49,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(metrics.MetricsMiddleware, name="core", router=app.router)
 
 # Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -58,6 +77,23 @@ class CompanyResponse(BaseModel):
     bounce_rate: Optional[float]
     similarity_score: Optional[float]
 
+class TrendingCompany(BaseModel):
+    company_id: int
+    domain: str
+    name: Optional[str]
+    country: Optional[str]
+    industry: Optional[str]
+    month: date
+    visits: Optional[float]
+    pages_per_visit: Optional[float]
+    bounce_rate: Optional[float]
+    visits_mom: Optional[float]
+    visits_3m: Optional[float]
+    pages_per_visit_mom: Optional[float]
+    pages_per_visit_3m: Optional[float]
+    bounce_rate_mom: Optional[float]
+    bounce_rate_3m: Optional[float]
+
 class ListOperationRequest(BaseModel):
     domain: str
     user: str = "system"
@@ -67,29 +103,166 @@ class ListResponse(BaseModel):
     total: int
     page: int
     per_page: int
+    next_cursor: Optional[str] = None
+
+# Database connection; conn.close() returns it to the pool
+db_pool = ConnectionPool(lambda: psycopg2.connect(PG_DSN))
 
-# Database connection
 def get_db_connection():
     try:
-        conn = psycopg2.connect(PG_DSN)
-        return conn
+        return db_pool.getconn()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database connection failed: {str(e)}")
 
-# OpenAI client
-def get_openai_client():
+def get_db():
+    """Request-scoped connection, returned to the pool after the response"""
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+# OpenAI client, built once on first use (or by the warm-up)
+_openai_client = None
+_openai_lock = threading.Lock()
+
+def get_openai_client() -> "openai.OpenAI":
+    global _openai_client
     if not OPENAI_API_KEY:
         raise HTTPException(status_code=500, detail="OpenAI API key not configured")
-    return openai.OpenAI(api_key=OPENAI_API_KEY)
+    if _openai_client is None:
+        with _openai_lock:
+            if _openai_client is None:
+                import openai
+                _openai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
+    return _openai_client
+
+# Current members of every list (company ids, newest first), snapshotted to
+# disk and checked against the database on each read (serving_cache.py)
+def load_list_members(conn) -> Dict[str, Any]:
+    import numpy as np
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT l.slug, array_remove(array_agg(lmc.company_id ORDER BY lmc.added_at DESC, lmc.company_id), NULL)
+            FROM lists l
+            LEFT JOIN list_members_current lmc ON lmc.list_id = l.list_id
+            GROUP BY l.slug
+        """)
+        return {slug: np.array(ids, dtype=np.int64) for slug, ids in cur.fetchall()}
+
+# Tables behind GET /lists/{slug}; their versions make its ETag
+LIST_PAGE_TABLES = ("lists", "list_memberships", "companies", "company_metrics_monthly")
+
+def cursor_position(members, cursor: str) -> int:
+    """
+    Index after a list cursor ("<index>.<company_id>" of the last company
+    seen). The company is looked up again if the list changed since; if it
+    was removed, paging resumes at its old index.
+    """
+    try:
+        index, company_id = (int(part) for part in cursor.split("."))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor!r}")
+    if 0 <= index < len(members) and members[index] == company_id:
+        return index + 1
+    found = (members == company_id).nonzero()[0]
+    if found.size:
+        return int(found[0]) + 1
+    return min(max(index, 0), len(members))
+
+list_cache = ServingCache("core")
+list_cache.register(Section(
+    "list_members", ("lists", "list_memberships"), load_list_members,
+    dump=lambda members: (sorted(members), members),
+    restore=lambda slugs, arrays: {slug: arrays[slug] for slug in slugs},
+))
+
+def _ensure_list_versions():
+    conn = get_db_connection()
+    try:
+        ensure_data_versions(conn, LIST_PAGE_TABLES)
+    finally:
+        conn.close()
+
+def _ensure_company_keys():
+    """The list write endpoints look companies up by companies.domain_key"""
+    conn = get_db_connection()
+    try:
+        ensure_domain_key(conn, "companies")
+    finally:
+        conn.close()
+
+# Company rows as GET /lists/{slug} returns them, in the order of the ids
+LIST_COMPANIES_SQL = """
+    SELECT 
+        c.company_id,
+        c.domain,
+        c.name,
+        c.country,
+        c.industry,
+        c.employee_range,
+        c.tech_tags,
+        m.visits,
+        m.pages_per_visit,
+        m.avg_visit_secs,
+        m.bounce_rate,
+        NULL::float8 AS similarity_score
+    FROM unnest(%s::bigint[]) WITH ORDINALITY AS p(company_id, position)
+    JOIN companies c ON c.company_id = p.company_id
+    LEFT JOIN LATERAL (
+        SELECT * FROM company_metrics_monthly 
+        WHERE company_id = c.company_id 
+        AND country = 'WW'
+        ORDER BY month DESC 
+        LIMIT 1
+    ) m ON true
+    ORDER BY p.position
+"""
+
+def expand_list_events(company_ids: List[int]):
+    """Company payloads and current list sizes for the events of /lists/events"""
+    conn = get_db_connection()
+    try:
+        members = list_cache.fresh(conn, "list_members")
+        with conn.cursor() as cur:
+            cur.execute(LIST_COMPANIES_SQL, (company_ids,))
+            companies = {row["company_id"]: row for row in records(cur)}
+    finally:
+        conn.close()
+    return companies, {slug: len(ids) for slug, ids in members.items()}
+
+list_events = ListEventHub(lambda: psycopg2.connect(PG_DSN), expand_list_events)
+
+metrics.register_pool("core", db_pool)
+metrics.register_cache(list_cache)
+
+warmup.register("core_db_pool", db_pool.fill)
+warmup.register("list_cache", lambda: list_cache.warm(get_db_connection))
+warmup.register("data_versions", _ensure_list_versions)
+warmup.register("domain_keys", _ensure_company_keys)
+warmup.register("list_events", list_events.start)
+if OPENAI_API_KEY:
+    warmup.register("openai_client", get_openai_client)
+
+@app.on_event("startup")
+async def start_warmup():
+    warmup.start()
+
+@app.on_event("shutdown")
+async def close_db_pool():
+    list_events.close()
+    list_cache.close()
+    db_pool.close()
 
 # Utility functions
-def get_embedding(text: str, client: openai.OpenAI) -> List[float]:
+def get_embedding(text: str, client: "openai.OpenAI") -> List[float]:
     """Get embedding for text using OpenAI"""
     try:
-        response = client.embeddings.create(
-            model="text-embedding-3-small",
-            input=text
-        )
+        with metrics.observe_openai("embeddings"):
+            response = client.embeddings.create(
+                model="text-embedding-3-small",
+                input=text
+            )
         return response.data[0].embedding
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Embedding generation failed: {str(e)}")
@@ -119,8 +292,8 @@ def build_company_source_text(company_data: Dict[str, Any]) -> str:
 @app.post("/search", response_model=List[CompanyResponse])
 async def search_companies(
     request: SearchRequest,
-    db: psycopg2.extensions.connection = Depends(get_db_connection),
-    openai_client: openai.OpenAI = Depends(get_openai_client)
+    db: psycopg2.extensions.connection = Depends(get_db),
+    openai_client=Depends(get_openai_client)
 ):
     """Search companies using AI prompt and optional filters"""
     
@@ -179,29 +352,13 @@ async def search_companies(
     params.append(request.limit)
     
     try:
-        with db.cursor(cursor_factory=RealDictCursor) as cur:
+        with db.cursor() as cur:
             cur.execute(query, params)
-            results = cur.fetchall()
-            
-            companies = []
-            for row in results:
-                company = CompanyResponse(
-                    company_id=row['company_id'],
-                    domain=row['domain'],
-                    name=row['name'],
-                    country=row['country'],
-                    industry=row['industry'],
-                    employee_range=row['employee_range'],
-                    tech_tags=row['tech_tags'],
-                    visits=row['visits'],
-                    pages_per_visit=row['pages_per_visit'],
-                    avg_visit_secs=row['avg_visit_secs'],
-                    bounce_rate=row['bounce_rate'],
-                    similarity_score=1.0 - (row['distance'] or 0)  # Convert distance to similarity
-                )
-                companies.append(company)
+            companies = records(cur)
+            for company in companies:
+                company["similarity_score"] = 1.0 - (company.pop("distance") or 0)  # Convert distance to similarity
             
-            return companies
+            return FastJSONResponse(companies)
             
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
@@ -210,7 +367,8 @@ async def search_companies(
 async def add_company_to_list(
     list_slug: str,
     request: ListOperationRequest,
-    db: psycopg2.extensions.connection = Depends(get_db_connection)
+    background_tasks: BackgroundTasks,
+    db: psycopg2.extensions.connection = Depends(get_db)
 ):
     """Add a company to a specific list"""
     
@@ -225,7 +383,7 @@ async def add_company_to_list(
             list_id = list_result[0]
             
             # Get company ID
-            cur.execute("SELECT company_id FROM companies WHERE lower(domain) = lower(%s)", (request.domain,))
+            cur.execute("SELECT company_id FROM companies WHERE domain_key = %s", (canonical_domain(request.domain),))
             company_result = cur.fetchone()
             if not company_result:
                 raise HTTPException(status_code=404, detail=f"Company with domain '{request.domain}' not found")
@@ -252,8 +410,10 @@ async def add_company_to_list(
                 INSERT INTO company_status_history (company_id, from_status, to_status, changed_by)
                 VALUES (%s, %s, %s, %s)
             """, (company_id, 'none', list_slug, request.user))
+            notify(cur, "added", list_slug, company_id, request.user)
             
             db.commit()
+            background_tasks.add_task(refresh_stats_snapshot_safely, get_db_connection)
             return {"message": f"Company added to list '{list_slug}'"}
             
     except HTTPException:
@@ -266,7 +426,8 @@ async def add_company_to_list(
 async def remove_company_from_list(
     list_slug: str,
     request: ListOperationRequest,
-    db: psycopg2.extensions.connection = Depends(get_db_connection)
+    background_tasks: BackgroundTasks,
+    db: psycopg2.extensions.connection = Depends(get_db)
 ):
     """Remove a company from a specific list"""
     
@@ -281,7 +442,7 @@ async def remove_company_from_list(
             list_id = list_result[0]
             
             # Get company ID
-            cur.execute("SELECT company_id FROM companies WHERE lower(domain) = lower(%s)", (request.domain,))
+            cur.execute("SELECT company_id FROM companies WHERE domain_key = %s", (canonical_domain(request.domain),))
             company_result = cur.fetchone()
             if not company_result:
                 raise HTTPException(status_code=404, detail=f"Company with domain '{request.domain}' not found")
@@ -303,8 +464,10 @@ async def remove_company_from_list(
                 INSERT INTO company_status_history (company_id, from_status, to_status, changed_by)
                 VALUES (%s, %s, %s, %s)
             """, (company_id, list_slug, 'none', request.user))
+            notify(cur, "removed", list_slug, company_id, request.user)
             
             db.commit()
+            background_tasks.add_task(refresh_stats_snapshot_safely, get_db_connection)
             return {"message": f"Company removed from list '{list_slug}'"}
             
     except HTTPException:
@@ -317,14 +480,15 @@ async def remove_company_from_list(
 async def promote_company(
     domain: str,
     request: ListOperationRequest,
-    db: psycopg2.extensions.connection = Depends(get_db_connection)
+    background_tasks: BackgroundTasks,
+    db: psycopg2.extensions.connection = Depends(get_db)
 ):
     """Promote company from 'interested' to 'reached_out' list"""
     
     try:
         with db.cursor() as cur:
             # Get company ID
-            cur.execute("SELECT company_id FROM companies WHERE lower(domain) = lower(%s)", (domain,))
+            cur.execute("SELECT company_id FROM companies WHERE domain_key = %s", (canonical_domain(domain),))
             company_result = cur.fetchone()
             if not company_result:
                 raise HTTPException(status_code=404, detail=f"Company with domain '{domain}' not found")
@@ -356,8 +520,10 @@ async def promote_company(
                 INSERT INTO company_status_history (company_id, from_status, to_status, changed_by)
                 VALUES (%s, %s, %s, %s)
             """, (company_id, 'interested', 'reached_out', request.user))
+            notify(cur, "promoted", "reached_out", company_id, request.user, from_list="interested")
             
             db.commit()
+            background_tasks.add_task(refresh_stats_snapshot_safely, get_db_connection)
             return {"message": f"Company promoted from 'interested' to 'reached_out'"}
             
     except HTTPException:
@@ -366,98 +532,132 @@ async def promote_company(
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to promote company: {str(e)}")
 
+@app.get("/lists/events")
+async def list_events_stream(request: Request):
+    """Server-sent events for list membership changes: added, removed, promoted"""
+    return StreamingResponse(
+        list_events.stream(request.headers.get("last-event-id"), request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/lists/{list_slug}", response_model=ListResponse)
 async def get_list_companies(
     list_slug: str,
+    request: Request,
     page: int = 1,
     per_page: int = 100,
-    db: psycopg2.extensions.connection = Depends(get_db_connection)
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page; replaces page"),
+    db: psycopg2.extensions.connection = Depends(get_db)
 ):
-    """Get companies in a specific list with pagination"""
+    """Get companies in a specific list with pagination (by page or by cursor)"""
     
     try:
-        with db.cursor(cursor_factory=RealDictCursor) as cur:
-            # Get list ID
-            cur.execute("SELECT list_id FROM lists WHERE slug = %s", (list_slug,))
-            list_result = cur.fetchone()
-            if not list_result:
-                raise HTTPException(status_code=404, detail=f"List '{list_slug}' not found")
-            
-            list_id = list_result[0]
-            
-            # Get total count
-            cur.execute("""
-                SELECT COUNT(*) FROM list_members_current lmc
-                WHERE lmc.list_id = %s
-            """, (list_id,))
-            total = cur.fetchone()[0]
-            
-            # Get companies with pagination
-            offset = (page - 1) * per_page
-            cur.execute("""
-                SELECT 
-                    c.company_id,
-                    c.domain,
-                    c.name,
-                    c.country,
-                    c.industry,
-                    c.employee_range,
-                    c.tech_tags,
-                    lmc.added_at,
-                    m.visits,
-                    m.pages_per_visit,
-                    m.avg_visit_secs,
-                    m.bounce_rate
-                FROM list_members_current lmc
-                JOIN companies c ON lmc.company_id = c.company_id
-                LEFT JOIN LATERAL (
-                    SELECT * FROM company_metrics_monthly 
-                    WHERE company_id = c.company_id 
-                    AND country = 'WW'
-                    ORDER BY month DESC 
-                    LIMIT 1
-                ) m ON true
-                WHERE lmc.list_id = %s
-                ORDER BY lmc.added_at DESC
-                LIMIT %s OFFSET %s
-            """, (list_id, per_page, offset))
-            
-            results = cur.fetchall()
-            
-            companies = []
-            for row in results:
-                company = CompanyResponse(
-                    company_id=row['company_id'],
-                    domain=row['domain'],
-                    name=row['name'],
-                    country=row['country'],
-                    industry=row['industry'],
-                    employee_range=row['employee_range'],
-                    tech_tags=row['tech_tags'],
-                    visits=row['visits'],
-                    pages_per_visit=row['pages_per_visit'],
-                    avg_visit_secs=row['avg_visit_secs'],
-                    bounce_rate=row['bounce_rate']
-                )
-                companies.append(company)
+        headers = db_validators(request, db, LIST_PAGE_TABLES)
+        unchanged = not_modified(request, headers)
+        if unchanged is not None:
+            return unchanged
+        
+        members = list_cache.fresh(db, "list_members").get(list_slug)
+        if members is None:
+            raise HTTPException(status_code=404, detail=f"List '{list_slug}' not found")
+        
+        total = len(members)
+        offset = cursor_position(members, cursor) if cursor else (page - 1) * per_page
+        page_ids = members[offset:offset + per_page].tolist() if offset >= 0 and per_page > 0 else []
+        end = offset + len(page_ids)
+        next_cursor = f"{end - 1}.{page_ids[-1]}" if page_ids and end < total else None
+        
+        with db.cursor() as cur:
+            # Companies of this page, in list order
+            cur.execute(LIST_COMPANIES_SQL, (page_ids,))
             
-            return ListResponse(
-                companies=companies,
-                total=total,
-                page=page,
-                per_page=per_page
-            )
+            return FastJSONResponse({
+                "companies": records(cur),
+                "total": total,
+                "page": page,
+                "per_page": per_page,
+                "next_cursor": next_cursor
+            }, headers=headers)
             
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get list: {str(e)}")
 
+@app.get("/companies/trending", response_model=List[TrendingCompany])
+async def get_trending_companies(
+    sort_by: str = Query("visits_mom", description="Growth signal to rank by, e.g. visits_mom or visits_3m"),
+    traffic_country: str = Query("WW", description="Similarweb country the metrics are for"),
+    vertical: Optional[str] = Query(None, description="Only companies in this industry"),
+    country: Optional[str] = Query(None, description="Only companies based in this country"),
+    min_visits: Optional[int] = Query(None, description="Ignore sites below this many monthly visits"),
+    exclude_reached_out: bool = True,
+    limit: int = Query(50, ge=1, le=1000),
+    db: psycopg2.extensions.connection = Depends(get_db)
+):
+    """
+    Fastest growing companies, read from the precomputed company_growth_signals.
+    Returned as a FastJSONResponse, so response_model only documents the shape;
+    the SELECT list produces exactly the TrendingCompany fields.
+    """
+    if sort_by not in SIGNAL_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"sort_by must be one of: {', '.join(SIGNAL_COLUMNS)}")
+    direction = SIGNAL_ORDER[sort_by]
+
+    query = f"""
+    SELECT c.company_id, c.domain, c.name, c.country, c.industry, g.month,
+           g.visits, g.pages_per_visit, g.bounce_rate, {", ".join("g." + col for col in SIGNAL_COLUMNS)}
+    FROM company_growth_signals g
+    JOIN companies c ON c.company_id = g.company_id
+    WHERE g.country = %s AND g.{sort_by} IS NOT NULL
+    """
+    params: List[Any] = [traffic_country]
+    if vertical:
+        query += " AND lower(c.industry) = lower(%s)"
+        params.append(vertical)
+    if country:
+        query += " AND lower(c.country) = lower(%s)"
+        params.append(country)
+    if min_visits:
+        query += " AND g.visits >= %s"
+        params.append(min_visits)
+    if exclude_reached_out:
+        query += """
+        AND NOT EXISTS (
+            SELECT 1 FROM list_members_current lmc
+            JOIN lists l ON l.list_id = lmc.list_id
+            WHERE lmc.company_id = c.company_id AND l.slug = 'reached_out'
+        )
+        """
+    query += f" ORDER BY g.{sort_by} {direction} LIMIT %s"
+    params.append(limit)
+
+    try:
+        ensure_growth_table(db)
+        with db.cursor() as cur:
+            cur.execute(query, params)
+            return FastJSONResponse(records(cur))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get trending companies: {str(e)}")
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus metrics (metrics.py)"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 503 until the background warm-up has finished"""
+    return JSONResponse(status_code=200 if warmup.is_ready() else 503,
+                        content={**warmup.readiness(), "db_pool": db_pool.stats(),
+                                 "list_events": list_events.stats()})
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+Bulk CSV import for all_companies.
+
+Rows are parsed into typed column batches, COPYed into an UNLOGGED staging
+table and merged into all_companies with a single set-based INSERT ... SELECT.
+The column mapping is resolved once per file from the header instead of being
+looked up on every row. Unchanged files and rows are skipped before they reach
+the database (see import_fingerprints).
+
+Requires a psycopg (v3) connection.
+"""
+
+import csv
+import itertools
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, TextIO, Tuple
+
+import numpy as np
+from psycopg import sql
+
+from domain_keys import canonical_domains, ensure_domain_key
+from import_fingerprints import (
+    ChangeFilter, ensure_fingerprint_tables, file_digest, record_source, source_unchanged,
+)
+
+DEFAULT_BATCH_SIZE = 10_000
+MAX_REJECT_SAMPLES = 100
+
+# Target column -> CSV headers, in order of preference (same rules the
+# original per-row importer used).
+COLUMN_ALIASES = {
+    "name": ("Company Name", "name", "Name", "company_name"),
+    "website": ("Website", "Domain", "website", "domain"),
+    "vertical": ("Vertical", "vertical", "category"),
+    "subvertical": ("Subvertical", "subvertical"),
+    "description": ("Description", "description"),
+    "location": ("Location", "location"),
+    "monthly_visits": ("Monthly Visits", "monthly_visits"),
+    "unique_visitors": ("Unique Visitors", "unique_visitors"),
+    "visit_duration": ("Visit Duration", "visit_duration"),
+    "pages_per_visit": ("Pages / Visit", "pages_per_visit"),
+    "adsense_enabled": ("AdSense", "adsense_enabled"),
+    "us_percentage": ("US %", "us_percentage"),
+}
+
+TEXT_FIELDS = ("name", "website", "vertical", "subvertical", "description", "location", "visit_duration")
+
+# VARCHAR widths in all_companies; longer values would abort the whole COPY
+VARCHAR_LIMITS = {
+    "name": 255, "website": 255, "vertical": 255, "subvertical": 255,
+    "location": 255, "visit_duration": 50,
+}
+
+COMPANY_COLUMNS = (
+    "name", "website", "vertical", "subvertical", "description", "location",
+    "monthly_visits", "unique_visitors", "visit_duration", "pages_per_visit",
+    "adsense_enabled", "us_percentage", "reached_out", "reached_out_date", "response_status",
+    "domain_key", "import_hash",
+)
+# Outreach state belongs to the app and is never overwritten by an import
+UPDATE_COLUMNS = tuple(
+    c for c in COMPANY_COLUMNS
+    if c not in ("reached_out", "reached_out_date", "response_status", "domain_key")
+)
+STAGING_COLUMNS = ("row_no",) + COMPANY_COLUMNS
+
+STAGING_SQL = """
+CREATE UNLOGGED TABLE IF NOT EXISTS {table} (
+    row_no            BIGINT,
+    name              VARCHAR(255),
+    website           VARCHAR(255),
+    vertical          VARCHAR(255),
+    subvertical       VARCHAR(255),
+    description       TEXT,
+    location          VARCHAR(255),
+    monthly_visits    BIGINT,
+    unique_visitors   BIGINT,
+    visit_duration    VARCHAR(50),
+    pages_per_visit   NUMERIC(10,2),
+    adsense_enabled   BOOLEAN,
+    us_percentage     NUMERIC(5,2),
+    reached_out       BOOLEAN,
+    reached_out_date  TIMESTAMP,
+    response_status   VARCHAR(50),
+    domain_key        TEXT,
+    import_hash       BYTEA
+)
+"""
+
+# First occurrence of a domain in the import wins. Existing rows are updated
+# only when their import_hash differs, so unchanged rows cost no write.
+# Relies on the unique index on all_companies.domain_key.
+MERGE_SQL = """
+INSERT INTO all_companies ({columns})
+SELECT {columns}
+FROM (
+    SELECT DISTINCT ON (domain_key) *
+    FROM {table}
+    ORDER BY domain_key, row_no
+) s
+ON CONFLICT (domain_key) DO UPDATE SET {updates}
+WHERE all_companies.import_hash IS DISTINCT FROM EXCLUDED.import_hash
+"""
+
+
+@dataclass
+class ImportStats:
+    rows_parsed: int = 0
+    rows_skipped: int = 0
+    rows_rejected: int = 0
+    rows_loaded: int = 0
+    rows_unchanged: int = 0
+    parse_errors: int = 0
+    elapsed_secs: float = 0.0
+    processed_files: List[str] = field(default_factory=list)
+    files_unchanged: List[str] = field(default_factory=list)
+    reject_counts: Dict[str, int] = field(default_factory=dict)
+    reject_samples: List[Dict[str, object]] = field(default_factory=list)
+
+    def reject(self, row: int, column: str, value: Optional[str], reason: str) -> None:
+        """Record a malformed cell; only the first MAX_REJECT_SAMPLES are kept verbatim."""
+        self.reject_counts[column] = self.reject_counts.get(column, 0) + 1
+        if len(self.reject_samples) < MAX_REJECT_SAMPLES:
+            self.reject_samples.append({"row": row, "column": column, "value": value, "reason": reason})
+
+    def rejects_report(self) -> Dict[str, object]:
+        return {"by_column": self.reject_counts, "samples": self.reject_samples}
+
+    @property
+    def rows_per_sec(self) -> float:
+        return round(self.rows_parsed / self.elapsed_secs, 1) if self.elapsed_secs else 0.0
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "rows_parsed": self.rows_parsed,
+            "rows_skipped": self.rows_skipped,
+            "rows_rejected": self.rows_rejected,
+            "rows_loaded": self.rows_loaded,
+            "rows_unchanged": self.rows_unchanged,
+            "files_unchanged": self.files_unchanged,
+            "parse_errors": self.parse_errors,
+            "elapsed_secs": round(self.elapsed_secs, 3),
+            "rows_per_sec": self.rows_per_sec,
+            "rejects": self.rejects_report(),
+        }
+
+
+# ---- Parsing ----
+
+# column -> (characters removed before conversion, integer column,
+# exclusive bound implied by the column type, NUMERIC scale)
+NUMERIC_COLUMNS = {
+    "monthly_visits": (",", True, 9e18, None),
+    "unique_visitors": (",", True, 9e18, None),
+    "pages_per_visit": ("", False, 1e8, 2),
+    "us_percentage": (",%", False, 1e3, 2),
+}
+
+# Joins a whole column into one string so the cleanup runs once per column
+_CELL_SEP = "\x1f"
+_WHITESPACE = " \t\r\n\xa0"
+
+
+def parse_numeric_column(raw: List[str], strip_chars: str, integer: bool, bound,
+                         scale: Optional[int] = None) -> Tuple[list, np.ndarray]:
+    """
+    Convert a column of display strings ("7,000,000", "1,175,754,959.88",
+    "17.00%") in one pass. Separators and whitespace are removed from the
+    whole column at once and the cleaned strings are converted by NumPy.
+    Values are rounded to `scale` decimals before the bound check, since
+    Postgres rounds them for the NUMERIC column ("999.996" would overflow
+    NUMERIC(5,2)). Empty, malformed and out-of-range cells become 0; the
+    latter two are flagged in the returned boolean mask.
+    """
+    joined = _CELL_SEP.join(raw)
+    for ch in strip_chars + _WHITESPACE:
+        joined = joined.replace(ch, "")
+    cells = joined.split(_CELL_SEP)
+    if len(cells) != len(raw):
+        # A cell contained the separator; clean cell by cell instead
+        table = str.maketrans("", "", strip_chars + _WHITESPACE)
+        cells = [cell.translate(table) for cell in raw]
+
+    try:
+        values = np.array([cell or "0" for cell in cells], dtype=np.float64)
+        bad = np.zeros(len(cells), dtype=bool)
+    except ValueError:
+        # Only columns that actually contain malformed cells take this path
+        values = np.zeros(len(cells), dtype=np.float64)
+        bad = np.zeros(len(cells), dtype=bool)
+        for i, cell in enumerate(cells):
+            try:
+                values[i] = float(cell or "0")
+            except ValueError:
+                bad[i] = True
+
+    if scale is not None:
+        values = np.round(values, scale)
+    with np.errstate(invalid="ignore"):
+        bad |= ~(np.abs(values) < bound)
+    values[bad] = 0
+    if integer:
+        return np.trunc(values).astype(np.int64).tolist(), bad
+    return values.tolist(), bad
+
+
+def resolve_columns(fieldnames: Sequence[str]) -> Dict[str, Optional[int]]:
+    """Map each target column to the index of the first matching CSV header."""
+    index = {name: i for i, name in enumerate(fieldnames)}
+    return {
+        target: next((index[alias] for alias in aliases if alias in index), None)
+        for target, aliases in COLUMN_ALIASES.items()
+    }
+
+
+def _column(rows: List[List[str]], idx: Optional[int], default, missing=None):
+    """Values of one CSV column; `missing` fills cells absent from short rows."""
+    if idx is None:
+        return [default] * len(rows)
+    return [row[idx] if idx < len(row) else missing for row in rows]
+
+
+def parse_batch(rows: List[List[str]], columns: Dict[str, Optional[int]], stats: ImportStats,
+                first_row: int = 1) -> Dict[str, list]:
+    """
+    Convert raw CSV rows into typed columns keyed by all_companies column.
+    first_row is the 1-based data-row number of rows[0], used in the rejects report.
+    """
+    batch = {name: _column(rows, columns[name], "") for name in TEXT_FIELDS}
+
+    for name, (strip_chars, integer, bound, scale) in NUMERIC_COLUMNS.items():
+        raw = _column(rows, columns[name], "", missing="")
+        batch[name], bad = parse_numeric_column(raw, strip_chars, integer, bound, scale)
+        stats.parse_errors += int(bad.sum())
+        for i in np.flatnonzero(bad).tolist():
+            stats.reject(first_row + i, name, raw[i], "malformed number")
+
+    batch["adsense_enabled"] = [
+        str(cell).lower() in ("true", "yes", "1")
+        for cell in _column(rows, columns["adsense_enabled"], "")
+    ]
+
+    batch["domain_key"] = canonical_domains(batch["website"])
+
+    # Rows without a name or website are skipped, as before; rows whose
+    # website has no usable domain or whose text is too long for its column
+    # are rejected instead of failing the COPY
+    keep = []
+    for i, (name, website) in enumerate(zip(batch["name"], batch["website"])):
+        if not name or not website:
+            stats.rows_skipped += 1
+            continue
+        if batch["domain_key"][i] is None:
+            stats.rows_rejected += 1
+            stats.reject(first_row + i, "website", website[:80], "no valid domain, row rejected")
+            continue
+        too_long = next((f for f, limit in VARCHAR_LIMITS.items() if len(batch[f][i] or "") > limit), None)
+        if too_long is None:
+            keep.append(i)
+        else:
+            stats.rows_rejected += 1
+            stats.reject(first_row + i, too_long, batch[too_long][i][:80], "value too long, row rejected")
+    if len(keep) != len(rows):
+        batch = {name: [values[i] for i in keep] for name, values in batch.items()}
+
+    count = len(keep)
+    batch["reached_out"] = [False] * count
+    batch["reached_out_date"] = [None] * count
+    batch["response_status"] = [""] * count
+    return batch
+
+
+def iter_column_batches(
+    file: TextIO, stats: ImportStats, batch_size: int = DEFAULT_BATCH_SIZE, skip_rows: int = 0,
+    max_rows: Optional[int] = None,
+) -> Iterator[Dict[str, list]]:
+    """
+    Read a CSV file and yield typed column batches of up to batch_size rows.
+
+    skip_rows data rows after the header are discarded first (used to resume
+    an import from its last committed chunk). Reading stops after max_rows
+    data rows when given.
+    """
+    reader = csv.reader(file)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = resolve_columns(header)
+    for _ in itertools.islice(reader, skip_rows):
+        pass
+    if max_rows is not None:
+        reader = itertools.islice(reader, max_rows)
+
+    first_row = skip_rows + 1
+    rows: List[List[str]] = []
+    for row in reader:
+        rows.append(row)
+        if len(rows) >= batch_size:
+            stats.rows_parsed += len(rows)
+            yield parse_batch(rows, columns, stats, first_row)
+            first_row += len(rows)
+            rows = []
+    if rows:
+        stats.rows_parsed += len(rows)
+        yield parse_batch(rows, columns, stats, first_row)
+
+
+# ---- Loading ----
+
+def create_staging_table(cur, name: Optional[str] = None) -> sql.Identifier:
+    """Create (or reuse) an empty UNLOGGED staging table; random name by default."""
+    table = sql.Identifier(name or f"all_companies_staging_{uuid.uuid4().hex[:12]}")
+    cur.execute(sql.SQL(STAGING_SQL).format(table=table))
+    cur.execute(sql.SQL("TRUNCATE {table}").format(table=table))
+    return table
+
+
+def copy_batch(cur, table: sql.Identifier, batch: Dict[str, list], first_row_no: int) -> int:
+    """COPY one column batch into the staging table; returns the rows written."""
+    count = len(batch["website"])
+    if not count:
+        return 0
+    columns = [range(first_row_no, first_row_no + count)] + [batch[name] for name in COMPANY_COLUMNS]
+    copy_sql = sql.SQL("COPY {table} ({columns}) FROM STDIN").format(
+        table=table,
+        columns=sql.SQL(", ").join(map(sql.Identifier, STAGING_COLUMNS)),
+    )
+    with cur.copy(copy_sql) as copy:
+        for row in zip(*columns):
+            copy.write_row(row)
+    return count
+
+
+def merge_staging(cur, table: sql.Identifier) -> int:
+    """Merge the staging table into all_companies; returns rows inserted or updated."""
+    cur.execute(sql.SQL("ANALYZE {table}").format(table=table))
+    cur.execute(sql.SQL(MERGE_SQL).format(
+        table=table,
+        columns=sql.SQL(", ").join(map(sql.Identifier, COMPANY_COLUMNS)),
+        updates=sql.SQL(", ").join(
+            sql.SQL("{c} = EXCLUDED.{c}").format(c=sql.Identifier(c)) for c in UPDATE_COLUMNS
+        ),
+    ))
+    return cur.rowcount
+
+
+def filter_batch(cur, changes: ChangeFilter, batch: Dict[str, list], stats: ImportStats) -> Dict[str, list]:
+    """Drop unchanged and repeated rows from a batch, counting them in stats."""
+    batch, unchanged, duplicates = changes.apply(cur, batch)
+    stats.rows_unchanged += unchanged
+    stats.rows_skipped += duplicates
+    return batch
+
+
+def merge_chunk(cur, table: sql.Identifier, batch: Dict[str, list]) -> int:
+    """COPY a batch, merge it and empty the staging table for the next one."""
+    if not batch["website"]:
+        return 0
+    copy_batch(cur, table, batch, 0)
+    loaded = merge_staging(cur, table)
+    cur.execute(sql.SQL("TRUNCATE {table}").format(table=table))
+    return loaded
+
+
+def bulk_import_csv(conn, paths: Iterable[str], batch_size: int = DEFAULT_BATCH_SIZE,
+                    force: bool = False) -> ImportStats:
+    """
+    Import the given CSV files into all_companies in one transaction.
+
+    Files identical to their last import and rows identical to what is
+    stored are skipped unless force is set. Files that cannot be read are
+    reported and skipped; rows already copied from a file that fails
+    part-way are still merged.
+    """
+    stats = ImportStats()
+    started = time.perf_counter()
+    row_no = 0
+    changes = ChangeFilter(force)
+
+    ensure_domain_key(conn, "all_companies")
+    ensure_fingerprint_tables(conn)
+    try:
+        with conn.cursor() as cur:
+            table = create_staging_table(cur)
+
+            for path in paths:
+                try:
+                    content_hash, size = file_digest(path)
+                    if not force and source_unchanged(cur, path, content_hash):
+                        print(f"Skipping unchanged CSV file: {path}")
+                        stats.files_unchanged.append(path)
+                        continue
+                    print(f"Processing CSV file: {path}")
+                    parsed_before = stats.rows_parsed
+                    with open(path, "r", encoding="utf-8", newline="") as file:
+                        for batch in iter_column_batches(file, stats, batch_size):
+                            batch = filter_batch(cur, changes, batch, stats)
+                            row_no += copy_batch(cur, table, batch, row_no)
+                    record_source(cur, path, content_hash, size, stats.rows_parsed - parsed_before)
+                    stats.processed_files.append(path)
+                except (OSError, UnicodeDecodeError, csv.Error) as file_error:
+                    print(f"Error reading file {path}: {file_error}")
+
+            stats.rows_loaded = merge_staging(cur, table)
+            cur.execute(sql.SQL("DROP TABLE {table}").format(table=table))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    stats.elapsed_secs = time.perf_counter() - started
+    print(
+        f"Imported {stats.rows_loaded} of {stats.rows_parsed} rows "
+        f"in {stats.elapsed_secs:.2f}s ({stats.rows_per_sec} rows/sec), "
+        f"{stats.rows_unchanged} rows and {len(stats.files_unchanged)} files unchanged, "
+        f"{stats.parse_errors} malformed numbers, {stats.rows_rejected} rows rejected"
+    )
+    return stats
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Streaming multipart CSV upload into an import job.
+
+The request body is fed to a push-style multipart parser as it arrives. Bytes
+of the uploaded file go through a small bounded queue to a writer thread that
+parses and loads them with the regular chunked import job (import_jobs), so
+parsing and loading overlap with the upload itself. When the writer falls
+behind, the queue fills up and the reader stops pulling from the socket, which
+applies back-pressure all the way to the client.
+
+Memory is bounded by QUEUE_DEPTH body chunks plus one parse chunk of
+UPLOAD_CHUNK_SIZE rows, independent of the file size.
+"""
+
+import asyncio
+import io
+import os
+import queue
+import threading
+from typing import Any, Callable, Dict, Optional
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from import_jobs import create_job, get_job, run_stream_job
+
+QUEUE_DEPTH = int(os.getenv("UPLOAD_QUEUE_DEPTH", "16"))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", "20000"))
+FILE_FIELD = "file"
+
+_EOF = object()
+_ABORT = object()
+
+
+class UploadError(Exception):
+    pass
+
+
+class QueueReader(io.RawIOBase):
+    """Blocking, read-only byte stream fed from a queue of byte chunks."""
+
+    def __init__(self, chunks: "queue.Queue"):
+        self._chunks = chunks
+        self._buf = b""
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buf and not self._eof:
+            chunk = self._chunks.get()
+            if chunk is _ABORT:
+                raise IOError("upload aborted by client")
+            if chunk is _EOF:
+                self._eof = True
+            else:
+                self._buf = chunk
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+
+class _FilePartSink:
+    """multipart callbacks that forward the bytes of the file field to `emit`."""
+
+    def __init__(self, emit: Callable[[bytes], None]):
+        self.emit = emit
+        self.filename: Optional[str] = None
+        self.found = False
+        self._headers: Dict[bytes, bytes] = {}
+        self._field = b""
+        self._value = b""
+        self._active = False
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._active = False
+
+    def on_header_field(self, data, start, end):
+        self._field += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field = b""
+        self._value = b""
+
+    def on_headers_finished(self):
+        _, params = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = params.get(b"name", b"").decode("utf-8", "replace")
+        # The first file part wins; later parts are ignored
+        if not self.found and name == FILE_FIELD:
+            self.found = True
+            self._active = True
+            self.filename = params.get(b"filename", b"upload.csv").decode("utf-8", "replace")
+
+    def on_part_data(self, data, start, end):
+        if self._active and end > start:
+            self.emit(bytes(data[start:end]))
+
+    def on_part_end(self):
+        self._active = False
+
+    def callbacks(self) -> Dict[str, Callable]:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+
+def _boundary(content_type: str) -> bytes:
+    ctype, params = parse_options_header(content_type.encode("latin-1"))
+    if ctype != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError("Expected a multipart/form-data body with a 'file' field")
+    return params[b"boundary"]
+
+
+async def stream_upload_import(request, connect: Callable[[], Any]) -> Dict[str, Any]:
+    """
+    Import the CSV in the `file` field of a multipart request while it is
+    still being received. Returns the finished job.
+    """
+    boundary = _boundary(request.headers.get("content-type", ""))
+    loop = asyncio.get_running_loop()
+    chunks: "queue.Queue" = queue.Queue(maxsize=QUEUE_DEPTH)
+    pending = []
+    sink = _FilePartSink(pending.append)
+    parser = MultipartParser(boundary, sink.callbacks())
+
+    conn = connect()
+    try:
+        job = create_job(conn, ["upload"], resumable=False)
+    finally:
+        conn.close()
+    job_id = job["job_id"]
+
+    stream = io.TextIOWrapper(io.BufferedReader(QueueReader(chunks)), encoding="utf-8-sig", newline="")
+    writer_done = threading.Event()
+
+    def write():
+        try:
+            run_stream_job(connect, job_id, stream, UPLOAD_CHUNK_SIZE)
+        finally:
+            writer_done.set()
+
+    writer = loop.run_in_executor(None, write)
+
+    def put(item) -> bool:
+        # Blocks while the writer is behind; gives up if the writer has exited
+        while not writer_done.is_set():
+            try:
+                chunks.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        async for body in request.stream():
+            parser.write(body)
+            for data in pending:
+                if not await loop.run_in_executor(None, put, data):
+                    break
+            pending.clear()
+            if writer_done.is_set():
+                break
+        parser.finalize()
+        if not sink.found:
+            raise UploadError("No 'file' field in upload")
+        await loop.run_in_executor(None, put, _EOF)
+    except BaseException:
+        await loop.run_in_executor(None, put, _ABORT)
+        raise
+    finally:
+        await writer
+
+    conn = connect()
+    try:
+        job = get_job(conn, job_id)
+    finally:
+        conn.close()
+    job["filename"] = sink.filename
+    return job
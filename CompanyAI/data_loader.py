@@ -12,6 +12,10 @@ from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 import openai
 
+from domain_keys import canonical_domain
+from growth_signals import refresh_growth_signals
+from metrics_partitions import ensure_partitions
+
 load_dotenv()
 
 # Configuration
@@ -162,6 +166,7 @@ def load_companies():
             for company in SAMPLE_COMPANIES:
                 company_data.append((
                     company['domain'],
+                    canonical_domain(company['domain']),
                     company['name'],
                     company['website_url'],
                     company['country'],
@@ -173,9 +178,10 @@ def load_companies():
             execute_values(
                 cur,
                 """
-                INSERT INTO companies (domain, name, website_url, country, industry, employee_range, tech_tags)
+                INSERT INTO companies (domain, domain_key, name, website_url, country, industry, employee_range, tech_tags)
                 VALUES %s
-                ON CONFLICT (domain) DO UPDATE SET
+                ON CONFLICT (domain_key) DO UPDATE SET
+                    domain = EXCLUDED.domain,
                     name = EXCLUDED.name,
                     website_url = EXCLUDED.website_url,
                     country = EXCLUDED.country,
@@ -270,7 +276,7 @@ def load_sample_metrics():
             company_ids = [row[0] for row in cur.fetchall()]
             
             # Generate sample metrics for the last 3 months
-            from datetime import datetime, timedelta
+            from datetime import datetime
             import random
             
             metrics_data = []
@@ -278,7 +284,8 @@ def load_sample_metrics():
             
             for company_id in company_ids:
                 for i in range(3):
-                    month = base_date - timedelta(days=30*i)
+                    index = base_date.month - 1 - i
+                    month = base_date.replace(year=base_date.year + index // 12, month=index % 12 + 1)
                     
                     # Sample metrics
                     visits = random.randint(10000, 1000000)
@@ -299,6 +306,8 @@ def load_sample_metrics():
                     ))
             
             if metrics_data:
+                months = [row[1] for row in metrics_data]
+                ensure_partitions(cur, "company_metrics_monthly", min(months), max(months))
                 execute_values(
                     cur,
                     """
@@ -316,6 +325,7 @@ def load_sample_metrics():
                     metrics_data
                 )
                 
+                refresh_growth_signals(cur, company_ids)
                 print(f"Loaded metrics for {len(company_ids)} companies across 3 months")
                 conn.commit()
             
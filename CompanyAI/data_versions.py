@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Per-table change watermarks ("data versions").
+
+A statement-level trigger on each watched table counts every INSERT, UPDATE,
+DELETE, COPY or TRUNCATE. That covers writes from every process: the APIs,
+import jobs, CLI scripts and psql.
+
+Writers never wait for each other on the counter. Each writing transaction
+inserts its own (table, xid) row into data_version_log instead of updating
+one shared row per table, which would stay locked until the writer commits:
+a list write would queue behind a long import chunk or dedup batch. A
+table's counter is its data_versions row plus the number of its log rows.
+Whichever trigger gets the advisory lock folds the committed log rows into
+data_versions (moving rows between the two does not change the sum);
+the others skip folding, so the log stays short without anyone blocking.
+
+The counter is transactional. A reader that reads the versions and then the
+data in one REPEATABLE READ transaction gets data matching those versions
+exactly. A version is "<table oid>-<counter>", so dropping and recreating a
+table (/setup-database) also changes it. Caches compare versions to decide
+what to reload (serving_cache.py), and read endpoints derive their ETags
+from them (http_cache.py).
+
+Works with both psycopg (v3) and psycopg2 connections.
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+# Serialized: concurrent CREATE OR REPLACE FUNCTION fails with "tuple concurrently updated"
+CREATE_SQL = """
+SELECT pg_advisory_xact_lock(hashtext('data_versions_ddl'));
+CREATE TABLE IF NOT EXISTS data_versions (
+  name        TEXT PRIMARY KEY,
+  version     BIGINT NOT NULL DEFAULT 0,
+  changed_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE TABLE IF NOT EXISTS data_version_log (
+  name        TEXT NOT NULL,
+  xid         BIGINT NOT NULL,        -- writing transaction
+  changed_at  TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  PRIMARY KEY (name, xid)
+);
+CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  INSERT INTO data_version_log (name, xid, changed_at) VALUES (TG_TABLE_NAME, txid_current(), NOW())
+  ON CONFLICT (name, xid) DO NOTHING;
+  IF pg_try_advisory_xact_lock(hashtext('data_version_log')) THEN
+    WITH folded AS (
+      DELETE FROM data_version_log WHERE xid <> txid_current() RETURNING name, changed_at
+    )
+    INSERT INTO data_versions (name, version, changed_at)
+    SELECT name, COUNT(*), MAX(changed_at) FROM folded GROUP BY name
+    ON CONFLICT (name) DO UPDATE SET
+      version = data_versions.version + EXCLUDED.version,
+      changed_at = GREATEST(data_versions.changed_at, EXCLUDED.changed_at);
+  END IF;
+  RETURN NULL;
+END
+$$;
+"""
+
+VERSIONS_SQL = """
+SELECT t.name,
+       COALESCE(to_regclass(t.name)::oid::bigint, 0) || '-' || (COALESCE(v.version, 0) + l.pending),
+       GREATEST(v.changed_at, l.changed_at)
+FROM unnest(%s::text[]) AS t(name)
+LEFT JOIN data_versions v ON v.name = t.name
+CROSS JOIN LATERAL (
+  SELECT COUNT(*) AS pending, MAX(changed_at) AS changed_at
+  FROM data_version_log WHERE name = t.name
+) l
+"""
+
+_table_ready = False
+_watched: Set[str] = set()  # tables this process has seen with a trigger
+
+
+def ensure_data_versions(conn, tables: Iterable[str]) -> None:
+    """
+    Create data_versions and add the bump trigger to each existing table in
+    `tables` that lacks it, e.g. because it was recreated. Commits.
+    """
+    global _table_ready
+    cur = conn.cursor()
+    try:
+        if not _table_ready:
+            cur.execute(CREATE_SQL)
+            conn.commit()
+            _table_ready = True
+        cur.execute(
+            "SELECT c.relname, EXISTS ("
+            "  SELECT 1 FROM pg_trigger tg"
+            "  WHERE tg.tgrelid = c.oid AND tg.tgname = c.relname || '_data_version')"
+            " FROM pg_class c"
+            " WHERE c.relname = ANY(%s) AND c.relkind IN ('r', 'p') AND pg_table_is_visible(c.oid)",
+            (list(tables),),
+        )
+        found = cur.fetchall()
+        missing = [table for table, has_trigger in found if not has_trigger]
+        for table in missing:
+            cur.execute(f"""
+                CREATE TRIGGER {table}_data_version
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version()
+            """)
+        conn.commit()
+        _watched.update(table for table, _ in found)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def watched(tables: Iterable[str]) -> bool:
+    """
+    True if ensure_data_versions() has seen a trigger on every table, i.e.
+    their versions change with their data. A table recreated since then is
+    caught by the oid in its version.
+    """
+    return _watched.issuperset(tables)
+
+
+def read_watermark(cur, tables: Iterable[str]) -> Tuple[Dict[str, str], Optional[datetime]]:
+    """Version of each table ("0-0" if it does not exist) and when the latest of them changed."""
+    cur.execute(VERSIONS_SQL, (list(tables),))
+    rows = cur.fetchall()
+    changed = [row[2] for row in rows if row[2] is not None]
+    return {row[0]: row[1] for row in rows}, max(changed) if changed else None
+
+
+def read_versions(cur, tables: Iterable[str]) -> Dict[str, str]:
+    """Version of each table; "0-0" for a table that does not exist."""
+    return read_watermark(cur, tables)[0]
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Reusable database connections for the API processes.
+
+Every request used to open its own connection. Against the hosted database
+that is a TLS handshake plus authentication, which is most of the latency of
+a small query. ConnectionPool keeps up to `size` idle connections:
+
+* getconn() hands out an idle connection, or opens a new one. Callers never
+  wait, so long-running import jobs cannot starve the endpoints.
+* close() on the returned connection puts it back instead of closing it.
+  Code written as `conn = get_db_connection() ... conn.close()` therefore
+  reuses connections unchanged.
+* A connection is rolled back and reset to autocommit off when returned.
+  Before reuse, one that has been idle longer than PING_AFTER_SECS is checked
+  with SELECT 1; broken ones are dropped.
+
+Creating a pool opens nothing. The first getconn() or fill() (run by the
+startup warm-up, see warmup.py) does.
+
+Works with both psycopg (v3) and psycopg2 connections.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+PING_AFTER_SECS = float(os.getenv("DB_POOL_PING_AFTER_SECS", "30"))
+
+
+class PooledConnection:
+    """A borrowed connection; close() returns it to its pool."""
+
+    __slots__ = ("_conn", "_pool")
+
+    def __init__(self, conn, pool: "ConnectionPool"):
+        object.__setattr__(self, "_conn", conn)
+        object.__setattr__(self, "_pool", pool)
+
+    def __getattr__(self, name):
+        conn = object.__getattribute__(self, "_conn")
+        if conn is None:
+            raise AttributeError(f"connection already returned to the pool (accessing {name!r})")
+        return getattr(conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def close(self) -> None:
+        conn = self._conn
+        if conn is not None:
+            object.__setattr__(self, "_conn", None)
+            self._pool.putconn(conn)
+
+    @property
+    def closed(self):
+        return self._conn is None or self._conn.closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._conn is not None and not self._conn.closed:
+            if exc_type is None:
+                self._conn.commit()
+            else:
+                self._conn.rollback()
+        self.close()
+
+
+class ConnectionPool:
+    def __init__(self, connect: Callable[[], Any], size: int = POOL_SIZE,
+                 ping_after_secs: float = PING_AFTER_SECS):
+        self._connect = connect
+        self.size = size
+        self.ping_after_secs = ping_after_secs
+        self._idle: List[Tuple[Any, float]] = []
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+        self.in_use = 0
+
+    def getconn(self) -> PooledConnection:
+        while True:
+            with self._lock:
+                item = self._idle.pop() if self._idle else None
+            if item is None:
+                break
+            conn, returned_at = item
+            if self._usable(conn, returned_at):
+                with self._lock:
+                    self.reused += 1
+                    self.in_use += 1
+                return PooledConnection(conn, self)
+            self._discard(conn)
+        conn = self._open()
+        with self._lock:
+            self.in_use += 1
+        return PooledConnection(conn, self)
+
+    def putconn(self, conn) -> None:
+        with self._lock:
+            self.in_use -= 1
+        try:
+            if conn.closed or getattr(conn, "broken", False):
+                return
+            conn.rollback()
+            if conn.autocommit:
+                conn.autocommit = False
+        except Exception:
+            self._discard(conn)
+            return
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((conn, time.monotonic()))
+                return
+        self._discard(conn)
+
+    def fill(self, count: Optional[int] = None) -> int:
+        """Open connections until `count` (default: size) are idle; returns how many were opened."""
+        target = min(self.size, self.size if count is None else count)
+        opened = 0
+        while True:
+            with self._lock:
+                if len(self._idle) >= target:
+                    return opened
+            conn = self._open()
+            opened += 1
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append((conn, time.monotonic()))
+                    continue
+            self._discard(conn)
+            return opened
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": self.size, "idle": len(self._idle), "in_use": self.in_use,
+                    "opened": self.opened, "reused": self.reused}
+
+    def _open(self):
+        conn = self._connect()
+        with self._lock:
+            self.opened += 1
+        return conn
+
+    def _usable(self, conn, returned_at: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.ping_after_secs:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _discard(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Fast JSON responses for large result sets.
+
+When an endpoint returns dicts or models, FastAPI validates them against
+response_model, walks every value with jsonable_encoder and encodes the
+result with the stdlib json module. For thousands of rows that costs more
+than the query. The fast path skips all three steps:
+
+* Queries run on plain tuple cursors. float_numerics() makes the cursor load
+  NUMERIC columns as float, so no Decimal objects are created.
+* records() zips the column names onto each tuple; no per-row model.
+* FastJSONResponse encodes with orjson. It handles datetime and date
+  natively, and Decimal values from other cursors are encoded the way
+  jsonable_encoder does it (int without a fractional part, else float).
+
+Endpoints keep response_model= for the OpenAPI schema. A returned Response
+bypasses validation, so the SELECT list must produce exactly the model's
+fields.
+
+Serialization benchmark for 1k and 10k rows (no database needed):
+
+  python fast_json.py --rows 1000 10000
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, List, Sequence
+
+import orjson
+from starlette.responses import Response
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value.as_tuple().exponent >= 0 else float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def float_numerics(cur):
+    """Load NUMERIC columns on this cursor as float instead of Decimal; returns the cursor."""
+    if hasattr(cur, "adapters"):  # psycopg 3
+        from psycopg.types.numeric import FloatLoader
+        cur.adapters.register_loader("numeric", FloatLoader)
+    else:  # psycopg2
+        import psycopg2.extensions
+        numeric = psycopg2.extensions.new_type(
+            (1700,), "NUMERIC_AS_FLOAT", lambda value, _cur: None if value is None else float(value)
+        )
+        psycopg2.extensions.register_type(numeric, cur)
+    return cur
+
+
+def records(cur, rows: Sequence[Sequence[Any]] = None) -> List[Dict[str, Any]]:
+    """Rows of a tuple cursor (default: the rest of its result) as dicts keyed by column name."""
+    columns = [d[0] for d in cur.description]
+    if rows is None:
+        rows = cur.fetchall()
+    return [dict(zip(columns, row)) for row in rows]
+
+
+# ---- Benchmark ----
+
+def _sample_rows(n: int):
+    """Rows shaped like the company search results."""
+    columns = ("company_id", "domain", "name", "country", "industry", "employee_range", "tech_tags",
+               "visits", "pages_per_visit", "avg_visit_secs", "bounce_rate", "similarity_score")
+    rows = [
+        (i, f"site{i}.com", f"Site {i}", "US", "Publishing", "51-200", ["react", "stripe"],
+         1234567.0 + i, 3.25, 184.5, 0.41, 0.87)
+        for i in range(n)
+    ]
+    app_columns = ("name", "website", "vertical", "subvertical", "description", "location",
+                   "monthly_visits", "unique_visitors", "pages_per_visit", "adsense_enabled", "reached_out_date")
+    app_rows = [
+        (f"Site {i}", f"https://site{i}.com/", "Publishing", "News", "Daily news and analysis " * 4, "United States",
+         1234567 + i, 456789, Decimal("3.25"), True, datetime(2024, 1, 1) + timedelta(minutes=i))
+        for i in range(n)
+    ]
+    return columns, rows, app_columns, app_rows
+
+
+def _time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def benchmark(n: int, repeat: int = 5) -> Dict[str, float]:
+    """Best-of-`repeat` milliseconds to serialize `n` rows along each path."""
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+
+    from company_management_api import CompanyResponse
+
+    columns, rows, app_columns, app_rows = _sample_rows(n)
+    models = TypeAdapter(List[CompanyResponse])
+    app_dicts = [dict(zip(app_columns, row)) for row in app_rows]
+
+    def stdlib(content):
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+    def response_model_path():
+        # One CompanyResponse per row, then FastAPI's response_model validation and encoding
+        built = [CompanyResponse(**dict(zip(columns, row))) for row in rows]
+        return stdlib(models.dump_python(models.validate_python(built), mode="json"))
+
+    return {
+        "response_model (per-row models)": _time(response_model_path, repeat),
+        "fast path (tuples -> orjson)": _time(lambda: dumps([dict(zip(columns, row)) for row in rows]), repeat),
+        "dict_row + jsonable_encoder": _time(lambda: stdlib(jsonable_encoder(app_dicts)), repeat),
+        "fast path, app.py rows": _time(lambda: dumps([dict(zip(app_columns, row)) for row in app_rows]), repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON serialization benchmark for large result sets")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for n in args.rows:
+        print(f"{n} rows")
+        for path, ms in benchmark(n, args.repeat).items():
+            print(f"  {path:<34}{ms:>10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
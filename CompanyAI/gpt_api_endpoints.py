@@ -1,12 +1,22 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 import psycopg
-from psycopg.rows import dict_row
 from typing import List, Optional
 import os
 from dotenv import load_dotenv
 
+from data_versions import ensure_data_versions
+from db_pool import ConnectionPool
+from fast_json import FastJSONResponse, float_numerics
+from http_cache import CompressionMiddleware, db_validators, not_modified
+import metrics
+from projection import SEARCH_FIELDS, check_format, parse_fields, result, select_list
+from stats_snapshot import get_stats_snapshot
+import warmup
+
 load_dotenv()
+warmup.mark("imports")
 
 import os
 
@@ -30,9 +40,11 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(metrics.MetricsMiddleware, name="gpt", router=app.router)
 
-# Database connection
-def get_db_connection():
+# Database connection; conn.close() returns it to the pool
+def open_db_connection():
     return psycopg.connect(
         host=os.getenv("DB_HOST", "localhost"),
         database=os.getenv("DB_NAME", "CompanyAI"),
@@ -41,30 +53,59 @@ def get_db_connection():
         port=int(os.getenv("DB_PORT", "5432"))
     )
 
+db_pool = ConnectionPool(open_db_connection)
+
+def get_db_connection():
+    return db_pool.getconn()
+
+def _warm_stats_snapshot():
+    conn = get_db_connection()
+    try:
+        ensure_data_versions(conn, ("stats_snapshots",))
+        get_stats_snapshot(conn)
+    finally:
+        conn.close()
+
+metrics.register_pool("gpt", db_pool)
+
+warmup.register("gpt_db_pool", db_pool.fill)
+warmup.register("stats_snapshot", _warm_stats_snapshot)
+
+@app.on_event("startup")
+async def start_warmup():
+    warmup.start()
+
+@app.on_event("shutdown")
+async def close_db_pool():
+    db_pool.close()
+
 @app.get("/gpt/companies/search")
 async def search_companies_gpt(
     query: str = Query(..., description="Search query for companies"),
     limit: int = Query(10, description="Number of results to return"),
     min_visits: Optional[int] = Query(None, description="Minimum monthly visits"),
     vertical: Optional[str] = Query(None, description="Filter by vertical"),
-    location: Optional[str] = Query(None, description="Filter by location")
+    location: Optional[str] = Query(None, description="Filter by location"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. name,website,monthly_visits"),
+    format: str = Query("rows", description="rows, or compact for one value array per field"),
+    max_description: Optional[int] = Query(None, ge=1, description="Truncate descriptions to this many characters")
 ):
     """
     Search companies for GPT integration
     """
+    columns = parse_fields(fields, SEARCH_FIELDS)
+    check_format(format)
     try:
         conn = get_db_connection()
-        cursor = conn.cursor(row_factory=dict_row)
+        cursor = float_numerics(conn.cursor())
         
-        # Build the query dynamically
-        sql = """
-            SELECT 
-                name, website, vertical, subvertical, description, location,
-                monthly_visits, unique_visitors, pages_per_visit, adsense_enabled
+        # Build the query dynamically; only the requested columns are read
+        select, params = select_list(columns, max_description)
+        sql = f"""
+            SELECT {select}
             FROM all_companies 
             WHERE 1=1
         """
-        params = []
         
         # Add text search
         if query:
@@ -96,24 +137,16 @@ async def search_companies_gpt(
         params.append(limit)
         
         cursor.execute(sql, params)
-        results = cursor.fetchall()
-        
-        # Convert to list of dicts
-        companies = []
-        for row in results:
-            companies.append(dict(row))
-        
-        return {
+        return FastJSONResponse({
             "success": True,
-            "count": len(companies),
-            "companies": companies,
+            **result(columns, cursor.fetchall(), format),
             "query": query,
             "filters_applied": {
                 "min_visits": min_visits,
                 "vertical": vertical,
                 "location": location
             }
-        }
+        })
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
@@ -123,26 +156,32 @@ async def search_companies_gpt(
         if 'conn' in locals():
             conn.close()
 
+REACHED_OUT_COMPANY_FIELDS = ("name", "website", "vertical", "subvertical", "description", "location",
+                              "monthly_visits", "us_percentage")
+
 @app.get("/gpt/companies/reached-out")
 async def get_reached_out_companies_gpt(
     limit: int = Query(20, description="Number of results to return"),
-    vertical: Optional[str] = Query(None, description="Filter by vertical")
+    vertical: Optional[str] = Query(None, description="Filter by vertical"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. name,website"),
+    format: str = Query("rows", description="rows, or compact for one value array per field"),
+    max_description: Optional[int] = Query(None, ge=1, description="Truncate descriptions to this many characters")
 ):
     """
     Get companies that have been reached out to
     """
+    columns = parse_fields(fields, REACHED_OUT_COMPANY_FIELDS)
+    check_format(format)
     try:
         conn = get_db_connection()
-        cursor = conn.cursor(row_factory=dict_row)
+        cursor = float_numerics(conn.cursor())
         
-        sql = """
-            SELECT 
-                name, website, vertical, subvertical, description, location,
-                monthly_visits, us_percentage
+        select, params = select_list(columns, max_description)
+        sql = f"""
+            SELECT {select}
             FROM reached_out_companies 
             WHERE 1=1
         """
-        params = []
         
         if vertical:
             sql += " AND LOWER(vertical) = LOWER(%s)"
@@ -152,15 +191,7 @@ async def get_reached_out_companies_gpt(
         params.append(limit)
         
         cursor.execute(sql, params)
-        results = cursor.fetchall()
-        
-        companies = [dict(row) for row in results]
-        
-        return {
-            "success": True,
-            "count": len(companies),
-            "companies": companies
-        }
+        return FastJSONResponse({"success": True, **result(columns, cursor.fetchall(), format)})
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
@@ -171,70 +202,57 @@ async def get_reached_out_companies_gpt(
             conn.close()
 
 @app.get("/gpt/companies/stats")
-async def get_database_stats_gpt():
+async def get_database_stats_gpt(request: Request):
     """
     Get database statistics for GPT context
     """
     try:
         conn = get_db_connection()
-        cursor = conn.cursor(row_factory=dict_row)
-        
-        # Get counts
-        cursor.execute("SELECT COUNT(*) FROM all_companies")
-        total_companies = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM reached_out_companies")
-        reached_out_count = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM interested_companies")
-        interested_count = cursor.fetchone()[0]
-        
-        # Get top verticals
-        cursor.execute("""
-            SELECT vertical, COUNT(*) as count 
-            FROM all_companies 
-            WHERE vertical IS NOT NULL 
-            GROUP BY vertical 
-            ORDER BY count DESC 
-            LIMIT 10
-        """)
-        top_verticals = cursor.fetchall()
+        headers = db_validators(request, conn, ("stats_snapshots",))
+        unchanged = not_modified(request, headers)
+        if unchanged is not None:
+            return unchanged
+        snapshot = get_stats_snapshot(conn)
+        if snapshot is None:
+            raise HTTPException(status_code=503, detail="Stats snapshot is being computed")
         
-        # Get top locations
-        cursor.execute("""
-            SELECT location, COUNT(*) as count 
-            FROM all_companies 
-            WHERE location IS NOT NULL 
-            GROUP BY location 
-            ORDER BY count DESC 
-            LIMIT 10
-        """)
-        top_locations = cursor.fetchall()
-        
-        return {
+        stats = snapshot["stats"]
+        return FastJSONResponse({
             "success": True,
             "database_stats": {
-                "total_companies": total_companies,
-                "reached_out_companies": reached_out_count,
-                "interested_companies": interested_count,
-                "top_verticals": [{"vertical": v[0], "count": v[1]} for v in top_verticals],
-                "top_locations": [{"location": l[0], "count": l[1]} for l in top_locations]
-            }
-        }
+                "total_companies": stats["total_companies"],
+                "reached_out_companies": stats.get("reached_out_companies", 0),
+                "interested_companies": stats.get("interested_companies", 0),
+                "top_verticals": stats["vertical_distribution"][:10],
+                "top_locations": stats["top_locations"]
+            },
+            "computed_at": snapshot["computed_at"].isoformat()
+        }, headers=headers)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
     finally:
-        if 'cursor' in locals():
-            cursor.close()
         if 'conn' in locals():
             conn.close()
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus metrics (metrics.py)"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/gpt/health")
 async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "service": "Company Database GPT API"}
 
+@app.get("/gpt/ready")
+async def readiness_check():
+    """Readiness probe: 503 until the background warm-up has finished"""
+    return JSONResponse(status_code=200 if warmup.is_ready() else 503,
+                        content={**warmup.readiness(), "db_pool": db_pool.stats()})
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
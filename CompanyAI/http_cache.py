@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Conditional GETs and compressed responses for the read endpoints.
+
+* validators() turns the data versions of the tables a response is built
+  from (data_versions.py) into a weak ETag, and their last change time into
+  Last-Modified. The ETag also covers the path and query string, so every
+  page and parameter combination has its own. db_validators() reads the
+  versions on a connection, and gives no headers for tables without a
+  version trigger.
+* not_modified() answers If-None-Match (or If-Modified-Since when there is
+  no If-None-Match) with a 304, before the endpoint runs its query.
+  Responses carry Cache-Control: no-cache, so browsers keep them but
+  revalidate on each use.
+* CompressionMiddleware gzips JSON and HTML bodies of COMPRESS_MIN_BYTES or
+  more, or uses brotli when the client accepts it and the brotli package is
+  installed. Streamed responses (event streams, CSV exports) pass through.
+
+Endpoints read the versions before the data. A write in between then makes
+the data newer than its ETag, which only costs the client one extra 200.
+"""
+
+import gzip
+import hashlib
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Iterable, Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+
+from data_versions import read_watermark, watched
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+COMPRESSIBLE_TYPES = ("application/json", "text/html", "text/plain", "text/csv")
+THREADPOOL_BYTES = 256 * 1024  # compress larger bodies off the event loop
+
+
+# ---- Conditional requests ----
+
+def validators(request: Request, versions: Dict[str, str],
+               changed_at: Optional[datetime] = None) -> Dict[str, str]:
+    """ETag, Last-Modified and Cache-Control headers for a response built from `versions`."""
+    key = repr((request.url.path, sorted(request.query_params.multi_items()), sorted(versions.items())))
+    headers = {
+        "ETag": f'W/"{hashlib.blake2b(key.encode(), digest_size=12).hexdigest()}"',
+        "Cache-Control": "no-cache",
+    }
+    if changed_at is not None:
+        headers["Last-Modified"] = format_datetime(changed_at.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+
+def db_validators(request: Request, conn, tables: Iterable[str]) -> Dict[str, str]:
+    """validators() for `tables` read on `conn`; {} if a table has no version trigger yet."""
+    tables = tuple(tables)
+    if not watched(tables):
+        return {}
+    cur = conn.cursor()
+    try:
+        versions, changed_at = read_watermark(cur, tables)
+    finally:
+        cur.close()
+    return validators(request, versions, changed_at)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # Weak comparison: W/"x" and "x" match
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith("W/") else candidate) == opaque:
+            return True
+    return False
+
+
+def _not_modified_since(header: str, last_modified: str) -> bool:
+    try:
+        return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+
+
+def not_modified(request: Request, headers: Dict[str, str]) -> Optional[Response]:
+    """A 304 carrying `headers` if the client's copy is current, else None."""
+    if "ETag" not in headers:
+        return None
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        fresh = _etag_matches(if_none_match, headers["ETag"])
+    else:
+        if_modified_since = request.headers.get("if-modified-since")
+        fresh = bool(if_modified_since and "Last-Modified" in headers
+                     and _not_modified_since(if_modified_since, headers["Last-Modified"]))
+    return Response(status_code=304, headers=headers) if fresh else None
+
+
+# ---- Compression ----
+
+def _accepted(accept_encoding: str) -> set:
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip())
+    return accepted
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = _accepted(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=min(COMPRESS_LEVEL, 11))
+    return gzip.compress(body, compresslevel=min(COMPRESS_LEVEL, 9), mtime=0)
+
+
+class CompressionMiddleware:
+    """
+    Compresses complete response bodies. A response sent in several body
+    messages (StreamingResponse) is passed through unchanged, so event
+    streams are never buffered.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if start is None:
+                await send(message)
+                return
+            pending, start = start, None
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                body = message.get("body", b"")
+                headers = MutableHeaders(raw=pending["headers"])
+                content_type = headers.get("content-type", "").split(";")[0].strip()
+                if (len(body) >= self.minimum_size and content_type in COMPRESSIBLE_TYPES
+                        and "content-encoding" not in headers):
+                    if len(body) >= THREADPOOL_BYTES:
+                        body = await run_in_threadpool(compress, body, encoding)
+                    else:
+                        body = compress(body, encoding)
+                    headers["Content-Encoding"] = encoding
+                    headers["Content-Length"] = str(len(body))
+                    headers.add_vary_header("Accept-Encoding")
+                    message = {"type": "http.response.body", "body": body}
+            await send(pending)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Change detection for CSV imports.
+
+Two levels:
+
+* Files: the sha256 of every imported source is stored in import_sources. A
+  file whose content hash matches its last successful import is skipped
+  without being parsed. The hash is tied to the oid of all_companies, so it
+  stops matching once /setup-database recreates the table.
+* Rows: every imported row carries a 128-bit hash of its CSV-sourced values
+  in all_companies.import_hash (keyed by domain_key). Before a batch is
+  COPYed, rows whose hash equals the stored one are dropped, so only new and
+  changed rows reach the database.
+
+Requires a psycopg (v3) connection.
+"""
+
+import hashlib
+import os
+from typing import Dict, List, Optional, Tuple
+
+FILE_HASH_BLOCK = 1 << 20
+
+# Values that come from the CSV; outreach columns are owned by the app
+HASHED_COLUMNS = (
+    "name", "website", "vertical", "subvertical", "description", "location",
+    "monthly_visits", "unique_visitors", "visit_duration", "pages_per_visit",
+    "adsense_enabled", "us_percentage",
+)
+
+CREATE_SQL = """
+CREATE TABLE IF NOT EXISTS import_sources (
+  source        TEXT PRIMARY KEY,      -- absolute path of the CSV file
+  content_hash  TEXT NOT NULL,         -- sha256 of the file bytes
+  size_bytes    BIGINT NOT NULL,
+  target_oid    OID NOT NULL,          -- all_companies' oid at import time
+  rows_parsed   BIGINT NOT NULL DEFAULT 0,
+  imported_at   TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+ALTER TABLE all_companies ADD COLUMN IF NOT EXISTS import_hash BYTEA;
+"""
+
+_table_ready = False
+
+
+def ensure_fingerprint_tables(conn) -> None:
+    """Create import_sources and all_companies.import_hash once per process."""
+    global _table_ready
+    if _table_ready:
+        return
+    with conn.cursor() as cur:
+        cur.execute(CREATE_SQL)
+    conn.commit()
+    _table_ready = True
+
+
+# ---- Files ----
+
+def file_digest(path: str) -> Tuple[str, int]:
+    """Return (sha256 hex digest, size in bytes) of a file."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(FILE_HASH_BLOCK), b""):
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+
+def source_unchanged(cur, path: str, content_hash: str) -> bool:
+    """True if `path` was last imported with this exact content into the current all_companies."""
+    cur.execute("""
+        SELECT 1 FROM import_sources
+        WHERE source = %s AND content_hash = %s AND target_oid = 'all_companies'::regclass
+    """, (os.path.abspath(path), content_hash))
+    return cur.fetchone() is not None
+
+
+def record_source(cur, path: str, content_hash: str, size_bytes: int, rows_parsed: int) -> None:
+    """Remember a successfully imported file; call in the transaction that loaded it."""
+    cur.execute("""
+        INSERT INTO import_sources (source, content_hash, size_bytes, target_oid, rows_parsed, imported_at)
+        VALUES (%s, %s, %s, 'all_companies'::regclass, %s, NOW())
+        ON CONFLICT (source) DO UPDATE SET
+            content_hash = EXCLUDED.content_hash, size_bytes = EXCLUDED.size_bytes,
+            target_oid = EXCLUDED.target_oid, rows_parsed = EXCLUDED.rows_parsed,
+            imported_at = EXCLUDED.imported_at
+    """, (os.path.abspath(path), content_hash, size_bytes, rows_parsed))
+
+
+# ---- Rows ----
+
+def row_hashes(batch: Dict[str, list]) -> List[bytes]:
+    """128-bit hash of each row's CSV-sourced values."""
+    return [
+        hashlib.blake2b(repr(values).encode("utf-8"), digest_size=16).digest()
+        for values in zip(*(batch[name] for name in HASHED_COLUMNS))
+    ]
+
+
+class ChangeFilter:
+    """
+    Drops rows that would not change all_companies, one batch at a time.
+
+    Within one import the first row for a domain wins (as in the merge);
+    later rows for the same domain are dropped and counted as duplicates.
+    With force=True only duplicates are dropped, so every row is re-sent.
+    """
+
+    def __init__(self, force: bool = False):
+        self.force = force
+        self.seen = set()
+
+    def mark_seen(self, batch: Dict[str, list]) -> None:
+        """Remember a batch's domains as already imported, without filtering it."""
+        self.seen.update(batch["domain_key"])
+
+    def apply(self, cur, batch: Dict[str, list]) -> Tuple[Dict[str, list], int, int]:
+        """Return (filtered batch with import_hash set, unchanged rows, duplicate rows)."""
+        keys = batch["domain_key"]
+        batch["import_hash"] = row_hashes(batch)
+
+        stored: Dict[str, Optional[bytes]] = {}
+        if not self.force and keys:
+            # Plain tuple cursor, whatever row factory the caller's cursor uses
+            with cur.connection.cursor() as lookup:
+                lookup.execute(
+                    "SELECT domain_key, import_hash FROM all_companies WHERE domain_key = ANY(%s)",
+                    (keys,),
+                )
+                stored = dict(lookup.fetchall())
+
+        keep, unchanged, duplicates = [], 0, 0
+        for i, (key, row_hash) in enumerate(zip(keys, batch["import_hash"])):
+            if key in self.seen:
+                duplicates += 1
+                continue
+            self.seen.add(key)
+            if stored.get(key) == row_hash:
+                unchanged += 1
+            else:
+                keep.append(i)
+
+        if len(keep) != len(keys):
+            batch = {name: [values[i] for i in keep] for name, values in batch.items()}
+        return batch, unchanged, duplicates
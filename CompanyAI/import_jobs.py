@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+Background CSV import jobs.
+
+A job is a row in import_jobs. Workers run jobs from a thread pool, merging
+one chunk at a time and committing the chunk together with the job's progress
+(file index + data-row offset), so a job that is cancelled, fails or whose
+process dies can be resumed from its last committed chunk. Because all state
+lives in the table, any worker can answer status queries or cancel a job.
+Files and rows that have not changed since their last import are skipped
+(see import_fingerprints) unless the job was created with force=True.
+
+Requires a psycopg (v3) connection.
+"""
+
+import csv
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+
+from csv_import import ImportStats, create_staging_table, filter_batch, iter_column_batches, merge_chunk
+from domain_keys import ensure_domain_key
+from import_fingerprints import (
+    ChangeFilter, ensure_fingerprint_tables, file_digest, record_source, source_unchanged,
+)
+from stats_snapshot import refresh_stats_snapshot_safely
+
+CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "20000"))
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "1"))
+# A running job that has not reported progress for this long is considered
+# orphaned (its worker died) and may be resumed.
+STALE_AFTER_SECS = int(os.getenv("IMPORT_STALE_AFTER_SECS", "300"))
+
+CREATE_SQL = """
+CREATE TABLE IF NOT EXISTS import_jobs (
+  job_id            BIGSERIAL PRIMARY KEY,
+  status            TEXT NOT NULL DEFAULT 'queued',  -- queued, running, completed, failed, cancelled
+  sources           JSONB NOT NULL,                  -- list of CSV paths
+  file_index        INT NOT NULL DEFAULT 0,          -- next source to (continue to) read
+  file_offset       BIGINT NOT NULL DEFAULT 0,       -- data rows of that source already committed
+  rows_parsed       BIGINT NOT NULL DEFAULT 0,
+  rows_loaded       BIGINT NOT NULL DEFAULT 0,
+  rows_skipped      BIGINT NOT NULL DEFAULT 0,
+  rows_rejected     BIGINT NOT NULL DEFAULT 0,
+  parse_errors      BIGINT NOT NULL DEFAULT 0,
+  elapsed_secs      DOUBLE PRECISION NOT NULL DEFAULT 0,
+  cancel_requested  BOOLEAN NOT NULL DEFAULT FALSE,
+  error             TEXT,
+  created_at        TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  started_at        TIMESTAMPTZ,
+  updated_at        TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  finished_at       TIMESTAMPTZ
+);
+ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS resumable BOOLEAN NOT NULL DEFAULT TRUE;
+ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS rejects JSONB;
+ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS force_reimport BOOLEAN NOT NULL DEFAULT FALSE;
+ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS rows_unchanged BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE import_jobs ADD COLUMN IF NOT EXISTS files_unchanged JSONB NOT NULL DEFAULT '[]';
+CREATE INDEX IF NOT EXISTS import_jobs_status_idx ON import_jobs (status);
+"""
+
+JOB_COLUMNS = """
+    job_id, status, sources, file_index, file_offset, rows_parsed, rows_loaded,
+    rows_skipped, rows_rejected, rows_unchanged, files_unchanged, parse_errors,
+    elapsed_secs, cancel_requested, resumable, force_reimport, rejects, error, created_at, started_at, updated_at, finished_at
+"""
+
+_table_ready = False
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def ensure_jobs_table(conn) -> None:
+    global _table_ready
+    if _table_ready:
+        return
+    with conn.cursor() as cur:
+        cur.execute(CREATE_SQL)
+    conn.commit()
+    _table_ready = True
+
+
+def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape a job row for API responses."""
+    elapsed = job["elapsed_secs"] or 0.0
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "sources": job["sources"],
+        "rows_parsed": job["rows_parsed"],
+        "rows_loaded": job["rows_loaded"],
+        "rows_skipped": job["rows_skipped"],
+        "rows_rejected": job["rows_rejected"],
+        "rows_unchanged": job["rows_unchanged"],
+        "files_unchanged": job["files_unchanged"],
+        "parse_errors": job["parse_errors"],
+        "rejects": job["rejects"] or {"by_column": {}, "samples": []},
+        "elapsed_secs": round(elapsed, 3),
+        "rows_per_sec": round(job["rows_parsed"] / elapsed, 1) if elapsed else 0.0,
+        "resume_point": {"file_index": job["file_index"], "file_offset": job["file_offset"]},
+        "cancel_requested": job["cancel_requested"],
+        "resumable": job["resumable"],
+        "force": job["force_reimport"],
+        "error": job["error"],
+        "created_at": job["created_at"].isoformat() if job["created_at"] else None,
+        "started_at": job["started_at"].isoformat() if job["started_at"] else None,
+        "updated_at": job["updated_at"].isoformat() if job["updated_at"] else None,
+        "finished_at": job["finished_at"].isoformat() if job["finished_at"] else None,
+    }
+
+
+# ---- Job state ----
+
+def create_job(conn, sources: List[str], resumable: bool = True, force: bool = False) -> Dict[str, Any]:
+    ensure_jobs_table(conn)
+    with conn.cursor(row_factory=dict_row) as cur:
+        cur.execute(
+            "INSERT INTO import_jobs (sources, resumable, force_reimport) "
+            f"VALUES (%s, %s, %s) RETURNING {JOB_COLUMNS}",
+            (Jsonb(sources), resumable, force),
+        )
+        job = cur.fetchone()
+    conn.commit()
+    return _public(job)
+
+
+def get_job(conn, job_id: int) -> Optional[Dict[str, Any]]:
+    ensure_jobs_table(conn)
+    with conn.cursor(row_factory=dict_row) as cur:
+        cur.execute(f"SELECT {JOB_COLUMNS} FROM import_jobs WHERE job_id = %s", (job_id,))
+        job = cur.fetchone()
+    conn.commit()
+    return _public(job) if job else None
+
+
+def cancel_job(conn, job_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Cancel a job. Queued jobs are cancelled immediately; running jobs stop
+    after their current chunk commits.
+    """
+    ensure_jobs_table(conn)
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE import_jobs
+            SET cancel_requested = TRUE,
+                status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE status END,
+                updated_at = NOW()
+            WHERE job_id = %s AND status IN ('queued', 'running')
+        """, (job_id,))
+    conn.commit()
+    return get_job(conn, job_id)
+
+
+def reset_job_for_resume(conn, job_id: int) -> bool:
+    """Re-queue a cancelled, failed or orphaned job; returns False if not resumable."""
+    ensure_jobs_table(conn)
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE import_jobs
+            SET status = 'queued', cancel_requested = FALSE, error = NULL,
+                finished_at = NULL, updated_at = NOW()
+            WHERE job_id = %s AND resumable
+              AND (status IN ('cancelled', 'failed')
+                   OR (status = 'running' AND updated_at < NOW() - make_interval(secs => %s)))
+        """, (job_id, STALE_AFTER_SECS))
+        resumed = cur.rowcount == 1
+    conn.commit()
+    return resumed
+
+
+def _claim(cur, job_id: int) -> Optional[Dict[str, Any]]:
+    cur.execute(f"""
+        UPDATE import_jobs
+        SET status = 'running', started_at = COALESCE(started_at, NOW()), updated_at = NOW()
+        WHERE job_id = %s AND status = 'queued'
+        RETURNING {JOB_COLUMNS}
+    """, (job_id,))
+    return cur.fetchone()
+
+
+def _save_progress(cur, job_id: int, stats: ImportStats, file_index: int, file_offset: int,
+                   elapsed: float, error: Optional[str] = None) -> bool:
+    """Record progress in the chunk's transaction; returns True if cancel was requested."""
+    cur.execute("""
+        UPDATE import_jobs
+        SET file_index = %s, file_offset = %s,
+            rows_parsed = %s, rows_loaded = %s, rows_skipped = %s, rows_rejected = %s,
+            rows_unchanged = %s, files_unchanged = %s, parse_errors = %s, rejects = %s,
+            elapsed_secs = %s, error = COALESCE(%s, error), updated_at = NOW()
+        WHERE job_id = %s
+        RETURNING cancel_requested
+    """, (file_index, file_offset, stats.rows_parsed, stats.rows_loaded, stats.rows_skipped,
+          stats.rows_rejected, stats.rows_unchanged, Jsonb(stats.files_unchanged),
+          stats.parse_errors, Jsonb(stats.rejects_report()), elapsed, error, job_id))
+    return cur.fetchone()["cancel_requested"]
+
+
+def _finish(cur, job_id: int, status: str, error: Optional[str] = None) -> None:
+    cur.execute("""
+        UPDATE import_jobs
+        SET status = %s, error = COALESCE(%s, error), finished_at = NOW(), updated_at = NOW()
+        WHERE job_id = %s
+    """, (status, error, job_id))
+
+
+def _fail_unclaimed(connect: Callable[[], Any], job_id: int, error: str) -> None:
+    """Mark a still queued job failed on a fresh connection (it can be resumed later)."""
+    conn = None
+    try:
+        conn = connect()
+        with conn.cursor() as cur:
+            cur.execute("""
+                UPDATE import_jobs
+                SET status = 'failed', error = %s, finished_at = NOW(), updated_at = NOW()
+                WHERE job_id = %s AND status = 'queued'
+            """, (error, job_id))
+        conn.commit()
+    except Exception as e:
+        print(f"Import job {job_id}: could not record the failure: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+# ---- Worker ----
+
+class JobCancelled(Exception):
+    pass
+
+
+def _import_stream(conn, cur, job_id: int, table, file, stats: ImportStats, changes: ChangeFilter,
+                   file_index: int, offset: int, elapsed: Callable[[], float], chunk_size: int) -> None:
+    """Merge one CSV stream chunk by chunk, committing progress after each chunk."""
+    parsed_before = stats.rows_parsed
+    for batch in iter_column_batches(file, stats, chunk_size, skip_rows=offset):
+        batch = filter_batch(cur, changes, batch, stats)
+        stats.rows_loaded += merge_chunk(cur, table, batch)
+        cancelled = _save_progress(
+            cur, job_id, stats, file_index,
+            offset + stats.rows_parsed - parsed_before, elapsed(),
+        )
+        conn.commit()
+        if cancelled:
+            raise JobCancelled()
+
+
+def _replay_seen(job: Dict[str, Any], changes: ChangeFilter, chunk_size: int) -> None:
+    """
+    Re-read the rows a resumed job already committed and mark their domains
+    as seen. Without this, a later duplicate of one of those domains would
+    overwrite the row that won under "first row wins".
+    """
+    sources, unchanged = job["sources"], set(job["files_unchanged"])
+    for file_index in range(job["file_index"] + 1):
+        max_rows = job["file_offset"] if file_index == job["file_index"] else None
+        path = sources[file_index] if file_index < len(sources) else None
+        if path is None or path in unchanged or max_rows == 0:
+            continue
+        try:
+            with open(path, "r", encoding="utf-8", newline="") as file:
+                for batch in iter_column_batches(file, ImportStats(), chunk_size, max_rows=max_rows):
+                    changes.mark_seen(batch)
+        except (OSError, UnicodeDecodeError, csv.Error):
+            # The first run stopped reading this file at the same point
+            pass
+
+
+def _drop_staging(conn, job_id: int) -> None:
+    """
+    Drop a job's staging table however the job ended. A resumed job
+    creates it again; only the claiming worker may drop it.
+    """
+    try:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS import_staging_{int(job_id)}")
+        conn.commit()
+    except Exception as e:
+        print(f"Import job {job_id}: could not drop its staging table: {e}")
+
+
+def _run(connect: Callable[[], Any], job_id: int, body: Callable) -> None:
+    """
+    Claim a queued job and run body(conn, cur, job, stats, changes, table, elapsed),
+    recording completion, cancellation or failure.
+    """
+    try:
+        conn = connect()
+    except Exception as e:
+        # Runs in the executor, where a raised error is lost; the job would stay queued
+        print(f"Import job {job_id} failed: {e}")
+        _fail_unclaimed(connect, job_id, str(e))
+        return
+    claimed = False
+    try:
+        ensure_jobs_table(conn)
+        ensure_domain_key(conn, "all_companies")
+        ensure_fingerprint_tables(conn)
+        with conn.cursor(row_factory=dict_row) as cur:
+            job = _claim(cur, job_id)
+            conn.commit()
+            if not job:
+                return
+            claimed = True
+
+            stats = ImportStats(
+                rows_parsed=job["rows_parsed"], rows_loaded=job["rows_loaded"],
+                rows_skipped=job["rows_skipped"], rows_rejected=job["rows_rejected"],
+                rows_unchanged=job["rows_unchanged"], files_unchanged=job["files_unchanged"],
+                parse_errors=job["parse_errors"],
+            )
+            changes = ChangeFilter(job["force_reimport"])
+            if job["rejects"]:
+                stats.reject_counts = job["rejects"]["by_column"]
+                stats.reject_samples = job["rejects"]["samples"]
+            started = time.perf_counter()
+            elapsed = lambda: job["elapsed_secs"] + time.perf_counter() - started
+            table = create_staging_table(cur, f"import_staging_{int(job_id)}")
+            conn.commit()
+
+            try:
+                body(conn, cur, job, stats, changes, table, elapsed)
+            except JobCancelled:
+                _finish(cur, job_id, "cancelled")
+                conn.commit()
+                print(f"Import job {job_id}: cancelled")
+                return
+
+            _finish(cur, job_id, "completed")
+            conn.commit()
+            print(f"Import job {job_id}: completed, {stats.rows_loaded} rows loaded")
+    except Exception as e:
+        conn.rollback()
+        print(f"Import job {job_id} failed: {e}")
+        with conn.cursor() as cur:
+            _finish(cur, job_id, "failed", str(e))
+        conn.commit()
+        return
+    finally:
+        if claimed:
+            _drop_staging(conn, job_id)
+        conn.close()
+
+    refresh_stats_snapshot_safely(connect)
+
+
+def run_import_job(connect: Callable[[], Any], job_id: int, chunk_size: int = CHUNK_SIZE) -> None:
+    """Run (or resume) a queued file job to completion, cancellation or failure."""
+
+    def body(conn, cur, job, stats, changes, table, elapsed):
+        sources = job["sources"]
+        if job["file_index"] or job["file_offset"]:
+            _replay_seen(job, changes, chunk_size)
+            print(f"Import job {job_id}: resuming with {len(changes.seen)} domains already imported")
+        for file_index in range(job["file_index"], len(sources)):
+            path = sources[file_index]
+            offset = job["file_offset"] if file_index == job["file_index"] else 0
+            try:
+                content_hash, size = file_digest(path)
+                if offset == 0 and not changes.force and source_unchanged(cur, path, content_hash):
+                    print(f"Import job {job_id}: skipping unchanged {path}")
+                    stats.files_unchanged.append(path)
+                    _save_progress(cur, job_id, stats, file_index + 1, 0, elapsed())
+                    conn.commit()
+                    continue
+                print(f"Import job {job_id}: processing {path} from row {offset}")
+                parsed_before = stats.rows_parsed
+                with open(path, "r", encoding="utf-8", newline="") as file:
+                    _import_stream(conn, cur, job_id, table, file, stats, changes,
+                                   file_index, offset, elapsed, chunk_size)
+                # Committed together with the progress below
+                record_source(cur, path, content_hash, size, stats.rows_parsed - parsed_before)
+                file_error = None
+            except (OSError, UnicodeDecodeError, csv.Error) as e:
+                conn.rollback()
+                file_error = f"Error reading file {path}: {e}"
+                print(f"Import job {job_id}: {file_error}")
+
+            _save_progress(cur, job_id, stats, file_index + 1, 0, elapsed(), file_error)
+            conn.commit()
+
+    _run(connect, job_id, body)
+
+
+def run_stream_job(connect: Callable[[], Any], job_id: int, file, chunk_size: int = CHUNK_SIZE) -> None:
+    """
+    Run a job whose single source is an already-open text stream (an upload).
+    Such jobs are created with resumable=False since the stream cannot be replayed.
+    """
+
+    def body(conn, cur, job, stats, changes, table, elapsed):
+        _import_stream(conn, cur, job_id, table, file, stats, changes, 0, 0, elapsed, chunk_size)
+        _save_progress(cur, job_id, stats, 1, 0, elapsed())
+        conn.commit()
+
+    _run(connect, job_id, body)
+
+
+def submit_import_job(connect: Callable[[], Any], job_id: int) -> None:
+    """Hand a queued job to the worker pool."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix="import-job")
+    _executor.submit(run_import_job, connect, job_id)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Live list membership events for GET /lists/events (server-sent events).
+
+The web interface used to re-fetch both lists after every add, remove or
+promote. Now the write endpoints announce each change and every open page
+patches its DOM from the event, including changes made by teammates.
+
+* notify() runs inside the write's transaction and sends a Postgres
+  NOTIFY on LIST_EVENTS_CHANNEL. Postgres delivers it only if the
+  transaction commits, to every API process, so events are never sent for
+  rolled-back writes and work with several workers.
+* ListEventHub keeps one LISTEN connection per process on a daemon thread.
+  It drains the pending notifications, loads the company payloads for all of
+  them at once (the `expand` callback) and hands each event to every
+  subscriber's asyncio queue.
+* stream() yields the SSE frames for one client. Event ids are
+  "<process token>-<n>". A client reconnecting with Last-Event-ID gets the
+  events it missed from a short in-memory backlog; if they are no longer
+  there (or came from another process), it gets a "reset" event and
+  reloads its lists. A client that falls too far behind gets the same.
+  Streams end after LIST_EVENTS_MAX_SECS and the browser reconnects with
+  Last-Event-ID. That bounds how long a graceful server shutdown waits for
+  open streams.
+
+Event types are "added", "removed" and "promoted". The data is JSON:
+{"list": slug, "from": slug (promoted only), "company_id": id, "company":
+{...} (as in GET /lists/{slug}), "totals": {slug: count}, "user": ...}.
+
+Uses psycopg2, like the core API.
+"""
+
+import asyncio
+import json
+import os
+import select
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from fast_json import dumps
+
+LIST_EVENTS_CHANNEL = "list_events"
+EVENT_TYPES = ("added", "removed", "promoted")
+
+BACKLOG_SIZE = int(os.getenv("LIST_EVENTS_BACKLOG", "500"))
+QUEUE_SIZE = int(os.getenv("LIST_EVENTS_QUEUE", "200"))
+HEARTBEAT_SECS = float(os.getenv("LIST_EVENTS_HEARTBEAT_SECS", "15"))
+MAX_STREAM_SECS = float(os.getenv("LIST_EVENTS_MAX_SECS", "120"))
+RETRY_MS = 3000
+RECONNECT_SECS = 5.0
+
+
+def notify(cur, event: str, list_slug: str, company_id: int, user: str,
+           from_list: Optional[str] = None) -> None:
+    """Queue a membership event; it is sent when the current transaction commits."""
+    payload = {"event": event, "list": list_slug, "company_id": company_id, "user": user}
+    if from_list is not None:
+        payload["from"] = from_list
+    cur.execute("SELECT pg_notify(%s, %s)", (LIST_EVENTS_CHANNEL, json.dumps(payload)))
+
+
+def format_event(event_id: Optional[str], event: str, data: Dict[str, Any]) -> str:
+    frame = f"event: {event}\ndata: {dumps(data).decode()}\n\n"
+    return f"id: {event_id}\n{frame}" if event_id else frame
+
+
+class _Subscriber:
+    __slots__ = ("loop", "queue")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: "asyncio.Queue[Tuple[Optional[str], str, Dict[str, Any]]]" = asyncio.Queue(QUEUE_SIZE)
+
+
+class ListEventHub:
+    """
+    `connect()` opens the dedicated LISTEN connection. `expand(company_ids)`
+    returns ({company_id: payload}, {slug: member count}).
+    """
+
+    def __init__(self, connect: Callable[[], Any],
+                 expand: Callable[[List[int]], Tuple[Dict[int, Dict[str, Any]], Dict[str, int]]]):
+        self._connect = connect
+        self._expand = expand
+        self._token = uuid.uuid4().hex[:8]
+        self._counter = 0
+        self._backlog: Deque[Tuple[int, str, Dict[str, Any]]] = deque(maxlen=BACKLOG_SIZE)
+        self._subscribers: Set[_Subscriber] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.delivered = 0
+
+    # ---- Listener thread ----
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="list-events", daemon=True)
+                self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        first = True
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {LIST_EVENTS_CHANNEL}")
+                if not first:
+                    # Notifications sent while we were disconnected are lost
+                    self._publish([("reset", {})])
+                first = False
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 1.0)[0]:
+                        conn.poll()
+                        pending = conn.notifies[:]
+                        del conn.notifies[:]
+                        if pending:
+                            self._dispatch([n.payload for n in pending])
+            except Exception as e:
+                print(f"List events: listener failed: {e}")
+                self._stop.wait(RECONNECT_SECS)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _dispatch(self, payloads: List[str]) -> None:
+        changes = []
+        for payload in payloads:
+            try:
+                change = json.loads(payload)
+            except ValueError:
+                continue
+            if change.get("event") in EVENT_TYPES:
+                changes.append(change)
+        if not changes:
+            return
+        companies, totals = self._expand(sorted({c["company_id"] for c in changes}))
+        events = []
+        for change in changes:
+            data = {"list": change["list"], "company_id": change["company_id"],
+                    "company": companies.get(change["company_id"]),
+                    "totals": totals, "user": change.get("user")}
+            if "from" in change:
+                data["from"] = change["from"]
+            events.append((change["event"], data))
+        self._publish(events)
+
+    def _publish(self, events: List[Tuple[str, Dict[str, Any]]]) -> None:
+        with self._lock:
+            numbered = []
+            for event, data in events:
+                if event != "reset":
+                    self._counter += 1
+                    self._backlog.append((self._counter, event, data))
+                    numbered.append((f"{self._token}-{self._counter}", event, data))
+                else:
+                    self._backlog.clear()
+                    numbered.append((None, event, data))
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(self._deliver, subscriber, numbered)
+            except RuntimeError:  # event loop closed
+                self._unsubscribe(subscriber)
+
+    def _deliver(self, subscriber: _Subscriber, events) -> None:
+        """On the subscriber's event loop."""
+        for event in events:
+            if subscriber.queue.full():
+                # Too far behind: drop what is queued and let the client reload
+                while not subscriber.queue.empty():
+                    subscriber.queue.get_nowait()
+                subscriber.queue.put_nowait((None, "reset", {}))
+                return
+            subscriber.queue.put_nowait(event)
+        self.delivered += len(events)
+
+    # ---- Subscribers ----
+
+    def _subscribe(self, last_event_id: Optional[str]) -> Tuple[_Subscriber, List[Tuple[Optional[str], str, Dict[str, Any]]]]:
+        subscriber = _Subscriber(asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscriber)
+            replay: List[Tuple[Optional[str], str, Dict[str, Any]]] = []
+            if last_event_id:
+                token, _, n = last_event_id.partition("-")
+                seen = int(n) if token == self._token and n.isdigit() else None
+                if seen is None or (seen < self._counter and
+                                    (not self._backlog or self._backlog[0][0] > seen + 1)):
+                    replay.append((None, "reset", {}))
+                else:
+                    replay.extend((f"{self._token}-{i}", event, data)
+                                  for i, event, data in self._backlog if i > seen)
+        return subscriber, replay
+
+    def _unsubscribe(self, subscriber: _Subscriber) -> None:
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    async def stream(self, last_event_id: Optional[str] = None,
+                     is_disconnected: Optional[Callable[[], Any]] = None) -> AsyncIterator[str]:
+        """SSE frames for one client until it disconnects."""
+        self.start()
+        subscriber, replay = self._subscribe(last_event_id)
+        deadline = time.monotonic() + MAX_STREAM_SECS
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            for event_id, event, data in replay:
+                yield format_event(event_id, event, data)
+            while not self._stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    event_id, event, data = await asyncio.wait_for(subscriber.queue.get(),
+                                                                   min(HEARTBEAT_SECS, remaining))
+                except asyncio.TimeoutError:
+                    if is_disconnected is not None and await is_disconnected():
+                        return
+                    yield f": ping {int(time.time())}\n\n"
+                    continue
+                yield format_event(event_id, event, data)
+        finally:
+            self._unsubscribe(subscriber)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"subscribers": len(self._subscribers), "events": self._counter,
+                    "delivered": self.delivered, "listening": self._thread is not None}
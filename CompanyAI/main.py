@@ -1,7 +1,24 @@
+import inspect
+
 from fastapi import FastAPI
 from company_management_api import app as core_app   # :8000 endpoints
 from gpt_api_endpoints import app as gpt_app        # :8001 endpoints
+import warmup
 
 app = FastAPI(title="CompanyAI")
+
+# Mounted apps' startup and shutdown hooks do not run; run them here
+@app.on_event("startup")
+async def start_warmup():
+    warmup.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    for mounted in (core_app, gpt_app):
+        for handler in mounted.router.on_shutdown:
+            result = handler()
+            if inspect.isawaitable(result):
+                await result
+
 app.mount("/", core_app)        # keeps your /search, /lists, /promote, /health
 app.mount("/gpt", gpt_app)      # exposes /gpt/companies/* & /gpt/health
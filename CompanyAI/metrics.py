@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Prometheus metrics for the API processes, served on /metrics.
+
+MetricsMiddleware records, per app, route template, method and status:
+
+* http_requests_total: requests answered
+* http_requests_in_flight: requests being handled now (open event streams
+  included)
+* http_request_duration_seconds: latency histogram, until the last body
+  byte was sent
+
+Requests that match no route are counted under route="unmatched", so
+scanners cannot blow up the number of series. A route that matches the
+path but not the method (405) keeps its template. Other modules record
+into the same process-wide registry:
+
+* openai_request_duration_seconds{operation, outcome}: observe_openai()
+* db_pool_connections{pool, state}: idle, in use and size of each
+  registered ConnectionPool (read at scrape time)
+* cache_requests_total{cache, result} and cache_hit_ratio{cache}: query
+  hits and misses of each registered ServingCache
+
+No client library is needed: render() writes the text exposition format.
+Each worker process keeps its own counts, so run one worker per scraped
+target (the default on Render), or scrape each worker.
+"""
+
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from starlette.routing import Match
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Labels:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[Sample]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Labels, List[float]] = {}  # per-bucket counts, then sum
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            counts[index] += 1  # index len(buckets) is the +Inf bucket
+            counts[-1] += value
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        out: List[Sample] = []
+        for key, counts in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                out.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            out.append((f"{self.name}_count", labels, cumulative))
+            out.append((f"{self.name}_sum", labels, counts[-1]))
+        return out
+
+
+class _Collected:
+    """Metric families whose samples are read from live objects at scrape time."""
+
+    def __init__(self, name: str, kind: str, documentation: str):
+        self.name = name
+        self.kind = kind
+        self.documentation = documentation
+        self.sources: List[Callable[[], Iterable[Tuple[Dict[str, str], float]]]] = []
+
+    def samples(self) -> List[Sample]:
+        out: List[Sample] = []
+        for source in list(self.sources):
+            try:
+                out.extend((self.name, labels, value) for labels, value in source())
+            except Exception as e:
+                print(f"Metrics: collecting {self.name} failed: {e}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric) -> None:
+        with self._lock:
+            self._metrics.setdefault(metric.name, metric)
+
+    def collected(self, name: str, kind: str, documentation: str) -> _Collected:
+        with self._lock:
+            family = self._metrics.get(name)
+            if family is None:
+                family = self._metrics[name] = _Collected(name, kind, documentation)
+            return family
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            samples = metric.samples()
+            if not samples:
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests answered",
+                        ("app", "method", "route", "status"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being handled",
+                       ("app", "method", "route"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency until the response was sent",
+                         ("app", "method", "route"))
+OPENAI_LATENCY = Histogram("openai_request_duration_seconds", "OpenAI API call latency",
+                           ("operation", "outcome"))
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# ---- Instrumented components ----
+
+@contextmanager
+def observe_openai(operation: str) -> Iterator[None]:
+    """Time one OpenAI call; outcome is "error" if it raised."""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        OPENAI_LATENCY.observe(time.perf_counter() - started, operation=operation, outcome=outcome)
+
+
+def register_pool(name: str, pool) -> None:
+    """Report a db_pool.ConnectionPool as db_pool_connections{pool=name}."""
+    def read():
+        stats = pool.stats()
+        return [({"pool": name, "state": state}, stats[state]) for state in ("idle", "in_use", "size")]
+
+    def opened():
+        stats = pool.stats()
+        return [({"pool": name}, stats["opened"])]
+
+    REGISTRY.collected("db_pool_connections", "gauge",
+                       "Connections of each pool by state (size is the idle limit)").sources.append(read)
+    REGISTRY.collected("db_pool_opened_total", "counter",
+                       "Connections each pool has opened").sources.append(opened)
+
+
+def register_cache(cache) -> None:
+    """Report a serving_cache.ServingCache's query hits and misses."""
+    def requests():
+        stats = cache.stats()["queries"]
+        return [({"cache": cache.name, "result": "hit"}, stats["hits"]),
+                ({"cache": cache.name, "result": "miss"}, stats["misses"])]
+
+    def ratio():
+        stats = cache.stats()["queries"]
+        total = stats["hits"] + stats["misses"]
+        return [({"cache": cache.name}, stats["hits"] / total)] if total else []
+
+    REGISTRY.collected("cache_requests_total", "counter",
+                       "Serving cache query lookups by result").sources.append(requests)
+    REGISTRY.collected("cache_hit_ratio", "gauge",
+                       "Share of serving cache query lookups answered from the cache").sources.append(ratio)
+
+
+# ---- Middleware ----
+
+class MetricsMiddleware:
+    """
+    Per-route request counts, in-flight gauge and latency for one app. The
+    route is matched against `router` before the request is handled, so the
+    in-flight gauge has it too.
+    """
+
+    def __init__(self, app, name: str, router):
+        self.app = app
+        self.name = name
+        self.router = router
+
+    def route_of(self, scope) -> str:
+        partial = None
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", "unmatched")
+            if match == Match.PARTIAL and partial is None:
+                partial = getattr(route, "path", None)
+        return partial or "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        labels = {"app": self.name, "method": scope["method"], "route": self.route_of(scope)}
+        status = 500
+
+        async def send_and_record(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(**labels)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_and_record)
+        finally:
+            HTTP_LATENCY.observe(time.perf_counter() - started, **labels)
+            HTTP_IN_FLIGHT.dec(**labels)
+            HTTP_REQUESTS.inc(**labels, status=str(status))
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Field projection and compact output for the GPT endpoints.
+
+The GPT action reads results inside a token budget, so the search and
+reached-out endpoints take three optional parameters:
+
+* fields=name,website,monthly_visits returns only those fields, in that
+  order. They become the SELECT list, so other columns are never read.
+* format=compact returns {"fields": [...], "columns": [[...], ...]}, one
+  array of values per field, instead of repeating every key in every row.
+* max_description=200 cuts descriptions to 200 characters and marks the cut
+  with an ellipsis. The cut is made in SQL (or by the catalog cache).
+"""
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+
+# Fields of all_companies the GPT endpoints return, in their default order
+SEARCH_FIELDS = ("name", "website", "vertical", "subvertical", "description", "location",
+                 "monthly_visits", "unique_visitors", "pages_per_visit", "adsense_enabled")
+REACHED_OUT_FIELDS = SEARCH_FIELDS + ("reached_out_date", "response_status")
+
+FORMATS = ("rows", "compact")
+ELLIPSIS = "…"
+
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str]) -> List[str]:
+    """The requested fields (all of `allowed` if none were given); 400 for unknown names."""
+    if not fields:
+        return list(allowed)
+    wanted = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in wanted if f not in allowed]
+    if unknown or not wanted:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown) or fields!r}. Available: {', '.join(allowed)}",
+        )
+    return wanted
+
+
+def check_format(format: str) -> None:
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(FORMATS)}")
+
+
+def select_list(fields: Sequence[str], max_description: Optional[int] = None) -> Tuple[str, List[Any]]:
+    """SELECT list for `fields` and its parameters, truncating description in SQL."""
+    columns, params = [], []
+    for field in fields:
+        if field == "description" and max_description:
+            columns.append(
+                f"CASE WHEN length(description) > %s THEN left(description, %s) || '{ELLIPSIS}' "
+                "ELSE description END AS description"
+            )
+            params.extend([max_description, max_description])
+        else:
+            columns.append(field)
+    return ", ".join(columns), params
+
+
+def truncate(text: Optional[str], max_chars: Optional[int]) -> Optional[str]:
+    if text is None or not max_chars or len(text) <= max_chars:
+        return text
+    return text[:max_chars] + ELLIPSIS
+
+
+def result(fields: Sequence[str], rows: Optional[Sequence[Sequence[Any]]], format: str = "rows",
+           max_description: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    {"count": ..., "companies": ...} from tuple rows in `fields` order. Pass
+    max_description only for rows the SQL did not truncate already. None
+    passes through (the cache could not answer).
+    """
+    if rows is None:
+        return None
+    fields = list(fields)
+    if max_description and "description" in fields:
+        at = fields.index("description")
+        rows = [row[:at] + (truncate(row[at], max_description),) + row[at + 1:] for row in map(tuple, rows)]
+    if format == "compact":
+        columns = [list(column) for column in zip(*rows)] if rows else [[] for _ in fields]
+        return {"count": len(rows), "companies": {"fields": fields, "columns": columns}}
+    return {"count": len(rows), "companies": [dict(zip(fields, row)) for row in rows]}
@@ -5,6 +5,7 @@ CREATE EXTENSION IF NOT EXISTS vector;
 CREATE TABLE IF NOT EXISTS companies (
   company_id        BIGSERIAL PRIMARY KEY,
   domain            TEXT UNIQUE NOT NULL,
+  domain_key        TEXT UNIQUE,   -- canonical host, see domain_keys.py; all lookups use it
   name              TEXT,
   website_url       TEXT,
   country           TEXT,
@@ -14,9 +15,10 @@ CREATE TABLE IF NOT EXISTS companies (
   created_at        TIMESTAMPTZ DEFAULT now(),
   updated_at        TIMESTAMPTZ DEFAULT now()
 );
-CREATE INDEX ON companies ((lower(domain)));
 
--- 2) Similarweb monthly metrics (wide-ish fact)
+-- 2) Similarweb monthly metrics (wide-ish fact), one range partition per month.
+--    Partitions are created by metrics_partitions.py (loaders call
+--    ensure_partitions; run it from cron for future months and retention).
 CREATE TABLE IF NOT EXISTS company_metrics_monthly (
   company_id        BIGINT REFERENCES companies(company_id),
   month             DATE NOT NULL,         -- first day of month
@@ -28,8 +30,8 @@ CREATE TABLE IF NOT EXISTS company_metrics_monthly (
   page_views        DOUBLE PRECISION,
   load_ts           TIMESTAMPTZ DEFAULT now(),
   PRIMARY KEY (company_id, month, country)
-);
-CREATE INDEX ON company_metrics_monthly (month);
+) PARTITION BY RANGE (month);
+CREATE INDEX IF NOT EXISTS company_metrics_monthly_month_brin ON company_metrics_monthly USING brin (month);
 CREATE INDEX ON company_metrics_monthly (country);
 
 -- 3) Lists (flexible named buckets)
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+Serving caches that survive restarts.
+
+A ServingCache holds named sections, e.g. the company catalog, the stats
+snapshot or list memberships. Each section is derived from a few tables and
+knows how to load itself from the database. The cache also keeps an LRU of
+query results computed from the sections.
+
+* Snapshots: write_snapshot() stores every section, the table versions it was
+  built from and the most used query results in one local file. The cache
+  writes one at most every CACHE_SNAPSHOT_SECS after a section was reloaded,
+  and on shutdown. The format is a small JSON header followed by raw, 64-byte
+  aligned numpy arrays and byte blobs. load_snapshot() maps the file and
+  wraps those regions without copying them, so a restart serves warm data
+  after a few milliseconds.
+* Reconciling: reconcile() compares each section's table versions
+  (data_versions.py) with the database and reloads only stale sections. The
+  versions and the data are read in one REPEATABLE READ transaction. A
+  background thread does this every CACHE_RECONCILE_SECS; wake() makes it run
+  right away, for example after a write by this process. Reloading a section
+  clears the query results.
+* watermark(name) gives the table versions and change time a section was
+  built from, for ETag and Last-Modified headers (http_cache.py).
+* fresh(conn, name) checks one section against the database inside a request
+  and reloads it first if it is stale. It is for small sections that must
+  reflect the caller's own writes.
+
+numpy is imported when a snapshot is read or written, not at import time.
+
+Works with both psycopg (v3) and psycopg2 connections.
+"""
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from data_versions import ensure_data_versions, read_versions, read_watermark
+
+CACHE_DIR = os.getenv("CACHE_SNAPSHOT_DIR", os.path.join(tempfile.gettempdir(), "companyai-cache"))
+RECONCILE_SECS = float(os.getenv("CACHE_RECONCILE_SECS", "5"))
+SNAPSHOT_SECS = float(os.getenv("CACHE_SNAPSHOT_SECS", "300"))
+QUERY_CACHE_SIZE = int(os.getenv("CACHE_QUERY_ENTRIES", "512"))
+PERSISTED_QUERIES = int(os.getenv("CACHE_PERSISTED_QUERIES", "128"))
+
+MAGIC = b"CAISNAP1"
+ALIGN = 64
+
+
+def _align(n: int) -> int:
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _json_hook(obj):
+    if len(obj) == 1:
+        if "__datetime__" in obj:
+            return datetime.fromisoformat(obj["__datetime__"])
+        if "__date__" in obj:
+            return date.fromisoformat(obj["__date__"])
+    return obj
+
+
+class Blob:
+    """Bytes held in memory or in a mapped snapshot file (a region of `buf`)."""
+
+    __slots__ = ("buf", "start", "size")
+
+    def __init__(self, buf, start: int = 0, size: Optional[int] = None):
+        self.buf = buf
+        self.start = start
+        self.size = len(buf) - start if size is None else size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def find(self, sub: bytes, start: int = 0, end: Optional[int] = None) -> int:
+        end = self.size if end is None else end
+        pos = self.buf.find(sub, self.start + start, self.start + end)
+        return pos - self.start if pos >= 0 else -1
+
+    def slice(self, start: int, end: int) -> bytes:
+        return self.buf[self.start + start:self.start + end]
+
+    def view(self) -> memoryview:
+        return memoryview(self.buf)[self.start:self.start + self.size]
+
+
+@dataclass
+class Section:
+    """
+    One cached dataset. load(conn) runs inside the reconcile transaction and
+    must only read. dump(value) returns (JSON-able meta, {key: numpy array or
+    Blob}) and restore(meta, arrays) rebuilds the value; without them the
+    value itself is stored as JSON. Bump `version` when the dumped layout
+    changes so older snapshot files are ignored.
+    """
+    name: str
+    tables: Tuple[str, ...]
+    load: Callable[[Any], Any]
+    dump: Optional[Callable[[Any], Tuple[Any, Dict[str, Any]]]] = None
+    restore: Optional[Callable[[Any, Dict[str, Any]], Any]] = None
+    version: int = 1
+
+
+class ServingCache:
+    def __init__(self, name: str, directory: str = CACHE_DIR):
+        self.name = name
+        self.path = os.path.join(directory, f"{name}.snap")
+        self._sections: Dict[str, Section] = {}
+        self._values: Dict[str, Any] = {}
+        self._versions: Dict[str, Dict[str, str]] = {}
+        self._changed: Dict[str, Optional[datetime]] = {}
+        self._queries: "OrderedDict[str, List[Any]]" = OrderedDict()
+        self._generation = 0
+        self._dirty = False          # a section changed since the last snapshot
+        self._queries_dirty = False  # only query results did
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._connect: Optional[Callable[[], Any]] = None
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.snapshot: Dict[str, Any] = {}
+
+    def register(self, section: Section) -> None:
+        self._sections.setdefault(section.name, section)
+
+    def get(self, name: str) -> Optional[Any]:
+        """The section's current value, or None if it has not been loaded."""
+        return self._values.get(name)
+
+    def watermark(self, name: str) -> Optional[Tuple[Dict[str, str], Optional[datetime]]]:
+        """
+        (table versions, last change) the section's current value was built
+        from; None if it is not loaded. Read it before the value, so a reload
+        in between can only make the value newer than the watermark.
+        """
+        with self._lock:
+            if name not in self._values:
+                return None
+            return self._versions[name], self._changed.get(name)
+
+    # ---- Query results ----
+
+    def query(self, key: Tuple, section: str, compute: Callable[[Any], Any]) -> Optional[Any]:
+        """
+        compute(value of `section`) through the LRU of query results. Returns
+        None without caching if the section is not loaded or compute returns
+        None (meaning it cannot answer from the cache).
+        """
+        cache_key = json.dumps(list(key), default=str)
+        with self._lock:
+            entry = self._queries.get(cache_key)
+            if entry is not None:
+                self._queries.move_to_end(cache_key)
+                entry[1] += 1
+                self.hits += 1
+                return entry[0]
+            generation = self._generation
+            value = self._values.get(section)
+        if value is None:
+            return None
+        result = compute(value)
+        if result is None:
+            return None
+        with self._lock:
+            self.misses += 1
+            if generation == self._generation:
+                self._queries[cache_key] = [result, 1]
+                while len(self._queries) > QUERY_CACHE_SIZE:
+                    self._queries.popitem(last=False)
+                self._queries_dirty = True
+        return result
+
+    # ---- Reconciling with the database ----
+
+    def reconcile(self, conn, names: Optional[Iterable[str]] = None) -> List[str]:
+        """Reload the sections (default: all) whose tables changed; returns the reloaded names."""
+        sections = [self._sections[n] for n in (names if names is not None else self._sections)]
+        tables = sorted({t for s in sections for t in s.tables})
+        with self._reload_lock:
+            ensure_data_versions(conn, tables)
+            cur = conn.cursor()
+            try:
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                versions = read_versions(cur, tables)
+                loaded = {}
+                for section in sections:
+                    wanted = {t: versions[t] for t in section.tables}
+                    if self._versions.get(section.name) != wanted:
+                        changed = read_watermark(cur, section.tables)[1]
+                        loaded[section.name] = (section.load(conn), wanted, changed)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+            if loaded:
+                with self._lock:
+                    for name, (value, wanted, changed) in loaded.items():
+                        self._values[name] = value
+                        self._versions[name] = wanted
+                        self._changed[name] = changed
+                    self._queries.clear()
+                    self._generation += 1
+                    self._dirty = True
+                    self.reloads += len(loaded)
+        return list(loaded)
+
+    def fresh(self, conn, name: str) -> Any:
+        """The section checked against the database now, reloaded first if stale."""
+        if name in self._versions:
+            cur = conn.cursor()
+            try:
+                versions = read_versions(cur, self._sections[name].tables)
+            finally:
+                cur.close()
+            if versions == self._versions[name]:
+                with self._lock:
+                    self.hits += 1
+                return self._values[name]
+        with self._lock:
+            self.misses += 1
+        self.reconcile(conn, [name])
+        return self._values[name]
+
+    def refresh(self) -> List[str]:
+        conn = self._connect()
+        try:
+            return self.reconcile(conn)
+        finally:
+            conn.close()
+
+    def warm(self, connect: Callable[[], Any]) -> None:
+        """
+        Startup: serve the snapshot if there is one and reconcile in the
+        background; otherwise load from the database before returning.
+        """
+        self._connect = connect
+        if self.load_snapshot():
+            self._wake.set()
+        else:
+            self.refresh()
+        self.start()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-cache", daemon=True)
+            self._thread.start()
+
+    def wake(self) -> None:
+        """Reconcile now instead of at the next interval."""
+        self._wake.set()
+
+    def _run(self) -> None:
+        last_snapshot = time.monotonic() if self.snapshot.get("loaded_ms") is not None else 0.0
+        while not self._stop.is_set():
+            self._wake.wait(RECONCILE_SECS)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                reloaded = self.refresh()
+                if reloaded:
+                    print(f"Serving cache {self.name}: reloaded {', '.join(reloaded)}")
+            except Exception as e:
+                print(f"Serving cache {self.name}: reconcile failed: {e}")
+            if self._dirty and time.monotonic() - last_snapshot >= SNAPSHOT_SECS:
+                last_snapshot = time.monotonic()
+                self.write_snapshot_safely()
+
+    def close(self) -> None:
+        """Stop reconciling and write a final snapshot if anything changed."""
+        self._stop.set()
+        self._wake.set()
+        if self._dirty or self._queries_dirty:
+            self.write_snapshot_safely()
+
+    # ---- Snapshot file ----
+
+    def write_snapshot(self) -> int:
+        """Write all loaded sections to the snapshot file (atomically); returns its size."""
+        import numpy as np
+
+        with self._lock:
+            values = dict(self._values)
+            versions = dict(self._versions)
+            changed = dict(self._changed)
+            queries = sorted(self._queries.items(), key=lambda item: item[1][1], reverse=True)
+            queries = [[key, entry[0]] for key, entry in queries[:PERSISTED_QUERIES]]
+            self._dirty = self._queries_dirty = False
+
+        header: Dict[str, Any] = {"cache": self.name, "written_at": time.time(),
+                                  "sections": {}, "queries": queries}
+        chunks = []
+        offset = 0
+        for name, value in values.items():
+            section = self._sections[name]
+            meta, arrays = section.dump(value) if section.dump else (value, {})
+            layout = {}
+            for key, array in arrays.items():
+                if isinstance(array, Blob):
+                    data, spec = array.view(), ["blob", None, None]
+                else:
+                    array = np.ascontiguousarray(array)
+                    data, spec = memoryview(array.reshape(-1).view(np.uint8)), ["array", array.dtype.str, list(array.shape)]
+                offset = _align(offset)
+                layout[key] = spec + [offset, len(data)]
+                chunks.append((offset, data))
+                offset += len(data)
+            header["sections"][name] = {"version": section.version, "tables": versions[name],
+                                        "changed_at": changed.get(name), "meta": meta, "arrays": layout}
+
+        head = json.dumps(header, default=_json_default).encode()
+        base = _align(len(MAGIC) + 8 + len(head))
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(MAGIC + struct.pack("<Q", len(head)) + head)
+                for chunk_offset, data in chunks:
+                    f.seek(base + chunk_offset)
+                    f.write(data)
+                f.truncate(base + offset)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.snapshot.update({"path": self.path, "bytes": base + offset, "written_at": header["written_at"]})
+        return base + offset
+
+    def write_snapshot_safely(self) -> None:
+        try:
+            size = self.write_snapshot()
+            print(f"Serving cache {self.name}: wrote {size / 1e6:.1f} MB snapshot to {self.path}")
+        except Exception as e:
+            self._dirty = True
+            print(f"Serving cache {self.name}: snapshot write failed: {e}")
+
+    def load_snapshot(self) -> bool:
+        """Map the snapshot file and serve its sections; False if there is no usable snapshot."""
+        started = time.perf_counter()
+        try:
+            with open(self.path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        try:
+            import numpy as np
+
+            if mapped[:len(MAGIC)] != MAGIC:
+                raise ValueError("not a snapshot file")
+            (head_len,) = struct.unpack_from("<Q", mapped, len(MAGIC))
+            header = json.loads(mapped[len(MAGIC) + 8:len(MAGIC) + 8 + head_len], object_hook=_json_hook)
+            base = _align(len(MAGIC) + 8 + head_len)
+
+            values, versions, changed = {}, {}, {}
+            for name, entry in header["sections"].items():
+                section = self._sections.get(name)
+                if section is None or entry["version"] != section.version:
+                    continue
+                arrays = {}
+                for key, (kind, dtype, shape, offset, size) in entry["arrays"].items():
+                    if kind == "blob":
+                        arrays[key] = Blob(mapped, base + offset, size)
+                    elif size == 0:
+                        arrays[key] = np.empty(shape, dtype=dtype)
+                    else:
+                        count = size // np.dtype(dtype).itemsize
+                        arrays[key] = np.frombuffer(mapped, dtype=dtype, count=count, offset=base + offset).reshape(shape)
+                values[name] = section.restore(entry["meta"], arrays) if section.restore else entry["meta"]
+                versions[name] = entry["tables"]
+                changed[name] = entry.get("changed_at")
+        except Exception as e:
+            print(f"Serving cache {self.name}: ignoring snapshot {self.path}: {e}")
+            return False
+
+        with self._lock:
+            if self._versions:
+                return False  # already reconciled from the database
+            self._values.update(values)
+            self._versions.update(versions)
+            self._changed.update(changed)
+            if len(values) == len(header["sections"]):
+                self._queries.update((key, [value, 0]) for key, value in header["queries"])
+        self.snapshot = {
+            "path": self.path, "bytes": len(mapped), "written_at": header["written_at"],
+            "loaded_ms": round((time.perf_counter() - started) * 1000, 2), "sections": sorted(values),
+        }
+        print(f"Serving cache {self.name}: loaded snapshot in {self.snapshot['loaded_ms']} ms")
+        return bool(values)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sections": {name: self._versions[name] for name in self._values},
+                "queries": {"entries": len(self._queries), "hits": self.hits, "misses": self.misses},
+                "reloads": self.reloads,
+                "snapshot": dict(self.snapshot),
+            }
@@ -3,7 +3,9 @@
 similarweb_to_postgres.py
 
 Submit a Similarweb Batch API report for the Websites "traffic_and_engagement" table,
-wait for completion, download CSV, and load into PostgreSQL with simple upserts.
+wait for completion, stream the CSV download and COPY it into PostgreSQL through a
+staging table merged into sw_traffic_engagement. Memory use stays flat regardless of
+report size.
 
 Usage:
   1) Copy .env.example to .env and fill in values
@@ -17,18 +19,24 @@ Notes:
 
 import csv
 import io
+import math
 import os
 import time
 from dataclasses import dataclass
-from typing import Dict, List, Any, Optional
+from typing import Dict, Iterable, Iterator, List, Any, Optional, TextIO
 
 import requests
 import psycopg2
-from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 
-BATCH_REQUEST_URL = "https://api.similarweb.com/batch/v4/request-report"
-BATCH_QUERY_URL = "https://api.similarweb.com/v3/batch/request-query"  # expects ?report_id=...
+from metrics_bridge import SW_TRAFFIC_SQL, bridge_domains
+from metrics_partitions import ensure_partitions_for
+from similarweb_reports import ReportRegistry, report_fingerprint
+from stats_snapshot import refresh_stats_snapshot_safely
+
+API_BASE = "https://api.similarweb.com"
+BATCH_REQUEST_PATH = "/batch/v4/request-report"
+BATCH_QUERY_PATH = "/v3/batch/request-query"  # expects ?report_id=...
 
 # ---- Config helpers ----
 
@@ -41,6 +49,15 @@ class Settings:
     start_date: str
     end_date: str
     metrics: List[str] = None
+    api_base: str = API_BASE  # point at a local stand-in server for testing
+
+    @property
+    def request_url(self) -> str:
+        return self.api_base.rstrip("/") + BATCH_REQUEST_PATH
+
+    @property
+    def query_url(self) -> str:
+        return self.api_base.rstrip("/") + BATCH_QUERY_PATH
 
     def __post_init__(self):
         if self.metrics is None:
@@ -71,13 +88,19 @@ def load_settings() -> Settings:
     countries = [c.strip() for c in os.getenv("COUNTRIES", "WW").split(",") if c.strip()]
     start_date = os.getenv("START_DATE", "2024-01")
     end_date = os.getenv("END_DATE", "2024-12")
-    return Settings(api_key, pg_dsn, domains, countries, start_date, end_date)
+    api_base = os.getenv("SIMILARWEB_API_BASE", API_BASE)
+    return Settings(api_key, pg_dsn, domains, countries, start_date, end_date, api_base=api_base)
 
 
 # ---- API ----
 
-def submit_report(s: Settings) -> str:
-    payload = {
+def report_payload(s: Settings, domains: Optional[List[str]] = None, countries: Optional[List[str]] = None,
+                   start_date: Optional[str] = None, end_date: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Batch API request body. The optional arguments override the settings for
+    one shard or one planned gap of a larger run.
+    """
+    return {
         "delivery_information": {
             "response_format": "csv",
             "delivery_method": "download_link"
@@ -88,31 +111,64 @@ def submit_report(s: Settings) -> str:
                     "vtable": "traffic_and_engagement",
                     "granularity": "monthly",
                     "filters": {
-                        "domains": s.domains,
-                        "countries": s.countries,
+                        "domains": domains if domains is not None else s.domains,
+                        "countries": countries or s.countries,
                         "include_subdomains": True
                     },
                     "metrics": s.metrics,
-                    "start_date": s.start_date,
-                    "end_date": s.end_date
+                    "start_date": start_date or s.start_date,
+                    "end_date": end_date or s.end_date
                 }
             ]
         },
         "report_name": "sw_traffic_and_engagement"
     }
-    headers = {
+
+
+def submit_headers(s: Settings) -> Dict[str, str]:
+    return {
         "Content-Type": "application/json",
         "api-key": s.api_key   # Batch API uses 'api-key' header
     }
-    r = requests.post(BATCH_REQUEST_URL, json=payload, headers=headers, timeout=60)
-    r.raise_for_status()
-    data = r.json()
+
+
+def parse_report_id(data: Dict[str, Any]) -> str:
     report_id = data.get("report_id") or data.get("id") or data.get("reportId")
     if not report_id:
         raise RuntimeError(f"Could not parse report_id from response: {data}")
     return report_id
 
 
+class ReportFailed(RuntimeError):
+    """The API reports the report itself as failed; it will not produce a download link."""
+
+
+FAILED_STATUSES = ("failed", "error", "cancelled", "canceled")
+
+
+def ready_download_link(data: Dict[str, Any]) -> Optional[str]:
+    """Download link of a finished report, or None while it is still running."""
+    status = (data.get("status") or data.get("report_status") or "").lower()
+    download_link = data.get("download_link") or data.get("report_download_url") or None
+    if status in FAILED_STATUSES:
+        raise ReportFailed(f"report status {status!r}: {data}")
+
+    if download_link and status in ("completed", "success", "ready"):
+        return download_link
+
+    # Sometimes the API returns a list of files; try to detect a link there
+    files = data.get("files") or []
+    if files and isinstance(files, list) and "url" in files[0]:
+        return files[0]["url"]
+    return None
+
+
+def submit_report(s: Settings) -> str:
+    r = requests.post(s.request_url, json=report_payload(s), headers=submit_headers(s), timeout=60)
+    r.raise_for_status()
+    return parse_report_id(r.json())
+
+
 def wait_for_report(s: Settings, report_id: str, timeout_sec: int = 900, poll_every: int = 10) -> Dict[str, Any]:
     """
     Poll the request-query endpoint until status is 'completed' and a download link exists.
@@ -121,7 +177,7 @@ def wait_for_report(s: Settings, report_id: str, timeout_sec: int = 900, poll_ev
     deadline = time.time() + timeout_sec
     last = None
     while time.time() < deadline:
-        r = requests.get(BATCH_QUERY_URL, params={"report_id": report_id}, headers=headers, timeout=30)
+        r = requests.get(s.query_url, params={"report_id": report_id}, headers=headers, timeout=30)
         if r.status_code == 404:
             # slight delay and retry
             time.sleep(poll_every)
@@ -129,32 +185,60 @@ def wait_for_report(s: Settings, report_id: str, timeout_sec: int = 900, poll_ev
         r.raise_for_status()
         last = r.json()
 
-        status = (last.get("status") or last.get("report_status") or "").lower()
-        download_link = last.get("download_link") or last.get("report_download_url") or None
-
-        if download_link and status in ("completed", "success", "ready"):
+        download_link = ready_download_link(last)
+        if download_link:
             return {"download_link": download_link, "raw": last}
 
-        # Sometimes the API returns a list of files; try to detect a link there
-        files = last.get("files") or []
-        if files and isinstance(files, list) and "url" in files[0]:
-            return {"download_link": files[0]["url"], "raw": last}
-
         time.sleep(poll_every)
 
     raise TimeoutError(f"Report {report_id} not ready before timeout; last={last}")
 
 
-def download_csv(url: str) -> str:
-    r = requests.get(url, timeout=120)
-    r.raise_for_status()
-    return r.text
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+LOAD_BATCH_SIZE = 50_000
+
+
+class _ChunkStream(io.RawIOBase):
+    """Read-only byte stream over an iterator of chunks (Response.iter_content)."""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._buf = memoryview(b"")
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buf:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._buf = memoryview(chunk)
+            self.bytes_read += len(chunk)
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
 
 
 # ---- Postgres ----
 
-CREATE_SQL = """
-CREATE TABLE IF NOT EXISTS sw_traffic_engagement (
+# sw_traffic_engagement; shared with the REST enrichment client
+CREATE_SQL = SW_TRAFFIC_SQL
+
+METRIC_COLUMNS = [
+    "all_traffic_visits",
+    "all_traffic_pages_per_visit",
+    "all_traffic_average_visit_duration",
+    "all_traffic_bounce_rate",
+    "all_page_views",
+]
+SW_COLUMNS = ["domain", "country", "date"] + METRIC_COLUMNS
+
+STAGING_SQL = """
+CREATE TEMP TABLE IF NOT EXISTS sw_staging (
+  row_no              BIGINT NOT NULL,
   domain              TEXT NOT NULL,
   country             TEXT NOT NULL,
   date                DATE NOT NULL,
@@ -162,97 +246,217 @@ CREATE TABLE IF NOT EXISTS sw_traffic_engagement (
   all_traffic_pages_per_visit DOUBLE PRECISION,
   all_traffic_average_visit_duration DOUBLE PRECISION,
   all_traffic_bounce_rate DOUBLE PRECISION,
-  all_page_views      DOUBLE PRECISION,
-  load_ts             TIMESTAMPTZ DEFAULT NOW(),
-  PRIMARY KEY (domain, country, date)
-);
+  all_page_views      DOUBLE PRECISION
+) ON COMMIT DROP;
 """
 
-def parse_rows(csv_text: str) -> List[Dict[str, Any]]:
-    buf = io.StringIO(csv_text)
-    reader = csv.DictReader(buf)
-    rows = []
-    for row in reader:
-        # Expecting columns like: domain,country,date,all_traffic_visits,...
-        rows.append({
-            "domain": row.get("domain") or row.get("Domain") or row.get("website") or "",
-            "country": row.get("country") or row.get("Country") or row.get("geo") or "WW",
-            "date": row.get("date") or row.get("Date"),
-            "all_traffic_visits": row.get("all_traffic_visits"),
-            "all_traffic_pages_per_visit": row.get("all_traffic_pages_per_visit"),
-            "all_traffic_average_visit_duration": row.get("all_traffic_average_visit_duration"),
-            "all_traffic_bounce_rate": row.get("all_traffic_bounce_rate"),
-            "all_page_views": row.get("all_page_views"),
-        })
-    return rows
-
-
-def upsert_rows(dsn: str, rows: List[Dict[str, Any]]):
-    if not rows:
-        print("No rows to load.")
-        return
+# Last row of the report wins when a (domain, country, date) repeats
+MERGE_SQL = f"""
+INSERT INTO sw_traffic_engagement ({",".join(SW_COLUMNS)})
+SELECT DISTINCT ON (domain, country, date) {",".join(SW_COLUMNS)}
+FROM sw_staging
+ORDER BY domain, country, date, row_no DESC
+ON CONFLICT (domain, country, date) DO UPDATE SET
+  all_traffic_visits = EXCLUDED.all_traffic_visits,
+  all_traffic_pages_per_visit = EXCLUDED.all_traffic_pages_per_visit,
+  all_traffic_average_visit_duration = EXCLUDED.all_traffic_average_visit_duration,
+  all_traffic_bounce_rate = EXCLUDED.all_traffic_bounce_rate,
+  all_page_views = EXCLUDED.all_page_views,
+  load_ts = NOW();
+"""
 
-    with psycopg2.connect(dsn) as conn:
-        with conn.cursor() as cur:
-            cur.execute(CREATE_SQL)
-            cols = [
-                "domain","country","date",
-                "all_traffic_visits","all_traffic_pages_per_visit",
-                "all_traffic_average_visit_duration","all_traffic_bounce_rate",
-                "all_page_views"
-            ]
-            values = [
-                (
-                    r["domain"],
-                    r["country"],
-                    r["date"],
-                    _to_float(r["all_traffic_visits"]),
-                    _to_float(r["all_traffic_pages_per_visit"]),
-                    _to_float(r["all_traffic_average_visit_duration"]),
-                    _to_float(r["all_traffic_bounce_rate"]),
-                    _to_float(r["all_page_views"]),
-                )
-                for r in rows
-            ]
-            insert_sql = f"""
-                INSERT INTO sw_traffic_engagement ({",".join(cols)})
-                VALUES %s
-                ON CONFLICT (domain, country, date) DO UPDATE SET
-                  all_traffic_visits = EXCLUDED.all_traffic_visits,
-                  all_traffic_pages_per_visit = EXCLUDED.all_traffic_pages_per_visit,
-                  all_traffic_average_visit_duration = EXCLUDED.all_traffic_average_visit_duration,
-                  all_traffic_bounce_rate = EXCLUDED.all_traffic_bounce_rate,
-                  all_page_views = EXCLUDED.all_page_views,
-                  load_ts = NOW();
-            """
-            execute_values(cur, insert_sql, values)
-        conn.commit()
-
-
-def _to_float(x: Optional[str]) -> Optional[float]:
+
+@dataclass
+class LoadStats:
+    rows_read: int = 0
+    rows_skipped: int = 0
+    rows_merged: int = 0
+    metrics_rows: int = 0
+    visits_updated: int = 0
+    bytes_read: int = 0
+    elapsed_secs: float = 0.0
+
+    def summary(self) -> str:
+        secs = self.elapsed_secs or 1e-9
+        mb = self.bytes_read / 1e6
+        return (
+            f"{self.rows_read} rows ({mb:.1f} MB) in {self.elapsed_secs:.1f}s: "
+            f"{self.rows_read / secs:,.0f} rows/s, {mb / secs:.1f} MB/s, "
+            f"{self.rows_merged} merged, {self.rows_skipped} skipped; "
+            f"{self.metrics_rows} company metric rows, {self.visits_updated} monthly_visits updated"
+        )
+
+
+def _report_date(value: str) -> Optional[str]:
+    """Monthly reports may give dates as YYYY-MM; DATE needs a day."""
+    value = value.strip()
+    if len(value) == 7:
+        return value + "-01"
+    return value or None
+
+
+def _float_cell(x: str) -> str:
+    """
+    Validated metric cell for COPY: the text itself if it is a finite number,
+    else "" (NULL). NaN and Infinity would be stored as such and break the
+    ROUND()::BIGINT casts of bridge_domains.
+    """
     try:
-        return float(x) if x not in (None, "", "null") else None
-    except Exception:
-        return None
+        v = float(x)
+    except ValueError:
+        return ""
+    return "" if "_" in x or not math.isfinite(v) else x
 
 
-def main():
-    s = load_settings()
-    print(f"Submitting report for {len(s.domains)} domains, countries={s.countries}, {s.start_date}..{s.end_date}")
-    report_id = submit_report(s)
-    print("Report ID:", report_id)
+def iter_report_batches(file: TextIO, stats: LoadStats,
+                        batch_size: int = LOAD_BATCH_SIZE) -> Iterator[List[list]]:
+    """
+    Read a report CSV incrementally and yield validated staging rows
+    (row_no, domain, country, date, metrics...) in batches. Metric cells that
+    are not finite numbers become NULL; valid ones keep their text so they
+    are not formatted twice.
+    """
+    reader = csv.reader(file)
+    header = next(reader, None)
+    if header is None:
+        return
+    index = {name: i for i, name in enumerate(header)}
+
+    def column(*names):
+        return next((index[n] for n in names if n in index), None)
 
-    print("Waiting for report to be ready...")
-    result = wait_for_report(s, report_id)
-    print("Download link:", result["download_link"])
+    domain_i = column("domain", "Domain", "website")
+    country_i = column("country", "Country", "geo")
+    date_i = column("date", "Date")
+    metric_i = [index.get(m) for m in METRIC_COLUMNS]
+    width = max([len(header)] + [i + 1 for i in metric_i if i is not None])
+
+    batch = []
+    for row in reader:
+        stats.rows_read += 1
+        if len(row) < width:
+            row += [""] * (width - len(row))
+        domain = row[domain_i] if domain_i is not None else ""
+        day = _report_date(row[date_i]) if date_i is not None else None
+        if not domain or not day:
+            stats.rows_skipped += 1
+            continue
+        country = (row[country_i] if country_i is not None else "") or "WW"
+        values = [stats.rows_read, domain, country, day]
+        values.extend([_float_cell(row[i]) if i is not None else "" for i in metric_i])
+        batch.append(values)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def copy_report(dsn: str, file: TextIO, batch_size: int = LOAD_BATCH_SIZE,
+                stats: Optional[LoadStats] = None) -> LoadStats:
+    """
+    COPY a report CSV stream into a staging table, merge it and bridge the
+    loaded domains into the company tables, all in one transaction.
+    """
+    stats = stats or LoadStats()
+    copy_sql = f"COPY sw_staging (row_no,{','.join(SW_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(CREATE_SQL)
+                cur.execute(STAGING_SQL)
+                for batch in iter_report_batches(file, stats, batch_size):
+                    buf = io.StringIO()
+                    csv.writer(buf).writerows(batch)
+                    buf.seek(0)
+                    cur.copy_expert(copy_sql, buf)
+                ensure_partitions_for(cur, "sw_traffic_engagement",
+                                      "SELECT MIN(date), MAX(date) FROM sw_staging")
+                cur.execute(MERGE_SQL)
+                stats.rows_merged = cur.rowcount
+
+                cur.execute("SELECT DISTINCT domain FROM sw_staging")
+                bridged = bridge_domains(cur, [row[0] for row in cur.fetchall()])
+                stats.metrics_rows = bridged["metrics_rows"]
+                stats.visits_updated = bridged["visits_updated"]
+    finally:
+        conn.close()
+
+    if stats.visits_updated:
+        refresh_stats_snapshot_safely(lambda: psycopg2.connect(dsn))
+    return stats
+
+
+def stream_load_report(dsn: str, url: str, batch_size: int = LOAD_BATCH_SIZE) -> LoadStats:
+    """
+    Download a report with iter_content straight into the incremental CSV
+    reader and COPY it batch by batch; only one batch is held in memory.
+    """
+    stats = LoadStats()
+    started = time.perf_counter()
+    with requests.get(url, stream=True, timeout=120) as r:
+        r.raise_for_status()
+        raw = _ChunkStream(r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE))
+        text = io.TextIOWrapper(io.BufferedReader(raw, DOWNLOAD_CHUNK_SIZE), encoding="utf-8-sig", newline="")
+        copy_report(dsn, text, batch_size, stats)
+        stats.bytes_read = raw.bytes_read
+    stats.elapsed_secs = time.perf_counter() - started
+    return stats
 
-    print("Downloading CSV...")
-    csv_text = download_csv(result["download_link"])
 
-    print("Parsing + loading into Postgres...")
-    rows = parse_rows(csv_text)
-    upsert_rows(s.pg_dsn, rows)
-    print(f"Done. Loaded {len(rows)} rows into sw_traffic_engagement.")
+def main():
+    s = load_settings()
+    payload = report_payload(s)
+    fingerprint = report_fingerprint(payload)
+    registry = ReportRegistry(s.pg_dsn)
+    try:
+        # A previous run may already have submitted (or even loaded) this exact query
+        existing = registry.find(fingerprint)
+        if existing and existing["status"] == "loaded":
+            print(f"Report {existing['report_id']} for this query was already loaded "
+                  f"at {existing['loaded_at']}; nothing to do.")
+            return
+
+        if existing and existing["status"] == "completed":
+            report_id, download_link = existing["report_id"], existing["download_link"]
+            print("Reusing completed report:", report_id)
+        else:
+            if existing:
+                report_id = existing["report_id"]
+                print("Resuming report:", report_id)
+            else:
+                print(f"Submitting report for {len(s.domains)} domains, countries={s.countries}, "
+                      f"{s.start_date}..{s.end_date}")
+                report_id = submit_report(s)
+                registry.record_submitted(report_id, fingerprint, payload)
+                print("Report ID:", report_id)
+
+            print("Waiting for report to be ready...")
+            try:
+                download_link = wait_for_report(s, report_id)["download_link"]
+            except ReportFailed as e:
+                registry.mark_failed(report_id, str(e))
+                raise
+            except Exception as e:
+                # Timeouts and network errors: the report may still finish; the next run resumes it
+                registry.note_error(report_id, f"{type(e).__name__}: {e}")
+                raise
+            registry.mark_completed(report_id, download_link)
+        print("Download link:", download_link)
+
+        print("Streaming CSV into Postgres...")
+        try:
+            stats = stream_load_report(s.pg_dsn, download_link)
+        except requests.HTTPError as e:
+            # An expired link makes the report useless; the next run resubmits
+            expired = e.response is not None and e.response.status_code in (403, 404, 410)
+            (registry.mark_failed if expired else registry.note_error)(report_id, str(e))
+            raise
+        registry.mark_loaded(report_id, stats.rows_merged)
+        print(f"Done. Loaded {stats.summary()} into sw_traffic_engagement.")
+    finally:
+        registry.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Parallel Similarweb batch ingestion.
+
+The DOMAINS list is split into report-sized shards. Each shard is submitted as
+its own Batch API report, at most MAX_IN_FLIGHT reports at a time, and every
+outstanding report_id is polled from one event loop with exponential backoff
+plus jitter. A report is downloaded and loaded as soon as it finishes, while
+the others are still running.
+
+Unless SW_DELTA_PLANNING=0, only the (domain, country, month) rows missing
+from sw_traffic_engagement are requested (similarweb_planner.py).
+
+Reports are tracked in sw_reports (similarweb_reports.py), so a rerun after a
+crash resumes polling or loading the reports it already paid for, and a query
+that was already loaded is not requested again.
+
+Usage:
+  pip install httpx requests psycopg2-binary python-dotenv
+  python similarweb_batch.py
+
+Settings come from the same .env as similarweb_api.py, plus:
+  SW_DOMAINS_PER_REPORT   domains per report (default 100)
+  SW_MAX_IN_FLIGHT        reports submitted but not finished (default 4)
+  SW_MAX_LOADS            reports downloaded/loaded concurrently (default 2)
+  SW_POLL_INITIAL_SECS    first poll delay (default 5)
+  SW_POLL_MAX_SECS        backoff ceiling (default 60)
+  SW_REPORT_TIMEOUT_SECS  give up on a report after this long (default 1800)
+  SW_SUBMIT_RETRIES       retries of a submit that was throttled (429) or could not connect (default 3)
+  SW_REUSE_REPORTS        0 to always submit new reports (default 1)
+  SW_DELTA_PLANNING       0 to request the full date range for every domain (default 1)
+  SW_REFRESH_MONTHS       newest months to re-request even if loaded (default 0);
+                          fetched once per run date, see similarweb_reports.py
+  SIMILARWEB_API_BASE     e.g. http://127.0.0.1:8765 for similarweb_standin.py
+"""
+
+import asyncio
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+import psycopg2
+import requests
+
+from similarweb_api import (
+    ReportFailed, Settings, load_settings, parse_report_id, ready_download_link, report_payload,
+    stream_load_report, submit_headers,
+)
+from similarweb_planner import PlannedReport, plan_reports, plan_summary
+from similarweb_reports import ReportRegistry, report_fingerprint
+
+
+@dataclass
+class BatchConfig:
+    domains_per_report: int = 100
+    max_in_flight: int = 4
+    max_loads: int = 2
+    poll_initial_secs: float = 5.0
+    poll_max_secs: float = 60.0
+    report_timeout_secs: float = 1800.0
+    submit_retries: int = 3
+    reuse_reports: bool = True
+    delta_planning: bool = True
+    refresh_months: int = 0
+
+    @classmethod
+    def from_env(cls) -> "BatchConfig":
+        return cls(
+            domains_per_report=int(os.getenv("SW_DOMAINS_PER_REPORT", "100")),
+            max_in_flight=int(os.getenv("SW_MAX_IN_FLIGHT", "4")),
+            max_loads=int(os.getenv("SW_MAX_LOADS", "2")),
+            poll_initial_secs=float(os.getenv("SW_POLL_INITIAL_SECS", "5")),
+            poll_max_secs=float(os.getenv("SW_POLL_MAX_SECS", "60")),
+            report_timeout_secs=float(os.getenv("SW_REPORT_TIMEOUT_SECS", "1800")),
+            submit_retries=int(os.getenv("SW_SUBMIT_RETRIES", "3")),
+            reuse_reports=os.getenv("SW_REUSE_REPORTS", "1") != "0",
+            delta_planning=os.getenv("SW_DELTA_PLANNING", "1") != "0",
+            refresh_months=int(os.getenv("SW_REFRESH_MONTHS", "0")),
+        )
+
+
+@dataclass
+class ReportResult:
+    shard: int
+    domains: List[str]
+    countries: List[str]
+    start_date: str
+    end_date: str
+    refresh: bool = False
+    report_id: Optional[str] = None
+    status: str = "pending"  # pending, loaded, reused, failed
+    rows: int = 0
+    polls: int = 0
+    error: Optional[str] = None
+    started: float = field(default_factory=time.perf_counter)
+    elapsed_secs: float = 0.0
+
+
+def shard_domains(domains: List[str], size: int) -> List[List[str]]:
+    """Split domains into report-sized chunks, dropping repeats."""
+    unique = list(dict.fromkeys(domains))
+    return [unique[i:i + size] for i in range(0, len(unique), max(1, size))]
+
+
+def full_plan(s: Settings, cfg: BatchConfig) -> List[PlannedReport]:
+    """Every domain over the whole configured range, without looking at the database."""
+    return [
+        PlannedReport(tuple(domains), tuple(s.countries), s.start_date, s.end_date)
+        for domains in shard_domains(s.domains, cfg.domains_per_report)
+    ]
+
+
+def delta_plan(s: Settings, cfg: BatchConfig) -> List[PlannedReport]:
+    conn = psycopg2.connect(s.pg_dsn)
+    try:
+        return plan_reports(conn, s, cfg.domains_per_report, cfg.refresh_months)
+    finally:
+        conn.close()
+
+
+def backoff_delay(attempt: int, initial: float, ceiling: float) -> float:
+    """Exponential backoff with full jitter: uniform(0, min(ceiling, initial * 2**attempt))."""
+    return random.uniform(0, min(ceiling, initial * (2 ** attempt)))
+
+
+def _transient(r: httpx.Response) -> bool:
+    return r.status_code == 429 or r.status_code >= 500
+
+
+def _link_expired(e: Exception) -> bool:
+    return (isinstance(e, requests.HTTPError) and e.response is not None
+            and e.response.status_code in (403, 404, 410))
+
+
+def load_report(s: Settings, download_link: str) -> int:
+    """Stream one finished report into Postgres; returns rows merged. Runs in a worker thread."""
+    stats = stream_load_report(s.pg_dsn, download_link)
+    print(f"Loaded {stats.summary()}")
+    return stats.rows_merged
+
+
+# ---- Async API calls ----
+
+async def submit(client: httpx.AsyncClient, s: Settings, cfg: BatchConfig, payload: Dict[str, Any]) -> str:
+    """
+    Create a report. Only retried when the API cannot have created it: the
+    connection failed, or the request was throttled (429). A 5xx or a read
+    timeout may come after the (paid) report was created, so those raise.
+    """
+    for attempt in range(cfg.submit_retries + 1):
+        try:
+            r = await client.post(s.request_url, json=payload, headers=submit_headers(s), timeout=60)
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            if attempt == cfg.submit_retries:
+                raise
+        else:
+            if r.status_code != 429 or attempt == cfg.submit_retries:
+                break
+        await asyncio.sleep(backoff_delay(attempt, cfg.poll_initial_secs, cfg.poll_max_secs))
+    r.raise_for_status()
+    return parse_report_id(r.json())
+
+
+async def poll_until_ready(client: httpx.AsyncClient, s: Settings, cfg: BatchConfig,
+                           result: ReportResult) -> str:
+    """Poll one report with backoff until it has a download link; returns the link."""
+    deadline = time.monotonic() + cfg.report_timeout_secs
+    last = None
+    attempt = 0
+    while time.monotonic() < deadline:
+        await asyncio.sleep(backoff_delay(attempt, cfg.poll_initial_secs, cfg.poll_max_secs))
+        attempt += 1
+        result.polls += 1
+
+        try:
+            r = await client.get(s.query_url, params={"report_id": result.report_id},
+                                 headers={"api_key": s.api_key}, timeout=30)
+        except httpx.TransportError as e:
+            # Network trouble; polling is read-only, so keep backing off
+            last = f"{type(e).__name__}: {e}"
+            continue
+        if r.status_code == 404 or _transient(r):
+            # Report not registered yet, or throttled; keep backing off
+            continue
+        r.raise_for_status()
+        last = r.json()
+        download_link = ready_download_link(last)
+        if download_link:
+            return download_link
+
+    raise TimeoutError(f"Report {result.report_id} not ready before timeout; last={last}")
+
+
+# ---- Orchestration ----
+
+async def _obtain_link(client: httpx.AsyncClient, s: Settings, cfg: BatchConfig, result: ReportResult,
+                       registry: ReportRegistry, fingerprint: str, payload: Dict[str, Any],
+                       outstanding: Optional[Dict[str, Any]]) -> str:
+    """Poll an outstanding report, or submit a new one, until it has a download link."""
+    if outstanding:
+        result.report_id = outstanding["report_id"]
+        print(f"Shard {result.shard}: resuming report {result.report_id}")
+    else:
+        result.report_id = await submit(client, s, cfg, payload)
+        await asyncio.to_thread(registry.record_submitted, result.report_id, fingerprint, payload)
+        print(f"Shard {result.shard}: report {result.report_id} submitted ({len(result.domains)} domains, "
+              f"{result.start_date}..{result.end_date})")
+    try:
+        download_link = await poll_until_ready(client, s, cfg, result)
+    except ReportFailed as e:
+        await asyncio.to_thread(registry.mark_failed, result.report_id, str(e))
+        raise
+    except Exception as e:
+        # Timeouts and network errors: the report stays submitted and is resumed next run
+        await asyncio.to_thread(registry.note_error, result.report_id, f"{type(e).__name__}: {e}")
+        raise
+    await asyncio.to_thread(registry.mark_completed, result.report_id, download_link)
+    return download_link
+
+
+async def run_shard(client: httpx.AsyncClient, s: Settings, cfg: BatchConfig, result: ReportResult,
+                    in_flight: asyncio.Semaphore, loads: asyncio.Semaphore,
+                    load: Callable[[Settings, str], int], registry: ReportRegistry) -> ReportResult:
+    payload = report_payload(s, result.domains, result.countries, result.start_date, result.end_date)
+    # A refresh repeats an already loaded query; salt it so it is fetched again once per day
+    fingerprint = report_fingerprint(payload, date.today().isoformat() if result.refresh else None)
+    try:
+        existing = await asyncio.to_thread(registry.find, fingerprint) if cfg.reuse_reports else None
+        if existing and existing["status"] == "loaded":
+            result.report_id = existing["report_id"]
+            result.rows = existing["rows_loaded"] or 0
+            result.status = "reused"
+            print(f"Shard {result.shard}: report {result.report_id} already loaded, skipping")
+            return result
+
+        download_link = existing["download_link"] if existing and existing["status"] == "completed" else None
+        for attempt in range(2):
+            if download_link is None:
+                outstanding = existing if existing and existing["status"] == "submitted" else None
+                async with in_flight:
+                    download_link = await _obtain_link(client, s, cfg, result, registry,
+                                                       fingerprint, payload, outstanding)
+            else:
+                result.report_id = existing["report_id"]
+                print(f"Shard {result.shard}: reusing completed report {result.report_id}")
+
+            try:
+                async with loads:
+                    result.rows = await asyncio.to_thread(load, s, download_link)
+                break
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                if attempt == 0 and existing and _link_expired(e):
+                    # Stored link of a reused report has expired; request it again
+                    await asyncio.to_thread(registry.mark_failed, result.report_id, error)
+                    existing = download_link = None
+                    continue
+                await asyncio.to_thread(registry.note_error, result.report_id, error)
+                raise
+
+        await asyncio.to_thread(registry.mark_loaded, result.report_id, result.rows)
+        result.status = "loaded"
+        print(f"Shard {result.shard}: loaded {result.rows} rows after {result.polls} polls")
+    except Exception as e:
+        result.status = "failed"
+        result.error = f"{type(e).__name__}: {e}"
+        print(f"Shard {result.shard}: failed: {result.error}")
+    finally:
+        result.elapsed_secs = round(time.perf_counter() - result.started, 3)
+    return result
+
+
+async def run_batch(s: Settings, cfg: Optional[BatchConfig] = None,
+                    load: Callable[[Settings, str], int] = load_report) -> List[ReportResult]:
+    """
+    Submit (or resume), poll and load every shard of s.domains. A failed
+    shard does not stop the others; check each result's status.
+    """
+    cfg = cfg or BatchConfig.from_env()
+    if cfg.delta_planning:
+        plan = await asyncio.to_thread(delta_plan, s, cfg)
+        print(f"Delta plan: {plan_summary(s, plan)}")
+    else:
+        plan = full_plan(s, cfg)
+    results = [
+        ReportResult(shard=i, domains=list(report.domains), countries=list(report.countries),
+                     start_date=report.start_date, end_date=report.end_date, refresh=report.refresh)
+        for i, report in enumerate(plan)
+    ]
+    if not results:
+        return results
+
+    registry = ReportRegistry(s.pg_dsn)
+    in_flight = asyncio.Semaphore(cfg.max_in_flight)
+    loads = asyncio.Semaphore(cfg.max_loads)
+    limits = httpx.Limits(max_connections=cfg.max_in_flight + cfg.max_loads)
+    try:
+        async with httpx.AsyncClient(limits=limits) as client:
+            await asyncio.gather(*(
+                run_shard(client, s, cfg, result, in_flight, loads, load, registry) for result in results
+            ))
+    finally:
+        registry.close()
+    return results
+
+
+def summarize(results: List[ReportResult]) -> Dict[str, Any]:
+    return {
+        "reports": len(results),
+        "loaded": sum(r.status == "loaded" for r in results),
+        "reused": sum(r.status == "reused" for r in results),
+        "failed": sum(r.status == "failed" for r in results),
+        "rows": sum(r.rows for r in results),
+        "errors": {r.shard: r.error for r in results if r.error},
+    }
+
+
+def main():
+    s = load_settings()
+    cfg = BatchConfig.from_env()
+    print(f"Ingesting {len(s.domains)} domains in reports of {cfg.domains_per_report}, "
+          f"{cfg.max_in_flight} in flight, countries={s.countries}, {s.start_date}..{s.end_date}")
+    started = time.perf_counter()
+    results = asyncio.run(run_batch(s, cfg))
+    summary = summarize(results)
+    print(f"Done in {time.perf_counter() - started:.1f}s: {summary['loaded']}/{summary['reports']} reports loaded, "
+          f"{summary['reused']} already loaded earlier, {summary['rows']} rows in sw_traffic_engagement")
+    for shard, error in summary["errors"].items():
+        print(f"  shard {shard}: {error}")
+    if summary["failed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Delta planning for Similarweb traffic reports.
+
+Instead of requesting START_DATE..END_DATE for every domain on every run, the
+planner reads which (domain, country, month) rows sw_traffic_engagement
+already holds and plans only the missing ones. For each domain and country
+the missing months are collapsed into contiguous ranges. Domains with the
+same gaps (same range and same countries) share one report, split into
+report-sized groups.
+
+A routine monthly refresh, where only the newest month is missing, becomes
+one report per DOMAINS_PER_REPORT domains covering a single month.
+
+With refresh_months > 0 the newest months are planned again even when
+loaded. Such reports are marked `refresh`, and the batch runner salts their
+registry fingerprint with the run date (similarweb_reports.py), so they are
+fetched again instead of being skipped as "already loaded".
+
+Usage:
+  python similarweb_planner.py      # print the plan for the current .env
+"""
+
+import os
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, FrozenSet, Iterable, List, Set, Tuple
+
+from metrics_partitions import retention_cutoff
+from similarweb_api import Settings, load_settings
+
+
+@dataclass(frozen=True)
+class PlannedReport:
+    domains: Tuple[str, ...]
+    countries: Tuple[str, ...]
+    start_date: str  # YYYY-MM
+    end_date: str    # YYYY-MM
+    refresh: bool = False  # covers months re-requested by refresh_months
+
+    @property
+    def cells(self) -> int:
+        """(domain, country, month) rows this report asks for."""
+        return len(self.domains) * len(self.countries) * len(month_range(self.start_date, self.end_date))
+
+
+def _month(value: str) -> date:
+    year, month = value[:7].split("-")
+    return date(int(year), int(month), 1)
+
+
+def _ym(value: date) -> str:
+    return value.strftime("%Y-%m")
+
+
+def month_range(start: str, end: str) -> List[date]:
+    """Inclusive month starts between two YYYY-MM[-DD] strings."""
+    current, last = _month(start), _month(end)
+    months = []
+    while current <= last:
+        months.append(current)
+        current = date(current.year + current.month // 12, current.month % 12 + 1, 1)
+    return months
+
+
+def covered_months(conn, domains: List[str], countries: List[str],
+                   start: str, end: str) -> Dict[Tuple[str, str], Set[date]]:
+    """Months already loaded per (domain, country) within start..end."""
+    months = month_range(start, end)
+    if not months or not domains:
+        return {}
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('sw_traffic_engagement') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            return {}
+        cur.execute("""
+            SELECT domain, country, array_agg(DISTINCT date_trunc('month', date)::date)
+            FROM sw_traffic_engagement
+            WHERE domain = ANY(%s) AND country = ANY(%s)
+              AND date >= %s AND date < %s::date + INTERVAL '1 month'
+            GROUP BY domain, country
+        """, (domains, countries, months[0], months[-1]))
+        return {(domain, country): set(dates) for domain, country, dates in cur.fetchall()}
+
+
+def missing_ranges(months: List[date], covered: Set[date]) -> List[Tuple[str, str]]:
+    """Contiguous (start, end) YYYY-MM ranges of `months` not in `covered`."""
+    ranges = []
+    run_start = previous = None
+    for month in months:
+        if month in covered:
+            if run_start is not None:
+                ranges.append((_ym(run_start), _ym(previous)))
+                run_start = None
+            continue
+        if run_start is None:
+            run_start = month
+        previous = month
+    if run_start is not None:
+        ranges.append((_ym(run_start), _ym(previous)))
+    return ranges
+
+
+def plan_reports(conn, s: Settings, domains_per_report: int,
+                 refresh_months: int = 0) -> List[PlannedReport]:
+    """
+    Minimal set of reports that fills the gaps of s.domains x s.countries x
+    s.start_date..s.end_date. The last `refresh_months` months are always
+    re-requested, for data Similarweb may still revise. Months older than
+    the partition retention window are never planned, since they would be
+    archived again right after loading.
+    """
+    domains = list(dict.fromkeys(s.domains))
+    months = month_range(s.start_date, s.end_date)
+    cutoff = retention_cutoff()
+    if cutoff:
+        months = [m for m in months if m >= cutoff]
+    if not months:
+        return []
+    covered = covered_months(conn, domains, s.countries, _ym(months[0]), _ym(months[-1]))
+    recent: Set[date] = set()
+    if refresh_months > 0:
+        recent = set(months[-refresh_months:])
+        covered = {key: have - recent for key, have in covered.items()}
+
+    # (range, countries) -> domains with exactly that gap
+    groups: Dict[Tuple[Tuple[str, str], FrozenSet[str]], List[str]] = {}
+    for domain in domains:
+        countries_by_range: Dict[Tuple[str, str], Set[str]] = {}
+        for country in s.countries:
+            for gap in missing_ranges(months, covered.get((domain, country), set())):
+                countries_by_range.setdefault(gap, set()).add(country)
+        for gap, countries in countries_by_range.items():
+            groups.setdefault((gap, frozenset(countries)), []).append(domain)
+
+    size = max(1, domains_per_report)
+    plan = []
+    for ((start, end), countries), group in sorted(groups.items(), key=lambda g: (g[0][0], sorted(g[0][1]))):
+        ordered = tuple(c for c in s.countries if c in countries)
+        refresh = any(m in recent for m in month_range(start, end))
+        for i in range(0, len(group), size):
+            plan.append(PlannedReport(tuple(group[i:i + size]), ordered, start, end, refresh))
+    return plan
+
+
+def plan_summary(s: Settings, plan: Iterable[PlannedReport]) -> str:
+    plan = list(plan)
+    total = len(set(s.domains)) * len(s.countries) * len(month_range(s.start_date, s.end_date))
+    requested = sum(report.cells for report in plan)
+    return (
+        f"{len(plan)} reports for {requested} of {total} (domain, country, month) rows; "
+        f"{total - requested} already loaded"
+    )
+
+
+def main():
+    import psycopg2
+
+    s = load_settings()
+    conn = psycopg2.connect(s.pg_dsn)
+    try:
+        plan = plan_reports(conn, s, int(os.getenv("SW_DOMAINS_PER_REPORT", "100")),
+                            int(os.getenv("SW_REFRESH_MONTHS", "0")))
+    finally:
+        conn.close()
+    print(plan_summary(s, plan))
+    for report in plan:
+        print(f"  {report.start_date}..{report.end_date} {','.join(report.countries)}: "
+              f"{len(report.domains)} domains ({report.domains[0]}, ...)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Registry of Similarweb Batch API reports.
+
+Every report is recorded in sw_reports the moment submit returns, keyed by its
+report_id and a fingerprint of the query. A rerun looks up its query
+fingerprint first: an outstanding report is polled again instead of being
+resubmitted, a completed one is loaded from its stored download link, and a
+loaded one is skipped. Only failed reports (or SW_REUSE_REPORTS=0) lead to a
+new submission.
+
+Refresh reports (SW_REFRESH_MONTHS) ask for the same query as the report
+that first loaded those months, so their fingerprint is salted with the run
+date. A rerun on the same day still resumes or skips them; the next day's
+run fetches the revised data again.
+
+Uses psycopg2, like similarweb_api.py.
+"""
+
+import hashlib
+import json
+import threading
+from typing import Any, Dict, Optional
+
+import psycopg2
+from psycopg2.extras import Json, RealDictCursor
+
+CREATE_SQL = """
+CREATE TABLE IF NOT EXISTS sw_reports (
+  report_id      TEXT PRIMARY KEY,
+  fingerprint    TEXT NOT NULL,                      -- sha256 of the normalized report_query
+  query          JSONB NOT NULL,
+  status         TEXT NOT NULL DEFAULT 'submitted',  -- submitted, completed, loaded, failed
+  download_link  TEXT,
+  rows_loaded    BIGINT,
+  error          TEXT,
+  submitted_at   TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+  completed_at   TIMESTAMPTZ,
+  loaded_at      TIMESTAMPTZ,
+  updated_at     TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS sw_reports_fingerprint_idx ON sw_reports (fingerprint, submitted_at DESC);
+"""
+
+# Filter/metric lists whose order does not change the report
+_UNORDERED = ("domains", "countries", "metrics")
+
+
+def _normalize(value):
+    if isinstance(value, dict):
+        return {k: sorted(v) if k in _UNORDERED and isinstance(v, list) else _normalize(v)
+                for k, v in value.items()}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def report_fingerprint(payload: Dict[str, Any], salt: Optional[str] = None) -> str:
+    """
+    Identify a report by what it asks for: the report_query, ignoring list
+    order. A salt (the run date of a refresh) keeps it apart from earlier
+    reports with the same query.
+    """
+    query = _normalize(payload["report_query"])
+    key = json.dumps(query, sort_keys=True) if salt is None else json.dumps([query, salt], sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class ReportRegistry:
+    """
+    sw_reports access over one autocommit psycopg2 connection. Every state
+    change is committed immediately; safe to call from worker threads.
+    """
+
+    def __init__(self, dsn: str):
+        self.conn = psycopg2.connect(dsn)
+        self.conn.autocommit = True
+        self._lock = threading.Lock()
+        self._execute(CREATE_SQL)
+
+    def _execute(self, sql: str, params=None, fetch: bool = False):
+        with self._lock:
+            with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(sql, params)
+                return cur.fetchone() if fetch else None
+
+    def find(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """Latest usable (not failed) report for a query fingerprint."""
+        return self._execute("""
+            SELECT report_id, status, download_link, rows_loaded, submitted_at, loaded_at
+            FROM sw_reports
+            WHERE fingerprint = %s AND status <> 'failed'
+            ORDER BY submitted_at DESC
+            LIMIT 1
+        """, (fingerprint,), fetch=True)
+
+    def record_submitted(self, report_id: str, fingerprint: str, payload: Dict[str, Any]) -> None:
+        self._execute("""
+            INSERT INTO sw_reports (report_id, fingerprint, query)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (report_id) DO NOTHING
+        """, (report_id, fingerprint, Json(payload["report_query"])))
+
+    def mark_completed(self, report_id: str, download_link: str) -> None:
+        self._execute("""
+            UPDATE sw_reports
+            SET status = 'completed', download_link = %s, error = NULL,
+                completed_at = NOW(), updated_at = NOW()
+            WHERE report_id = %s
+        """, (download_link, report_id))
+
+    def mark_loaded(self, report_id: str, rows_loaded: int) -> None:
+        self._execute("""
+            UPDATE sw_reports
+            SET status = 'loaded', rows_loaded = %s, error = NULL, loaded_at = NOW(), updated_at = NOW()
+            WHERE report_id = %s
+        """, (rows_loaded, report_id))
+
+    def mark_failed(self, report_id: str, error: str) -> None:
+        """The report itself is unusable (failed, link expired); its query will be resubmitted."""
+        self._execute("""
+            UPDATE sw_reports SET status = 'failed', error = %s, updated_at = NOW()
+            WHERE report_id = %s
+        """, (error, report_id))
+
+    def note_error(self, report_id: str, error: str) -> None:
+        """Record an error (e.g. a failed load) without giving up on the report."""
+        self._execute("UPDATE sw_reports SET error = %s, updated_at = NOW() WHERE report_id = %s",
+                      (error, report_id))
+
+    def close(self) -> None:
+        self.conn.close()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Similarweb Batch and REST APIs, for exercising the
+ingestion scripts without a license or network access.
+
+Implements the calls the scripts make:
+  POST /batch/v4/request-report       -> {"report_id": ...}
+  GET  /v3/batch/request-query        -> pending until --ready-after polls, then a download link
+  GET  /download/<report_id>.csv      -> one row per domain x country x month
+  GET  /v1/website/<domain>/total-traffic-and-engagement/visits
+                                      -> monthly visits (404 for domains starting with "nodata")
+
+Values are deterministic per (domain, country, month), so reloading a report
+is idempotent.
+
+Usage:
+  python similarweb_standin.py [--port 8765] [--ready-after 2] [--fail-every 0]
+  SIMILARWEB_API_BASE=http://127.0.0.1:8765 python similarweb_batch.py
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import re
+import threading
+import uuid
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List
+from urllib.parse import parse_qs, urlsplit
+
+CSV_COLUMNS = [
+    "domain", "country", "date", "all_traffic_visits", "all_traffic_pages_per_visit",
+    "all_traffic_average_visit_duration", "all_traffic_bounce_rate", "all_page_views",
+]
+
+
+def months(start: str, end: str) -> List[date]:
+    """Inclusive list of month starts between two YYYY-MM strings."""
+    year, month = map(int, start[:7].split("-"))
+    last = tuple(map(int, end[:7].split("-")))
+    result = []
+    while (year, month) <= last:
+        result.append(date(year, month, 1))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return result
+
+
+REST_VISITS_RE = re.compile(r"^/v1/website/([^/]+)/total-traffic-and-engagement/visits$")
+
+
+def _seed(domain: str, country: str, month: date) -> int:
+    return int.from_bytes(hashlib.sha1(f"{domain}|{country}|{month}".encode()).digest()[:8], "big")
+
+
+def report_rows(query: Dict[str, Any]) -> Iterator[str]:
+    """CSV lines (header first) for a report_query.tables[0] definition."""
+    table = query["tables"][0]
+    filters = table["filters"]
+    yield ",".join(CSV_COLUMNS) + "\n"
+    for domain, country, month in itertools.product(
+        filters["domains"], filters["countries"], months(table["start_date"], table["end_date"])
+    ):
+        seed = _seed(domain, country, month)
+        visits = 1000 + seed % 5_000_000
+        pages = 1 + (seed >> 24) % 900 / 100
+        yield (
+            f"{domain},{country},{month.isoformat()},{visits},{pages:.2f},"
+            f"{30 + (seed >> 8) % 600},{(seed >> 16) % 1000 / 1000:.3f},{int(visits * pages)}\n"
+        )
+
+
+class StandIn:
+    def __init__(self, ready_after: int, fail_every: int):
+        self.ready_after = ready_after
+        self.fail_every = fail_every
+        self.reports: Dict[str, Dict[str, Any]] = {}
+        self.requests = 0
+        self.rest_requests = 0
+        self.lock = threading.Lock()
+
+
+def make_handler(state: StandIn):
+    class Handler(BaseHTTPRequestHandler):
+        def _json(self, status: int, body: Dict[str, Any]):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _flaky(self) -> bool:
+            with state.lock:
+                state.requests += 1
+                fail = state.fail_every and state.requests % state.fail_every == 0
+            if fail:
+                self._json(503, {"error": "stand-in injected failure"})
+            return bool(fail)
+
+        def do_POST(self):
+            if urlsplit(self.path).path != "/batch/v4/request-report":
+                return self._json(404, {"error": "not found"})
+            if self._flaky():
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            report_id = uuid.uuid4().hex
+            with state.lock:
+                state.reports[report_id] = {"query": body["report_query"], "polls": 0}
+            self._json(200, {"report_id": report_id, "status": "pending"})
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == "/v3/batch/request-query":
+                if self._flaky():
+                    return
+                report_id = parse_qs(url.query).get("report_id", [""])[0]
+                with state.lock:
+                    report = state.reports.get(report_id)
+                    if report:
+                        report["polls"] += 1
+                if not report:
+                    return self._json(404, {"error": "unknown report"})
+                if report["polls"] < state.ready_after:
+                    return self._json(200, {"report_id": report_id, "status": "processing"})
+                host = self.headers.get("Host", f"127.0.0.1:{self.server.server_port}")
+                return self._json(200, {
+                    "report_id": report_id, "status": "completed",
+                    "download_link": f"http://{host}/download/{report_id}.csv",
+                })
+
+            match = REST_VISITS_RE.match(url.path)
+            if match:
+                if self._flaky():
+                    return
+                with state.lock:
+                    state.rest_requests += 1
+                domain = match.group(1)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                if domain.startswith("nodata"):
+                    return self._json(404, {"meta": {"status": "Error", "error_message": "Data not found"}})
+                country = params.get("country", "ww").upper()
+                return self._json(200, {
+                    "meta": {"request": params, "status": "Success"},
+                    "visits": [
+                        {"date": month.isoformat(), "visits": 1000 + _seed(domain, country, month) % 5_000_000}
+                        for month in months(params["start_date"], params["end_date"])
+                    ],
+                })
+
+            if url.path.startswith("/download/"):
+                report = state.reports.get(url.path.rsplit("/", 1)[-1].removesuffix(".csv"))
+                if not report:
+                    return self._json(404, {"error": "unknown report"})
+                # HTTP/1.0 response without Content-Length: streamed until close
+                self.send_response(200)
+                self.send_header("Content-Type", "text/csv")
+                self.end_headers()
+                for line in report_rows(report["query"]):
+                    self.wfile.write(line.encode())
+                return
+
+            self._json(404, {"error": "not found"})
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+
+def serve(port: int = 8765, ready_after: int = 2, fail_every: int = 0, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Start the stand-in on a background thread; call .shutdown() to stop it."""
+    state = StandIn(ready_after, fail_every)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ready-after", type=int, default=2, help="polls before a report completes")
+    parser.add_argument("--fail-every", type=int, default=0, help="answer every Nth API call with 503")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(StandIn(args.ready_after, args.fail_every)))
+    print(f"Similarweb stand-in listening on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
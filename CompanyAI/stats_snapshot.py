@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Precomputed database statistics for the GPT stats endpoints.
+
+Every aggregate the /gpt/companies/stats endpoints report is computed in one
+pass over all_companies (GROUPING SETS) and stored as a single JSON snapshot in
+stats_snapshots. Readers fetch that row by primary key; writers (imports, list
+changes, duplicate cleanup) call refresh_stats_snapshot() afterwards.
+
+Works with both psycopg (v3) and psycopg2 connections.
+"""
+
+from typing import Any, Dict, Optional
+
+SNAPSHOT_NAME = "company_stats"
+TOP_N = 10
+
+CREATE_SQL = """
+CREATE TABLE IF NOT EXISTS stats_snapshots (
+  name         TEXT PRIMARY KEY,
+  payload      JSONB NOT NULL,
+  computed_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+"""
+
+# One scan of all_companies: the () grouping set yields the totals, the
+# (vertical) and (location) sets yield the two histograms.
+AGGREGATE_SQL = """
+WITH g AS (
+    SELECT
+        GROUPING(vertical) AS gv,
+        GROUPING(location) AS gl,
+        vertical,
+        location,
+        COUNT(*) AS count,
+        COUNT(*) FILTER (WHERE reached_out) AS reached_out,
+        AVG(monthly_visits) FILTER (WHERE monthly_visits > 0) AS avg_visits
+    FROM all_companies
+    GROUP BY GROUPING SETS ((vertical), (location), ())
+)
+SELECT jsonb_build_object(
+    'total_companies',
+        COALESCE((SELECT count FROM g WHERE gv = 1 AND gl = 1), 0),
+    'reached_out_count',
+        COALESCE((SELECT reached_out FROM g WHERE gv = 1 AND gl = 1), 0),
+    'average_monthly_visits',
+        COALESCE((SELECT ROUND(avg_visits, 2) FROM g WHERE gv = 1 AND gl = 1), 0),
+    'vertical_distribution', COALESCE((
+        SELECT jsonb_agg(jsonb_build_object('vertical', vertical, 'count', count)
+                         ORDER BY count DESC, vertical)
+        FROM g WHERE gv = 0 AND vertical IS NOT NULL
+    ), '[]'::jsonb),
+    'top_locations', COALESCE((
+        SELECT jsonb_agg(t ORDER BY t.count DESC, t.location)
+        FROM (
+            SELECT location, count FROM g
+            WHERE gl = 0 AND location IS NOT NULL
+            ORDER BY count DESC, location
+            LIMIT %(top_n)s
+        ) t
+    ), '[]'::jsonb)
+    {extra}
+)
+"""
+
+# Legacy outreach tables and list memberships only exist in some deployments.
+OPTIONAL_COUNTS = {
+    "reached_out_companies": "(SELECT COUNT(*) FROM reached_out_companies)",
+    "interested_companies": "(SELECT COUNT(*) FROM interested_companies)",
+    "list_counts": """COALESCE((
+        SELECT jsonb_object_agg(l.slug, COALESCE(c.n, 0))
+        FROM lists l
+        LEFT JOIN (
+            SELECT list_id, COUNT(*) AS n FROM list_members_current GROUP BY list_id
+        ) c ON c.list_id = l.list_id
+    ), '{}'::jsonb)""",
+}
+OPTIONAL_TABLES = {
+    "reached_out_companies": ["reached_out_companies"],
+    "interested_companies": ["interested_companies"],
+    "list_counts": ["lists", "list_members_current"],
+}
+
+_table_ready = False
+
+
+def ensure_stats_table(conn) -> None:
+    """Create stats_snapshots once per process."""
+    global _table_ready
+    if _table_ready:
+        return
+    cur = conn.cursor()
+    try:
+        cur.execute(CREATE_SQL)
+        conn.commit()
+    finally:
+        cur.close()
+    _table_ready = True
+
+
+def _existing_relations(cur, names) -> set:
+    cur.execute(
+        "SELECT relname FROM pg_class WHERE relname = ANY(%s) AND pg_table_is_visible(oid)",
+        (list(names),),
+    )
+    return {row[0] for row in cur.fetchall()}
+
+
+def refresh_stats_snapshot(conn) -> bool:
+    """
+    Recompute the stats snapshot and commit it.
+
+    Readers keep seeing the previous snapshot until the upsert commits. If
+    another session is already refreshing, this call waits for it, then
+    returns False without doing any work when that refresh started after
+    this call (it already saw the caller's writes).
+    """
+    ensure_stats_table(conn)
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT clock_timestamp()")
+        requested_at = cur.fetchone()[0]
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('stats_snapshots'))")
+        cur.execute("SELECT computed_at >= %s FROM stats_snapshots WHERE name = %s",
+                    (requested_at, SNAPSHOT_NAME))
+        row = cur.fetchone()
+        if row and row[0]:
+            conn.rollback()
+            return False
+
+        wanted = {t for tables in OPTIONAL_TABLES.values() for t in tables}
+        present = _existing_relations(cur, wanted)
+        extra = "".join(
+            f",\n    '{key}', {OPTIONAL_COUNTS[key]}"
+            for key, tables in OPTIONAL_TABLES.items()
+            if all(t in present for t in tables)
+        )
+
+        cur.execute(
+            "INSERT INTO stats_snapshots (name, payload, computed_at) "
+            f"SELECT %(name)s, ({AGGREGATE_SQL.format(extra=extra)}), NOW() "
+            "ON CONFLICT (name) DO UPDATE SET "
+            "payload = EXCLUDED.payload, computed_at = EXCLUDED.computed_at",
+            {"name": SNAPSHOT_NAME, "top_n": TOP_N},
+        )
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def get_stats_snapshot(conn) -> Optional[Dict[str, Any]]:
+    """
+    Return {"stats": {...}, "computed_at": datetime} from a single primary-key
+    read, computing the snapshot first if none exists yet.
+    """
+    ensure_stats_table(conn)
+    for _ in range(2):
+        snapshot = read_stats_snapshot(conn)
+        if snapshot is not None:
+            return snapshot
+        refresh_stats_snapshot(conn)
+    return None
+
+
+def read_stats_snapshot(conn) -> Optional[Dict[str, Any]]:
+    """The stored snapshot, or None if there is none yet; never writes."""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT payload, computed_at FROM stats_snapshots WHERE name = %s",
+            (SNAPSHOT_NAME,),
+        )
+        row = cur.fetchone()
+    finally:
+        cur.close()
+    if not row:
+        return None
+    payload, computed_at = (row["payload"], row["computed_at"]) if isinstance(row, dict) else row
+    return {"stats": payload, "computed_at": computed_at}
+
+
+def refresh_stats_snapshot_safely(connect) -> None:
+    """
+    Background-task helper: open a connection with `connect`, refresh, and
+    swallow errors so a failed refresh never breaks the write that triggered it.
+    """
+    conn = None
+    try:
+        conn = connect()
+        refresh_stats_snapshot(conn)
+    except Exception as e:
+        print(f"Stats snapshot refresh failed: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Dedup of companies that are both in the same list.
+
+Needs a scratch database: set TEST_PG_DSN. The tables are created in a
+throwaway schema, which is dropped afterwards.
+
+Usage:
+  TEST_PG_DSN=postgresql://... python -m pytest test_company_dedup.py
+"""
+
+import os
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+psycopg = pytest.importorskip("psycopg")
+
+import company_dedup
+import domain_keys
+
+DSN = os.getenv("TEST_PG_DSN")
+
+SCHEMA_SQL = """
+CREATE TABLE companies (
+  company_id BIGSERIAL PRIMARY KEY,
+  name       TEXT,
+  domain     TEXT
+);
+CREATE TABLE lists (
+  list_id BIGSERIAL PRIMARY KEY,
+  slug    TEXT UNIQUE NOT NULL
+);
+CREATE TABLE list_memberships (
+  list_id     BIGINT REFERENCES lists(list_id),
+  company_id  BIGINT REFERENCES companies(company_id),
+  added_at    TIMESTAMPTZ DEFAULT now(),
+  removed_at  TIMESTAMPTZ,
+  added_by    TEXT,
+  removed_by  TEXT,
+  PRIMARY KEY (list_id, company_id, added_at)
+);
+"""
+
+
+def ts(day: int) -> datetime:
+    return datetime(2024, 1, day, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def conn():
+    if not DSN:
+        pytest.skip("TEST_PG_DSN is not set")
+    schema = f"test_dedup_{uuid.uuid4().hex[:8]}"
+    admin = psycopg.connect(DSN, autocommit=True)
+    admin.execute(f"CREATE SCHEMA {schema}")
+    conn = psycopg.connect(DSN, options=f"-c search_path={schema}")
+    try:
+        conn.execute(SCHEMA_SQL)
+        conn.commit()
+        domain_keys._ready_tables.discard("companies")
+        yield conn
+    finally:
+        conn.close()
+        admin.execute(f"DROP SCHEMA {schema} CASCADE")
+        admin.close()
+
+
+def memberships(conn, company_id: int):
+    return conn.execute(
+        "SELECT l.slug, m.added_at, m.removed_at FROM list_memberships m JOIN lists l USING (list_id) "
+        "WHERE m.company_id = %s ORDER BY l.slug, m.added_at", (company_id,)
+    ).fetchall()
+
+
+def test_shared_list_keeps_one_open_membership(conn):
+    keep, dup, later = [conn.execute(
+        "INSERT INTO companies (name, domain) VALUES ('Foo', %s) RETURNING company_id", (domain,)
+    ).fetchone()[0] for domain in ("foo.com", "https://www.foo.com/", "http://FOO.com")]
+    interested, reached = [conn.execute(
+        "INSERT INTO lists (slug) VALUES (%s) RETURNING list_id", (slug,)
+    ).fetchone()[0] for slug in ("interested", "reached_out")]
+    conn.cursor().executemany(
+        "INSERT INTO list_memberships (list_id, company_id, added_at, removed_at) VALUES (%s, %s, %s, %s)",
+        [
+            (interested, keep, ts(5), None),
+            (interested, dup, ts(1), ts(2)),    # history of the duplicate
+            (interested, dup, ts(3), None),     # open before the survivor's: closed at ts(5)
+            (interested, later, ts(7), None),   # open after the survivor's: covered, dropped
+            (reached, dup, ts(4), None),        # only the duplicate is in this list: moved
+            (reached, later, ts(6), None),      # later than the moved one: dropped
+        ],
+    )
+    conn.commit()
+
+    stats = company_dedup.dedup_table(conn, "companies", throttle_secs=0)
+
+    assert stats.deleted == 2
+    assert conn.execute(
+        "SELECT list_id, company_id FROM list_memberships WHERE removed_at IS NULL "
+        "GROUP BY 1, 2 HAVING COUNT(*) > 1"
+    ).fetchall() == []
+    assert memberships(conn, keep) == [
+        ("interested", ts(1), ts(2)),
+        ("interested", ts(3), ts(5)),
+        ("interested", ts(5), None),
+        ("reached_out", ts(4), None),
+    ]
+    assert conn.execute(
+        "SELECT removed_by FROM list_memberships WHERE added_at = %s", (ts(3),)
+    ).fetchone()[0] == "dedup"
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Startup profiling, background warm-up and the readiness probe.
+
+The Render free plan sleeps idle services, so cold starts are common. The
+APIs keep startup to the imports they cannot serve without. Everything else
+is a warm-up step that runs in the background once the server is up:
+
+* Modules register steps at import time with register(name, fn). Examples
+  are filling the DB connection pool, importing the CSV import stack,
+  building the OpenAI client, or reading the stats snapshot.
+* The app's startup hook calls start(). It runs each step once per process,
+  in registration order, on a daemon thread. The server accepts requests
+  and /health answers meanwhile.
+* mark(phase) records seconds since the process started. There are marks for
+  "imports" (module imports done), "startup" (server started) and "warm"
+  (all steps finished).
+* readiness() backs /ready, which answers 503 until every step has finished.
+  A failed step is reported with its error but does not keep the process
+  unready; /health stays a plain liveness check.
+
+For the import-time breakdown of a module (python -X importtime, grouped by
+top-level package):
+
+  python warmup.py app [--top 15]
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+
+def _process_start() -> float:
+    """Wall-clock start of this process (Linux /proc), else the time of this import."""
+    try:
+        with open("/proc/self/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+PROCESS_START = _process_start()
+
+_marks: Dict[str, float] = {}
+_steps: List[Tuple[str, Callable[[], Any]]] = []
+_results: Dict[str, Dict[str, Any]] = {}
+_lock = threading.Lock()
+_started = False
+_done = threading.Event()
+
+
+def mark(phase: str) -> None:
+    """Record when `phase` was reached, in seconds since the process started (first call wins)."""
+    _marks.setdefault(phase, round(time.time() - PROCESS_START, 3))
+
+
+def register(name: str, fn: Callable[[], Any]) -> None:
+    """Add a warm-up step; registering the same name twice keeps the first."""
+    with _lock:
+        if all(existing != name for existing, _ in _steps):
+            _steps.append((name, fn))
+
+
+def _run() -> None:
+    for name, fn in list(_steps):
+        started = time.perf_counter()
+        try:
+            fn()
+            _results[name] = {"ok": True, "secs": round(time.perf_counter() - started, 3)}
+        except Exception as e:
+            _results[name] = {"ok": False, "secs": round(time.perf_counter() - started, 3), "error": str(e)}
+            print(f"Warm-up step {name} failed: {e}")
+    mark("warm")
+    _done.set()
+    print(f"Warm-up finished {_marks['warm']:.2f}s after process start")
+
+
+def start() -> None:
+    """Run the registered steps on a background thread, once per process."""
+    global _started
+    mark("startup")
+    with _lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=_run, name="warm-up", daemon=True).start()
+
+
+def is_ready() -> bool:
+    return _done.is_set()
+
+
+def readiness() -> Dict[str, Any]:
+    """Body of /ready: warm-up state, per-step timings and startup phases."""
+    ready = _done.is_set()
+    return {
+        "ready": ready,
+        "status": "ready" if ready else ("warming" if _started else "starting"),
+        "uptime_secs": round(time.time() - PROCESS_START, 3),
+        "startup": dict(_marks),
+        "steps": {name: _results.get(name, {"ok": None}) for name, _ in _steps},
+    }
+
+
+# ---- Import-time breakdown ----
+
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_breakdown(module: str, cwd: str = ".") -> Tuple[float, List[Tuple[str, float, float]]]:
+    """
+    Import `module` in a fresh interpreter with -X importtime. Returns its
+    total import time and (package, self secs, first-import cumulative secs)
+    per top-level package, slowest first.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed")
+
+    total = 0.0
+    packages: Dict[str, List[float]] = {}
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = int(match[1]), int(match[2]), len(match[3]), match[4]
+        if name == module:
+            total = cumulative_us / 1e6
+            continue
+        entry = packages.setdefault(name.split(".")[0], [0.0, 0.0, indent])
+        entry[0] += self_us / 1e6
+        if indent <= entry[2]:
+            # The outermost import of the package carries its whole subtree
+            entry[1], entry[2] = max(entry[1], cumulative_us / 1e6), indent
+    ranked = sorted(((name, s, c) for name, (s, c, _) in packages.items()), key=lambda p: p[1], reverse=True)
+    return total, ranked
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time breakdown of an API module")
+    parser.add_argument("module", nargs="?", default="app")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--cwd", default=".")
+    args = parser.parse_args()
+
+    total, ranked = import_breakdown(args.module, args.cwd)
+    print(f"import {args.module}: {total * 1000:.0f} ms")
+    print(f"{'package':<28}{'self ms':>10}{'cumulative ms':>16}")
+    for name, self_secs, cumulative in ranked[:args.top]:
+        print(f"{name:<28}{self_secs * 1000:>10.1f}{cumulative * 1000:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
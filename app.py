@@ -3,19 +3,39 @@
 CompanyAI GPT API - Integrated FastAPI application for Render deployment
 """
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, Response
 import psycopg
-from psycopg.rows import dict_row
+from pydantic import BaseModel
 from typing import List, Optional
 import os
+import sys
 import csv
 from dotenv import load_dotenv
 from urllib.parse import quote_plus
 
 load_dotenv()
 
+# Shared modules live next to the other services in CompanyAI/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "CompanyAI"))
+
+from data_versions import ensure_data_versions
+from db_pool import ConnectionPool
+from domain_keys import canonical_domain, ensure_domain_key
+from fast_json import FastJSONResponse, float_numerics, records
+from http_cache import CompressionMiddleware, db_validators, not_modified, validators
+import metrics
+from projection import REACHED_OUT_FIELDS, SEARCH_FIELDS, check_format, parse_fields, result, select_list
+from serving_cache import Section, ServingCache
+from stats_snapshot import get_stats_snapshot, read_stats_snapshot, refresh_stats_snapshot_safely
+import warmup
+
+# The CSV import stack (numpy) and the enrichment client (httpx) are imported
+# by the endpoints that use them, and ahead of time by the background warm-up,
+# so they stay off the cold-start path.
+warmup.mark("imports")
+
 # Create the FastAPI app
 app = FastAPI(
     title="CompanyAI GPT API", 
@@ -31,9 +51,11 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(metrics.MetricsMiddleware, name="app", router=app.router)
 
 # Database connection
-def get_db_connection():
+def open_db_connection():
     # Try using the exact External Database URL first
     external_url = os.getenv("EXTERNAL_DATABASE_URL")
     if external_url:
@@ -89,6 +111,44 @@ def get_db_connection():
         print(f"Password starts with: {password[:10]}...")
         raise
 
+# Connections are reused across requests; conn.close() returns them to the pool
+db_pool = ConnectionPool(open_db_connection)
+
+def get_db_connection():
+    return db_pool.getconn()
+
+def _warm_stats_snapshot():
+    conn = get_db_connection()
+    try:
+        get_stats_snapshot(conn)
+    finally:
+        conn.close()
+
+def _warm_imports():
+    import csv_import, csv_upload, import_jobs, similarweb_enrich
+
+# Catalog, stats and popular query results; snapshotted to disk and
+# reconciled with the database in the background (serving_cache.py)
+serving_cache = ServingCache("app")
+serving_cache.register(Section("stats", ("stats_snapshots",), read_stats_snapshot))
+
+metrics.register_pool("app", db_pool)
+metrics.register_cache(serving_cache)
+
+def _warm_serving_cache():
+    from company_catalog import CATALOG_SECTION
+    serving_cache.register(CATALOG_SECTION)
+    serving_cache.warm(get_db_connection)
+
+warmup.register("db_pool", db_pool.fill)
+warmup.register("stats_snapshot", _warm_stats_snapshot)
+warmup.register("serving_cache", _warm_serving_cache)
+warmup.register("deferred_imports", _warm_imports)
+
+@app.on_event("startup")
+async def start_warmup():
+    warmup.start()
+
 @app.get("/", response_class=HTMLResponse)
 async def root():
     """Root endpoint with API documentation"""
@@ -146,22 +206,33 @@ async def search_companies_gpt(
     limit: int = Query(10, description="Number of results to return"),
     min_visits: Optional[int] = Query(None, description="Minimum monthly visits"),
     vertical: Optional[str] = Query(None, description="Filter by vertical"),
-    location: Optional[str] = Query(None, description="Filter by location")
+    location: Optional[str] = Query(None, description="Filter by location"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. name,website,monthly_visits"),
+    format: str = Query("rows", description="rows, or compact for one value array per field"),
+    max_description: Optional[int] = Query(None, ge=1, description="Truncate descriptions to this many characters")
 ):
     """Search companies for GPT integration"""
+    columns = parse_fields(fields, SEARCH_FIELDS)
+    check_format(format)
+    cached = serving_cache.query(
+        ("search", query, limit, min_visits, vertical, location, columns, format, max_description), "catalog",
+        lambda catalog: result(columns, catalog.search(query, limit, min_visits, vertical, location, columns),
+                               format, max_description),
+    )
+    if cached is not None:
+        return FastJSONResponse({"success": True, **cached})
+    
     try:
         conn = get_db_connection()
-        cursor = conn.cursor(row_factory=dict_row)
+        cursor = float_numerics(conn.cursor())
         
-        # Build the query dynamically
-        sql = """
-            SELECT 
-                name, website, vertical, subvertical, description, location,
-                monthly_visits, unique_visitors, pages_per_visit, adsense_enabled
+        # Build the query dynamically; only the requested columns are read
+        select, params = select_list(columns, max_description)
+        sql = f"""
+            SELECT {select}
             FROM all_companies 
             WHERE 1=1
         """
-        params = []
         
         # Add text search
         if query:
@@ -198,11 +269,7 @@ async def search_companies_gpt(
         cursor.close()
         conn.close()
         
-        return {
-            "success": True,
-            "count": len(results),
-            "companies": results
-        }
+        return FastJSONResponse({"success": True, **result(columns, results, format)})
         
     except Exception as e:
         return {
@@ -214,22 +281,31 @@ async def search_companies_gpt(
 @app.get("/gpt/companies/reached-out")
 async def get_reached_out_companies_gpt(
     limit: int = Query(20, description="Number of results to return"),
-    vertical: Optional[str] = Query(None, description="Filter by vertical")
+    vertical: Optional[str] = Query(None, description="Filter by vertical"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. name,website,reached_out_date"),
+    format: str = Query("rows", description="rows, or compact for one value array per field"),
+    max_description: Optional[int] = Query(None, ge=1, description="Truncate descriptions to this many characters")
 ):
     """Get companies that have been reached out to"""
+    columns = parse_fields(fields, REACHED_OUT_FIELDS)
+    check_format(format)
+    cached = serving_cache.query(
+        ("reached-out", limit, vertical, columns, format, max_description), "catalog",
+        lambda catalog: result(columns, catalog.reached_out(limit, vertical, columns), format, max_description),
+    )
+    if cached is not None:
+        return FastJSONResponse({"success": True, **cached})
+    
     try:
         conn = get_db_connection()
-        cursor = conn.cursor(row_factory=dict_row)
+        cursor = float_numerics(conn.cursor())
         
-        sql = """
-            SELECT 
-                name, website, vertical, subvertical, description, location,
-                monthly_visits, unique_visitors, pages_per_visit, adsense_enabled,
-                reached_out_date, response_status
+        select, params = select_list(columns, max_description)
+        sql = f"""
+            SELECT {select}
             FROM all_companies 
             WHERE reached_out = true
         """
-        params = []
         
         if vertical:
             sql += " AND LOWER(vertical) = LOWER(%s)"
@@ -244,11 +320,7 @@ async def get_reached_out_companies_gpt(
         cursor.close()
         conn.close()
         
-        return {
-            "success": True,
-            "count": len(results),
-            "companies": results
-        }
+        return FastJSONResponse({"success": True, **result(columns, results, format)})
         
     except Exception as e:
         return {
@@ -258,46 +330,45 @@ async def get_reached_out_companies_gpt(
         }
 
 @app.get("/gpt/companies/stats")
-async def get_database_stats_gpt():
-    """Get database statistics"""
+async def get_database_stats_gpt(request: Request):
+    """Get database statistics from the precomputed snapshot"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(row_factory=dict_row)
-        
-        # Total companies
-        cursor.execute("SELECT COUNT(*) as total FROM all_companies")
-        total_companies = cursor.fetchone()["total"]
-        
-        # Companies by vertical
-        cursor.execute("""
-            SELECT vertical, COUNT(*) as count 
-            FROM all_companies 
-            WHERE vertical IS NOT NULL 
-            GROUP BY vertical 
-            ORDER BY count DESC
-        """)
-        vertical_stats = cursor.fetchall()
-        
-        # Companies reached out to
-        cursor.execute("SELECT COUNT(*) as count FROM all_companies WHERE reached_out = true")
-        reached_out_count = cursor.fetchone()["count"]
-        
-        # Average monthly visits
-        cursor.execute("SELECT AVG(monthly_visits) as avg_visits FROM all_companies WHERE monthly_visits > 0")
-        avg_visits = cursor.fetchone()["avg_visits"]
-        
-        cursor.close()
-        conn.close()
+        watermark = serving_cache.watermark("stats")
+        snapshot = serving_cache.get("stats")
+        if snapshot is None or watermark is None:
+            conn = get_db_connection()
+            try:
+                headers = db_validators(request, conn, ("stats_snapshots",))
+                unchanged = not_modified(request, headers)
+                if unchanged is not None:
+                    return unchanged
+                snapshot = get_stats_snapshot(conn)
+            finally:
+                conn.close()
+        else:
+            headers = validators(request, *watermark)
+            unchanged = not_modified(request, headers)
+            if unchanged is not None:
+                return unchanged
+        
+        if snapshot is None:
+            return {
+                "success": False,
+                "error": "Stats snapshot is being computed",
+                "message": "Failed to get database stats"
+            }
         
-        return {
+        stats = snapshot["stats"]
+        return FastJSONResponse({
             "success": True,
             "stats": {
-                "total_companies": total_companies,
-                "reached_out_count": reached_out_count,
-                "average_monthly_visits": round(avg_visits, 2) if avg_visits else 0,
-                "vertical_distribution": vertical_stats
-            }
-        }
+                "total_companies": stats["total_companies"],
+                "reached_out_count": stats["reached_out_count"],
+                "average_monthly_visits": stats["average_monthly_visits"],
+                "vertical_distribution": stats["vertical_distribution"]
+            },
+            "computed_at": snapshot["computed_at"].isoformat()
+        }, headers=headers)
         
     except Exception as e:
         return {
@@ -308,17 +379,44 @@ async def get_database_stats_gpt():
 
 @app.get("/companies")
 async def get_all_companies(
+    request: Request,
     limit: int = Query(50, description="Number of companies to return"),
     offset: int = Query(0, description="Number of companies to skip")
 ):
     """Get all companies with pagination"""
+    watermark = serving_cache.watermark("catalog")
+    headers = validators(request, *watermark) if watermark is not None else {}
+    unchanged = not_modified(request, headers)
+    if unchanged is not None:
+        return unchanged
+    cached = serving_cache.query(
+        ("companies", limit, offset), "catalog",
+        lambda catalog: catalog.page(limit, offset),
+    )
+    if cached is not None:
+        total_count, rows = cached
+        companies = [dict(zip(SEARCH_FIELDS, row)) for row in rows]
+        return FastJSONResponse({
+            "success": True,
+            "total_companies": total_count,
+            "returned_companies": len(companies),
+            "limit": limit,
+            "offset": offset,
+            "companies": companies
+        }, headers=headers)
+    
     try:
         conn = get_db_connection()
-        cursor = conn.cursor(row_factory=dict_row)
+        headers = db_validators(request, conn, ("all_companies",))
+        unchanged = not_modified(request, headers)
+        if unchanged is not None:
+            conn.close()
+            return unchanged
+        cursor = float_numerics(conn.cursor())
         
         # Get total count
         cursor.execute("SELECT COUNT(*) as total FROM all_companies")
-        total_count = cursor.fetchone()["total"]
+        total_count = cursor.fetchone()[0]
         
         # Get companies with pagination
         sql = """
@@ -331,19 +429,19 @@ async def get_all_companies(
         """
         
         cursor.execute(sql, (limit, offset))
-        companies = cursor.fetchall()
+        companies = records(cursor)
         
         cursor.close()
         conn.close()
         
-        return {
+        return FastJSONResponse({
             "success": True,
             "total_companies": total_count,
             "returned_companies": len(companies),
             "limit": limit,
             "offset": offset,
             "companies": companies
-        }
+        }, headers=headers)
         
     except Exception as e:
         return {
@@ -352,6 +450,51 @@ async def get_all_companies(
             "message": "Failed to get companies"
         }
 
+MAX_ENRICH_DOMAINS = int(os.getenv("MAX_ENRICH_DOMAINS", "100"))
+
+class EnrichRequest(BaseModel):
+    domains: List[str]
+    force: bool = False
+
+@app.post("/companies/enrich")
+async def enrich_companies(request: EnrichRequest, background_tasks: BackgroundTasks):
+    """Fetch Similarweb visits for companies without metrics (cached) and store them"""
+    if not request.domains:
+        raise HTTPException(status_code=400, detail="No domains given")
+    if len(request.domains) > MAX_ENRICH_DOMAINS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_ENRICH_DOMAINS} domains per request")
+    
+    from similarweb_enrich import EnrichmentError, get_enrichment_client
+    
+    try:
+        result = await get_enrichment_client().enrich(get_db_connection, request.domains, force=request.force)
+    except EnrichmentError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    if result["visits_updated"]:
+        background_tasks.add_task(refresh_stats_snapshot_safely, get_db_connection)
+        background_tasks.add_task(serving_cache.wake)
+    return {"success": True, **result}
+
+@app.on_event("shutdown")
+async def shutdown_clients():
+    if "similarweb_enrich" in sys.modules:
+        await sys.modules["similarweb_enrich"].close_enrichment_client()
+    serving_cache.close()
+    db_pool.close()
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 503 until the background warm-up has finished"""
+    return JSONResponse(status_code=200 if warmup.is_ready() else 503,
+                        content={**warmup.readiness(), "db_pool": db_pool.stats(),
+                                 "serving_cache": serving_cache.stats()})
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus metrics (metrics.py)"""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/gpt/health")
 async def gpt_health():
     """GPT health check endpoint"""
@@ -364,15 +507,18 @@ async def gpt_health():
             "/gpt/companies/reached-out", 
             "/gpt/companies/stats",
             "/gpt/health",
+            "/ready",
+            "/companies/enrich",
             "/setup-database",
             "/populate-sample-data",
             "/import-csv-data",
+            "/imports",
             "/debug-csv-files"
         ]
     }
 
 @app.get("/setup-database")
-async def setup_database():
+async def setup_database(background_tasks: BackgroundTasks):
     """Create the all_companies table if it doesn't exist"""
     try:
         conn = get_db_connection()
@@ -400,12 +546,17 @@ async def setup_database():
             us_percentage NUMERIC(5,2),
             reached_out BOOLEAN DEFAULT FALSE,
             reached_out_date TIMESTAMP,
-            response_status VARCHAR(50)
+            response_status VARCHAR(50),
+            domain_key TEXT,
+            import_hash BYTEA
         );
+        CREATE UNIQUE INDEX all_companies_domain_key_key ON all_companies (domain_key);
         """
         
         cursor.execute(create_table_sql)
         conn.commit()
+        # Version the new table right away so caches and ETags see its changes
+        ensure_data_versions(conn, ("all_companies",))
         
         # Check if table was created
         cursor.execute("SELECT COUNT(*) as count FROM all_companies")
@@ -414,6 +565,9 @@ async def setup_database():
         cursor.close()
         conn.close()
         
+        background_tasks.add_task(refresh_stats_snapshot_safely, get_db_connection)
+        background_tasks.add_task(serving_cache.wake)
+        
         return {
             "success": True,
             "message": "Database table recreated successfully with updated schema!",
@@ -429,7 +583,7 @@ async def setup_database():
         }
 
 @app.get("/populate-sample-data")
-async def populate_sample_data():
+async def populate_sample_data(background_tasks: BackgroundTasks):
     """Add sample company data to the database"""
     try:
         conn = get_db_connection()
@@ -519,12 +673,15 @@ async def populate_sample_data():
         ]
         
         # Insert sample data
+        ensure_domain_key(conn, "all_companies")
         insert_sql = """
         INSERT INTO all_companies 
         (name, website, vertical, subvertical, description, location, 
          monthly_visits, unique_visitors, visit_duration, pages_per_visit, 
-         adsense_enabled, us_percentage, reached_out, reached_out_date, response_status)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+         adsense_enabled, us_percentage, reached_out, reached_out_date, response_status,
+         domain_key)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (domain_key) DO NOTHING
         """
         
         inserted_count = 0
@@ -545,9 +702,10 @@ async def populate_sample_data():
                     company["us_percentage"],
                     company["reached_out"],
                     company.get("reached_out_date"),
-                    company.get("response_status")
+                    company.get("response_status"),
+                    canonical_domain(company["website"])
                 ))
-                inserted_count += 1
+                inserted_count += cursor.rowcount
             except Exception as insert_error:
                 print(f"Error inserting {company['name']}: {insert_error}")
                 continue
@@ -561,6 +719,9 @@ async def populate_sample_data():
         cursor.close()
         conn.close()
         
+        background_tasks.add_task(refresh_stats_snapshot_safely, get_db_connection)
+        background_tasks.add_task(serving_cache.wake)
+        
         return {
             "success": True,
             "message": f"Sample data populated successfully!",
@@ -575,177 +736,54 @@ async def populate_sample_data():
             "message": "Failed to populate sample data"
         }
 
+DEFAULT_CSV_FILES = [
+    "CompanyAI/AI_Andrew_Outreach_List.csv",
+    "CompanyAI/SW_List_Andrew.csv"
+]
+
+class ImportJobRequest(BaseModel):
+    files: Optional[List[str]] = None
+    force: bool = False
+
 @app.get("/import-csv-data")
-async def import_csv_data():
-    """Import company data from CSV files"""
+async def import_csv_data(
+    background_tasks: BackgroundTasks,
+    force: bool = Query(False, description="Re-import files and rows even if unchanged since the last import")
+):
+    """Import company data from CSV files using the COPY-based bulk loader"""
+    from csv_import import bulk_import_csv
+    
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
         
-        imported_count = 0
-        error_count = 0
-        csv_files = [
-            "CompanyAI/AI_Andrew_Outreach_List.csv",
-            "CompanyAI/SW_List_Andrew.csv"
-        ]
+        csv_files = DEFAULT_CSV_FILES
         
         for csv_file in csv_files:
             if not os.path.exists(csv_file):
                 print(f"CSV file not found: {csv_file}")
-                continue
-                
-            print(f"Processing CSV file: {csv_file}")
-            
-            try:
-                with open(csv_file, 'r', encoding='utf-8') as file:
-                    csv_reader = csv.DictReader(file)
-                    
-                    for row_num, row in enumerate(csv_reader, 1):
-                        try:
-                            # Map CSV columns to database columns based on actual CSV structure
-                            company_data = {
-                                "name": row.get("Company Name", row.get("name", row.get("Name", row.get("company_name", "")))),
-                                "website": row.get("Website", row.get("Domain", row.get("website", row.get("domain", "")))),
-                                "vertical": row.get("Vertical", row.get("vertical", row.get("category", ""))),
-                                "subvertical": row.get("Subvertical", row.get("subvertical", "")),
-                                "description": row.get("Description", row.get("description", "")),
-                                "location": row.get("Location", row.get("location", "")),
-                                "monthly_visits": 0,
-                                "unique_visitors": 0,
-                                "visit_duration": row.get("Visit Duration", row.get("visit_duration", "")),
-                                "pages_per_visit": 0.0,
-                                "adsense_enabled": False,
-                                "us_percentage": 0.0,
-                                "reached_out": False,
-                                "reached_out_date": None,
-                                "response_status": ""
-                            }
-                            
-                            # Safely parse numeric fields
-                            try:
-                                monthly_visits_str = row.get("Monthly Visits", row.get("monthly_visits", "0"))
-                                if monthly_visits_str and str(monthly_visits_str).strip():
-                                    # Handle cases like "7,000,000" or "1,175,754,959.88"
-                                    monthly_visits_str = str(monthly_visits_str).replace(",", "")
-                                    if "." in monthly_visits_str:
-                                        # Handle decimal numbers by converting to float first
-                                        company_data["monthly_visits"] = int(float(monthly_visits_str))
-                                    else:
-                                        company_data["monthly_visits"] = int(monthly_visits_str)
-                                else:
-                                    company_data["monthly_visits"] = 0
-                            except Exception as e:
-                                print(f"Error parsing monthly_visits '{monthly_visits_str}': {e}")
-                                company_data["monthly_visits"] = 0
-                            
-                            try:
-                                unique_visitors_str = row.get("Unique Visitors", row.get("unique_visitors", "0"))
-                                if unique_visitors_str and str(unique_visitors_str).strip():
-                                    # Handle cases like "80,117,090.18"
-                                    unique_visitors_str = str(unique_visitors_str).replace(",", "")
-                                    if "." in unique_visitors_str:
-                                        company_data["unique_visitors"] = int(float(unique_visitors_str))
-                                    else:
-                                        company_data["unique_visitors"] = int(unique_visitors_str)
-                                else:
-                                    company_data["unique_visitors"] = 0
-                            except Exception as e:
-                                print(f"Error parsing unique_visitors '{unique_visitors_str}': {e}")
-                                company_data["unique_visitors"] = 0
-                            
-                            try:
-                                pages_per_visit_str = row.get("Pages / Visit", row.get("pages_per_visit", "0"))
-                                if pages_per_visit_str and str(pages_per_visit_str).strip():
-                                    company_data["pages_per_visit"] = float(pages_per_visit_str)
-                                else:
-                                    company_data["pages_per_visit"] = 0.0
-                            except Exception as e:
-                                print(f"Error parsing pages_per_visit '{pages_per_visit_str}': {e}")
-                                company_data["pages_per_visit"] = 0.0
-                            
-                            try:
-                                us_percentage_str = row.get("US %", row.get("us_percentage", "0"))
-                                if us_percentage_str and str(us_percentage_str).strip():
-                                    us_percentage_str = str(us_percentage_str).replace("%", "").replace(",", "")
-                                    company_data["us_percentage"] = float(us_percentage_str)
-                                else:
-                                    company_data["us_percentage"] = 0.0
-                            except Exception as e:
-                                print(f"Error parsing us_percentage '{us_percentage_str}': {e}")
-                                company_data["us_percentage"] = 0.0
-                            
-                            # Parse boolean fields
-                            adsense_str = row.get("AdSense", row.get("adsense_enabled", ""))
-                            company_data["adsense_enabled"] = str(adsense_str).lower() in ["true", "yes", "1"]
-                            
-                            # Skip if no name or website
-                            if not company_data["name"] or not company_data["website"]:
-                                continue
-                            
-                            # Insert into database
-                            insert_sql = """
-                            INSERT INTO all_companies 
-                            (name, website, vertical, subvertical, description, location, 
-                             monthly_visits, unique_visitors, visit_duration, pages_per_visit, 
-                             adsense_enabled, us_percentage, reached_out, reached_out_date, response_status)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                            ON CONFLICT (website) DO NOTHING
-                            """
-                            
-                            cursor.execute(insert_sql, (
-                                company_data["name"],
-                                company_data["website"],
-                                company_data["vertical"],
-                                company_data["subvertical"],
-                                company_data["description"],
-                                company_data["location"],
-                                company_data["monthly_visits"],
-                                company_data["unique_visitors"],
-                                company_data["visit_duration"],
-                                company_data["pages_per_visit"],
-                                company_data["adsense_enabled"],
-                                company_data["us_percentage"],
-                                company_data["reached_out"],
-                                company_data["reached_out_date"],
-                                company_data["response_status"]
-                            ))
-                            
-                            imported_count += 1
-                            
-                            # Commit every 50 records to avoid memory issues
-                            if imported_count % 50 == 0:
-                                conn.commit()
-                                print(f"Imported {imported_count} companies so far...")
-                                
-                        except Exception as row_error:
-                            error_count += 1
-                            print(f"Error processing row {row_num} in {csv_file}: {row_error}")
-                            print(f"Row data: {dict(row)}")
-                            if error_count > 500:  # Increased error limit
-                                print(f"Stopping due to too many errors ({error_count})")
-                                break
-                            continue
-                            
-            except Exception as file_error:
-                print(f"Error reading file {csv_file}: {file_error}")
-                continue
         
-        conn.commit()
+        stats = bulk_import_csv(conn, [f for f in csv_files if os.path.exists(f)], force=force)
         
         # Get final count
+        cursor = conn.cursor()
         cursor.execute("SELECT COUNT(*) as count FROM all_companies")
         total_count = cursor.fetchone()[0]
         
         cursor.close()
         conn.close()
         
+        background_tasks.add_task(refresh_stats_snapshot_safely, get_db_connection)
+        background_tasks.add_task(serving_cache.wake)
+        
         return {
             "success": True,
             "message": f"CSV data imported successfully!",
-            "imported_companies": imported_count,
+            "imported_companies": stats.rows_loaded,
             "total_companies": total_count,
-            "error_count": error_count,
-            "processed_files": [f for f in csv_files if os.path.exists(f)]
+            "error_count": stats.parse_errors + stats.rows_rejected,
+            "processed_files": stats.processed_files,
+            "unchanged_files": stats.files_unchanged,
+            "import_stats": stats.as_dict()
         }
         
     except Exception as e:
@@ -755,14 +793,104 @@ async def import_csv_data():
             "message": "Failed to import CSV data"
         }
 
+def resolve_import_files(files: List[str]) -> List[str]:
+    """Validate requested CSV paths; only files inside this deployment are allowed"""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    resolved = []
+    for f in files:
+        path = os.path.realpath(os.path.join(base_dir, f))
+        if not path.startswith(base_dir + os.sep) or not path.lower().endswith(".csv"):
+            raise HTTPException(status_code=400, detail=f"Invalid import file: {f}")
+        if not os.path.exists(path):
+            raise HTTPException(status_code=404, detail=f"CSV file not found: {f}")
+        resolved.append(path)
+    return resolved
+
+@app.post("/imports", status_code=202)
+async def start_import_job(request: Optional[ImportJobRequest] = None):
+    """Start a background CSV import job and return its id immediately"""
+    files = request.files if request and request.files else [f for f in DEFAULT_CSV_FILES if os.path.exists(f)]
+    force = request.force if request else False
+    sources = resolve_import_files(files)
+    if not sources:
+        raise HTTPException(status_code=400, detail="No CSV files to import")
+    from import_jobs import create_job, submit_import_job
+    
+    conn = get_db_connection()
+    try:
+        job = create_job(conn, sources, force=force)
+    finally:
+        conn.close()
+    
+    submit_import_job(get_db_connection, job["job_id"])
+    return {"success": True, "job": job}
+
+@app.post("/imports/upload")
+async def upload_import(request: Request):
+    """Stream a multipart CSV upload (field 'file') into all_companies while it is received"""
+    from csv_upload import UploadError, stream_upload_import
+    
+    try:
+        job = await stream_upload_import(request, get_db_connection)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": job["status"] == "completed", "job": job}
+
+@app.get("/imports/{job_id}")
+async def get_import_job(job_id: int):
+    """Report progress of an import job: rows parsed/loaded/rejected and throughput"""
+    from import_jobs import get_job
+    
+    conn = get_db_connection()
+    try:
+        job = get_job(conn, job_id)
+    finally:
+        conn.close()
+    
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Import job {job_id} not found")
+    return {"success": True, "job": job}
+
+@app.post("/imports/{job_id}/cancel")
+async def cancel_import_job(job_id: int):
+    """Cancel an import job; a running job stops after its current chunk commits"""
+    from import_jobs import cancel_job
+    
+    conn = get_db_connection()
+    try:
+        job = cancel_job(conn, job_id)
+    finally:
+        conn.close()
+    
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Import job {job_id} not found")
+    return {"success": True, "job": job}
+
+@app.post("/imports/{job_id}/resume", status_code=202)
+async def resume_import_job(job_id: int):
+    """Resume a cancelled, failed or orphaned import job from its last committed chunk"""
+    from import_jobs import get_job, reset_job_for_resume, submit_import_job
+    
+    conn = get_db_connection()
+    try:
+        resumed = reset_job_for_resume(conn, job_id)
+        job = get_job(conn, job_id)
+    finally:
+        conn.close()
+    
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Import job {job_id} not found")
+    if not resumed:
+        raise HTTPException(status_code=409, detail=f"Import job {job_id} is {job['status']} and cannot be resumed")
+    
+    submit_import_job(get_db_connection, job_id)
+    return {"success": True, "job": job}
+
 @app.get("/debug-csv-files")
 async def debug_csv_files():
     """Debug endpoint to check CSV files and their structure"""
     try:
-        csv_files = [
-            "CompanyAI/AI_Andrew_Outreach_List.csv",
-            "CompanyAI/SW_List_Andrew.csv"
-        ]
+        csv_files = DEFAULT_CSV_FILES
         
         debug_info = {
             "current_working_directory": os.getcwd(),